@@ -1,19 +1,40 @@
 from antlr4 import *
+from antlr4.Lexer import TokenSource
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
 from llvmlite import ir, binding
 
 import re
 import os
-from typing import Dict, List, Union, Optional, Tuple, Any
-
-from .errors import CompilationError, SemanticError, ParserErrorListener
+import sys
+import linecache
+import time
+from typing import Callable, Dict, Iterator, List, Set, Union, Optional, Tuple, Any
+
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource, --stats 不输出内存峰值
+    resource = None
+
+from .errors import CompilationError, SemanticError, ParserError, ParserErrorListener
 from .symbol_table import SymbolTable
-from .values import TypedValue, const_value, ElementNamedLiteralStructType
-from .elements import ParameterList, DeclarationSpecifiers
+from .values import TypedValue, PendingDeclaration, const_value, ElementNamedLiteralStructType
+from .elements import ParameterList, DeclarationSpecifiers, DeferredFunction
 from .parser.CLexer import CLexer
 from .parser.CParser import CParser
 from .parser.CVisitor import CVisitor
-from preprocessor import preprocess
+from .fast_parser import FastParser
+from .precompiled_header import PrecompiledHeader
+from .ir_cache import IRCache, CachedFunction, CachedBody, STRING_REFERENCE, describe_symbol
+from .dfa_cache import DFACache
+from .syntax_tree import NODE_TYPES, Leaf, Node, Lowering, leaves
+from .token_source import PreprocessorTokenSource, RegexTokenSource
+from preprocessor import preprocess_source, SourceLine, header_prefix, header_cache, MacroTable, LineInputStream
 from preprocessor.errors import MacroError
+from preprocessor.parser.CPreprocessorLexer import CPreprocessorLexer
+from preprocessor.parser.CPreprocessorParser import CPreprocessorParser
 
 double = ir.DoubleType()
 int1 = ir.IntType(1)
@@ -29,11 +50,87 @@ int_types = [int1, int8, int16, int32, int64]
 int32_zero = ir.Constant(int32, 0)
 
 
+class CheckingBuilder(ir.IRBuilder):
+    """
+    只做检查时 (-fsyntax-only) 使用的 IRBuilder.
+
+    指令照常创建, 所以结果的类型和 llvmlite 的类型检查与生成代码时相同, 但不放入基本块.
+    终结指令仍由 IRBuilder 记录在 Block.terminator 中, is_terminated 的判断不受影响.
+    """
+
+    def _insert(self, instr):
+        pass
+
+
 class Visitor(CVisitor):
     """
     语义分析，生成 llvm
     """
 
+    # 只有一个子结点时访问结果就是子结点的访问结果的规则, 转换语法树时被折叠 (见 Lowering)
+    pass_through = (
+        CParser.ExternalDeclarationContext,
+        CParser.StatementContext,
+        CParser.ForInitializationContext,
+        CParser.ForExpressionContext,
+        CParser.TypeNameContext,
+        CParser.TypeSpecifier_1Context,
+        CParser.ConstantExpressionContext,
+        CParser.Expression_1Context,
+        CParser.AssignmentExpression_1Context,
+        CParser.ConditionalExpressionContext,
+        CParser.LogicalOrExpressionContext,
+        CParser.LogicalAndExpressionContext,
+        CParser.InclusiveOrExpression_1Context,
+        CParser.ExclusiveOrExpression_1Context,
+        CParser.AndExpression_1Context,
+        CParser.EqualityExpression_1Context,
+        CParser.RelationalExpression_1Context,
+        CParser.ShiftExpression_1Context,
+        CParser.AdditiveExpression_1Context,
+        CParser.MultiplicativeExpression_1Context,
+        CParser.CastExpression_2Context,
+        CParser.UnaryExpression_1Context,
+        CParser.PostfixExpression_1Context,
+    )
+
+    # 第一个子结点是同一规则的左递归的备选分支, 它们的 visit 方法都最先访问第一个子结点.
+    # 这些结点形成的左侧链用循环访问 (见 visit_left_recursive).
+    # && 和 || 在访问左侧之前就创建了基本块, 不在其中, 它们的链由 _visitLogicalExpression 自己用循环访问
+    left_recursive = (
+        CParser.PostfixExpression_2Context,
+        CParser.PostfixExpression_3Context,
+        CParser.PostfixExpression_4Context,
+        CParser.PostfixExpression_5Context,
+        CParser.PostfixExpression_6Context,
+        CParser.PostfixExpression_7Context,
+        CParser.ArgumentExpressionListContext,
+        CParser.MultiplicativeExpression_2Context,
+        CParser.MultiplicativeExpression_3Context,
+        CParser.MultiplicativeExpression_4Context,
+        CParser.AdditiveExpression_2Context,
+        CParser.AdditiveExpression_3Context,
+        CParser.ShiftExpression_2Context,
+        CParser.ShiftExpression_3Context,
+        CParser.RelationalExpression_2Context,
+        CParser.RelationalExpression_3Context,
+        CParser.RelationalExpression_4Context,
+        CParser.RelationalExpression_5Context,
+        CParser.EqualityExpression_2Context,
+        CParser.EqualityExpression_3Context,
+        CParser.AndExpression_2Context,
+        CParser.ExclusiveOrExpression_2Context,
+        CParser.InclusiveOrExpression_2Context,
+        CParser.Expression_2Context,
+        CParser.PointerContext,
+        CParser.InitDeclaratorListContext,
+        CParser.InitializerListContext,
+        CParser.ParameterListContext,
+        CParser.StructDeclarationListContext,
+        CParser.StructDeclaratorListContext,
+        CParser.EnumeratorListContext,
+    )
+
     def __init__(self, target: str = 'x86_64-pc-linux-gnu'):
         super().__init__()
 
@@ -47,6 +144,8 @@ class Visitor(CVisitor):
 
         # 当前 llvm block 的语句生成器，在任何 visit 后都可能被改变
         self.builder: Optional[ir.IRBuilder] = None
+        # 创建 builder 的类, 只做检查时为 CheckingBuilder
+        self.builder_type: type = ir.IRBuilder
 
         # 用于控制语句的标号
         self.continue_blocks: ir.BasicBlock = []
@@ -73,6 +172,97 @@ class Visitor(CVisitor):
         # 字符串常量表
         self.string_constants: Dict[str, TypedValue] = {}
 
+        # 函数的 IR 缓存, 为 None 时不使用
+        self.ir_cache: Optional[IRCache] = None
+        # 正在生成的函数按首次使用的顺序引用的全局符号和字符串常量 (见 CachedFunction.references)
+        # 以及它能否放入缓存, 见 generate_function
+        self.function_references: Optional[Dict[Tuple[str, Optional[str]], None]] = None
+        self.function_cacheable = False
+
+        # 是否只为可达的函数生成代码, 见 generate_reachable_functions
+        self.lazy_functions = False
+        # 尚未生成函数体的函数定义, 按定义的顺序
+        self.deferred_functions: Dict[str, DeferredFunction] = {}
+        # 声明为 static 的函数
+        self.static_functions: Set[str] = set()
+        # 在函数体之外出现的标识符, 例如全局变量初始值中的函数名
+        self.root_functions: Set[str] = set()
+
+        # 结点类 -> visit 方法, 见 build_dispatch
+        self.dispatch: Dict[type, Callable] = {}
+        self.left_recursive_dispatch: Dict[type, Callable] = {}
+        self.build_dispatch()
+        # 左侧链中已经算出的结点的值, 见 visit_left_recursive
+        self.left_values: Dict[Node, Any] = {}
+
+    def __getstate__(self):
+        # 用于预编译头, 只能在全局作用域下保存
+        state = self.__dict__.copy()
+        del state['target_data']
+        del state['dispatch']
+        del state['left_recursive_dispatch']
+        state['builder'] = None
+        state['ir_cache'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.target_data = binding.create_target_data(self.module.data_layout)
+        self.build_dispatch()
+
+    def build_dispatch(self) -> None:
+        """
+        建立结点类到绑定的 visit 方法的表, 与 Node.accept 的选择相同: 没有对应方法的规则用 visitChildren.
+        left_recursive 中的结点类经过 visit_left_recursive, 原来的方法在 left_recursive_dispatch 中.
+        """
+        self.dispatch = {Leaf: self.visitTerminal}
+        self.left_recursive_dispatch = {}
+        for node_type in NODE_TYPES.values():
+            self.dispatch[node_type] = getattr(self, node_type.visit_name, self.visitChildren)
+        for cls in self.left_recursive:
+            node_type = NODE_TYPES[cls]
+            self.left_recursive_dispatch[node_type] = self.dispatch[node_type]
+            self.dispatch[node_type] = self.visit_left_recursive
+
+    def visit(self, tree):
+        # 直接查表, 不经过 tree.accept 和按名字查找方法
+        method = self.dispatch.get(type(tree))
+        if method is None:
+            # CParser 的 context 等不是 Node 的树
+            return tree.accept(self)
+        return method(tree)
+
+    def visit_left_recursive(self, node: Node):
+        """
+        访问左递归的结点, 例如 a + b + c 中的加法, 参数列表等, 不按链的长度递归.
+
+        先沿第一个子结点向下找到链中最深的结点并访问它, 再由下向上访问链中的各结点;
+        各结点的方法访问第一个子结点时直接得到 left_values 中已经算出的值.
+        """
+        left_values = self.left_values
+        if left_values and node in left_values:
+            return left_values.pop(node)
+        methods = self.left_recursive_dispatch
+        chain = [node]
+        child = node.children[0]
+        while type(child) in methods and child.rule is type(node).rule_type:
+            node = child
+            chain.append(node)
+            child = node.children[0]
+        value = methods[type(node)](node)
+        for i in range(len(chain) - 2, -1, -1):
+            node = chain[i]
+            left_values[chain[i + 1]] = value
+            value = methods[type(node)](node)
+        return value
+
+    def visitChildren(self, node):
+        # 与 ParseTreeVisitor.visitChildren 相同, 返回最后一个子结点的结果, 但子结点也通过 self.visit 访问
+        result = None
+        for child in node.children or ():
+            result = self.visit(child)
+        return result
+
     def is_global_scope(self) -> bool:
         """
         当前是否在全局作用域下.
@@ -94,6 +284,9 @@ class Visitor(CVisitor):
         Returns:
             None
         """
+        # 缓存的 key 由定义之前的全局符号决定
+        cache_key = self.function_cache_key(ctx) if self.ir_cache is not None else None
+
         specifiers: DeclarationSpecifiers = self.visit(ctx.declarationSpecifiers())
         ret_type: ir.Type = specifiers.get_type()
         if ret_type is None:
@@ -104,13 +297,14 @@ class Visitor(CVisitor):
         parameter_list: ParameterList
 
         # 判断重定义，存储函数
+        self.materialize(function_name)
         if function_name in self.functions:
             llvm_function = self.functions[function_name]
             if parameter_list.calling_convention and parameter_list.calling_convention != llvm_function.calling_convention:
                 raise SemanticError("Calling convention not identical: "
                                     f"previous {llvm_function.calling_convention} "
                                     f"new {parameter_list.calling_convention}", ctx)
-            if len(llvm_function.blocks) > 0:
+            if len(llvm_function.blocks) > 0 or function_name in self.deferred_functions:
                 raise SemanticError('函数重定义: ' + function_name, ctx)
         else:
             llvm_function = ir.Function(self.module, function_type, name=function_name)
@@ -127,12 +321,48 @@ class Visitor(CVisitor):
             typ, name = parameter_list[i]
             llvm_function.args[i].name = name
 
+        if specifiers.is_static():
+            self.static_functions.add(function_name)
+        if self.lazy_functions:
+            # 只记录函数体中的标识符, 函数体在确定可达之后才生成
+            self.functions[function_name] = llvm_function
+            self.deferred_functions[function_name] = DeferredFunction(
+                ctx, llvm_function, parameter_list, cache_key,
+                {leaf.text for leaf in leaves(ctx.compoundStatement()) if leaf.type == CParser.Identifier},
+                self.symbol_table.checkpoint())
+            return
+        self.generate_function(ctx, llvm_function, parameter_list, cache_key)
+
+    def generate_function(self, ctx: CParser.FunctionDefinitionContext, llvm_function: ir.Function,
+                          parameter_list: ParameterList, cache_key: Optional[str]) -> None:
+        """
+        生成已处理函数头的函数定义的函数体.
+
+        Args:
+            ctx (CParser.FunctionDefinitionContext): 函数定义
+            llvm_function (ir.Function): 函数
+            parameter_list (ParameterList): 参数列表
+            cache_key (Optional[str]): 函数在 IR 缓存中的 key, 不使用缓存时为 None
+
+        Returns:
+            None
+        """
+        function_name = llvm_function.name
+        if cache_key is not None:
+            cached = self.ir_cache.get(cache_key)
+            if cached is not None:
+                self.reuse_function(llvm_function, cached)
+                self.functions[function_name] = llvm_function
+                return
+            self.function_references = {}
+            self.function_cacheable = True
+
         # 函数 block
         alloca_block: ir.Block = llvm_function.append_basic_block(name=f'{function_name}.entry')
         block: ir.Block = llvm_function.append_basic_block(name=f'{function_name}.code')
         self.functions[function_name] = llvm_function
 
-        self.builder = ir.IRBuilder(block)
+        self.builder = self.builder_type(block)
 
         # 进入函数作用域
         self.current_function = llvm_function
@@ -160,12 +390,123 @@ class Visitor(CVisitor):
                 self.builder.ret_void()
 
         # 处理完毕，退出函数作用域
-        ir.IRBuilder(alloca_block).branch(block)
+        self.builder_type(alloca_block).branch(block)
         self.current_function = ''
         self.builder = None
         self.symbol_table.quit_scope()
+
+        if cache_key is not None:
+            if self.function_cacheable:
+                buf = []
+                llvm_function.descr_body(buf)
+                self.ir_cache.put(cache_key, CachedFunction(''.join(buf), list(self.function_references)))
+            self.function_references = None
+            self.function_cacheable = False
         return
 
+    def function_cache_key(self, ctx: CParser.FunctionDefinitionContext) -> str:
+        """
+        函数定义在 IR 缓存中的 key, 见 token_cache_key.
+        """
+        return self.token_cache_key(leaves(ctx))
+
+    def skip_function_body(self, tokens: List[Token]) -> bool:
+        """
+        FastParser 的 skip_body: 函数定义在 IR 缓存中时不需要分析函数体.
+        只能在流式编译中使用, 此时分析到一个函数定义时它之前的声明都已经处理过了.
+        """
+        return self.token_cache_key(tokens) in self.ir_cache.entries
+
+    def token_cache_key(self, tokens: List[Union[Token, Leaf]]) -> str:
+        """
+        由函数定义的全部记号得到它在 IR 缓存中的 key: 包括各记号, 以及其中的标识符在全局作用域中对应的符号的描述.
+        """
+        identifiers = {token.text: None for token in tokens if token.type == CParser.Identifier}
+        symbols = []
+        for identifier in identifiers:
+            symbols.append(identifier)
+            # 尚未加入模块的声明也不在这里加入, 标识符可能只是函数中的局部变量
+            symbols.append(describe_symbol(self.symbol_table.get_item(identifier)))
+            symbols.append(describe_symbol(self.symbol_table.get_item('struct ' + identifier)))
+        return self.ir_cache.make_key((token.text for token in tokens), symbols)
+
+    def generate_reachable_functions(self) -> Tuple[int, int]:
+        """
+        为延迟的函数定义中可达的函数生成函数体, 从模块中删除其余的函数.
+
+        起点是非 static 的函数 (包括 main) 和在函数体之外出现的函数, 例如全局变量初始值中的函数指针;
+        函数体中出现的函数名是调用图中的边. 局部变量与函数同名时也被当作边, 只会多生成一些函数.
+        不可达的函数体不生成代码, 其中的语义错误也不会报告.
+        函数体中的名字按定义函数时的全局作用域解析, 之后才声明的名字不可见.
+
+        Returns:
+            Tuple[int, int]: 生成和删除的函数数
+        """
+        deferred = self.deferred_functions
+        stack = [name for name in deferred if name not in self.static_functions or name in self.root_functions]
+        reachable = set(stack)
+        while stack:
+            for name in deferred[stack.pop()].references:
+                if name in deferred and name not in reachable:
+                    reachable.add(name)
+                    stack.append(name)
+        # 按定义的顺序生成, 每个函数体只能看到定义之前的全局名字
+        for name, function in deferred.items():
+            if name in reachable:
+                self.symbol_table.global_limit = function.checkpoint
+                try:
+                    self.generate_function(function.ctx, function.llvm_function, function.parameter_list,
+                                           function.cache_key)
+                finally:
+                    self.symbol_table.global_limit = None
+            else:
+                del self.module.globals[name]
+        self.deferred_functions = {}
+        return len(reachable), len(deferred) - len(reachable)
+
+    def materialize(self, identifier: str) -> Any:
+        """
+        取得符号表中的标识符, 尚未加入模块的外部声明 (PendingDeclaration) 此时加入模块.
+
+        Args:
+            identifier (str): 标识符
+
+        Returns:
+            Any: 符号表中的项, 不存在时为 None
+        """
+        item = self.symbol_table.get_item(identifier)
+        if self.function_references is not None and \
+                (isinstance(item, PendingDeclaration) or isinstance(getattr(item, 'ir_value', None), ir.GlobalValue)):
+            self.function_references[(identifier, None)] = None
+        if not isinstance(item, PendingDeclaration):
+            return item
+        if isinstance(item.type, ir.FunctionType):
+            variable = ir.Function(self.module, item.type, identifier)
+            self.functions[identifier] = variable
+            value = TypedValue(ir_value=variable, typ=variable.type, constant=False, name=identifier,
+                               lvalue_ptr=False)
+        else:
+            variable = ir.GlobalVariable(self.module, item.type, identifier)
+            value = TypedValue(ir_value=variable, typ=item.type, constant=False, name=identifier, lvalue_ptr=True)
+        self.symbol_table.replace_item(identifier, value)
+        return value
+
+    def reuse_function(self, llvm_function: ir.Function, cached: CachedFunction) -> None:
+        """
+        用缓存的函数体作为 llvm_function 的定义.
+        """
+        # 按原来的顺序取得引用的声明和字符串常量, 加入模块的顺序和新建的常量的名字都与重新生成时相同
+        names = {}
+        for name, value in cached.references:
+            if value is None:
+                self.materialize(name)
+            else:
+                names[name] = self.str_constant(value).ir_value.name
+        body = cached.body
+        if any(name != new_name for name, new_name in names.items()):
+            body = STRING_REFERENCE.sub(lambda m: '@"{}"'.format(names[m.group(1)]), body)
+        llvm_function.blocks.append(CachedBody(body))
+
     def visitDirectDeclarator_1(self, ctx: CParser.DirectDeclarator_1Context):
         """
         directDeclarator : Identifier
@@ -375,13 +716,14 @@ class Visitor(CVisitor):
                     if self.symbol_table.exist(identifier):
                         raise SemanticError("Symbol redefined: " + identifier, ctx)
                     if isinstance(typ, ir.FunctionType):
-                        variable = ir.Function(self.module, typ, identifier)
-                        self.functions[identifier] = variable
-                        self.symbol_table.add_item(identifier, TypedValue(ir_value=variable,
-                                                                          typ=variable.type,
-                                                                          constant=False,
-                                                                          name=identifier,
-                                                                          lvalue_ptr=False))
+                        if specifiers.is_static():
+                            self.static_functions.add(identifier)
+                        # 函数原型在被引用时才加入模块
+                        self.symbol_table.add_item(identifier, PendingDeclaration(typ, identifier))
+                    elif specifiers.is_extern():
+                        if initializer is not None:
+                            raise SemanticError("External variable cannot be initialized.", ctx)
+                        self.symbol_table.add_item(identifier, PendingDeclaration(typ, identifier))
                     else:
                         variable = ir.GlobalVariable(self.module, typ, identifier)
                         self.symbol_table.add_item(identifier, TypedValue(ir_value=variable,
@@ -389,23 +731,21 @@ class Visitor(CVisitor):
                                                                           constant=False,
                                                                           name=identifier,
                                                                           lvalue_ptr=True))
-                        if specifiers.is_extern():
-                            if initializer is not None:
-                                raise SemanticError("External variable cannot be initialized.", ctx)
+                        if specifiers.is_static():
+                            variable.linkage = "internal"
+                        if initializer is not None:
+                            variable.initializer = self.create_initializer_list(typ, initializer, True, ctx)
                         else:
-                            if specifiers.is_static():
-                                variable.linkage = "internal"
-                            if initializer is not None:
-                                variable.initializer = self.create_initializer_list(typ, initializer, True, ctx)
-                            else:
-                                variable.initializer = ir.Constant(typ, None)
+                            variable.initializer = ir.Constant(typ, None)
                 else:
                     if specifiers.is_static():
+                        # 缓存的函数体不包含这样的全局变量
+                        self.function_cacheable = False
                         variable = ir.GlobalVariable(self.module, typ, f"{self.current_function.name}.{identifier}")
                         variable.initializer = ir.Constant(typ, None)
                         variable.linkage = "internal"
                     else:
-                        variable = ir.IRBuilder(self.current_function.blocks[0]).alloca(typ, 1)
+                        variable = self.builder_type(self.current_function.blocks[0]).alloca(typ, 1)
                     result = self.symbol_table.add_item(identifier, TypedValue(ir_value=variable,
                                                                                typ=typ,
                                                                                constant=False,
@@ -675,24 +1015,39 @@ class Visitor(CVisitor):
         """
         kw = ctx.getChild(0).getText()
         if kw == 'if':
-            has_else = len(ctx.statement()) > 1
-            block_true = self.builder.append_basic_block(name='if.then')
-            blocks = [block_true]
-            if has_else:
-                block_false = self.builder.append_basic_block(name='if.else')
-                block_end = self.builder.append_basic_block(name='if.end')
-                blocks.append(block_false)
-            else:
-                block_end = self.builder.append_basic_block(name='if.end')
-                block_false = block_end
-            cond = self.ir_bool(self.visit(ctx.expression()))
-            self.builder.cbranch(cond, block_true, block_false)
-            for i, block in enumerate(blocks):
-                self.builder = ir.IRBuilder(block)
-                self.visit(ctx.statement()[i])
+            # else if 链用循环处理, 不递归; outer_ends 是外层各 if 的 if.end
+            outer_ends = []
+            while True:
+                statements = ctx.statement()
+                block_true = self.builder.append_basic_block(name='if.then')
+                if len(statements) > 1:
+                    block_false = self.builder.append_basic_block(name='if.else')
+                    block_end = self.builder.append_basic_block(name='if.end')
+                else:
+                    block_end = self.builder.append_basic_block(name='if.end')
+                    block_false = block_end
+                cond = self.ir_bool(self.visit(ctx.expression()))
+                self.builder.cbranch(cond, block_true, block_false)
+                self.builder = self.builder_type(block_true)
+                self.visit(statements[0])
                 if not self.builder.basic_block.is_terminated:
                     self.builder.branch(block_end)
-            self.builder = ir.IRBuilder(block_end)
+                if len(statements) > 1:
+                    self.builder = self.builder_type(block_false)
+                    else_ctx = statements[1]
+                    if type(else_ctx) is type(ctx) and else_ctx.getChild(0).getText() == 'if':
+                        outer_ends.append(block_end)
+                        ctx = else_ctx
+                        continue
+                    self.visit(else_ctx)
+                    if not self.builder.basic_block.is_terminated:
+                        self.builder.branch(block_end)
+                self.builder = self.builder_type(block_end)
+                break
+            for block_end in reversed(outer_ends):
+                if not self.builder.basic_block.is_terminated:
+                    self.builder.branch(block_end)
+                self.builder = self.builder_type(block_end)
             return
         if kw == 'switch':
             raise SemanticError("Not implemented", ctx)
@@ -719,7 +1074,7 @@ class Visitor(CVisitor):
         else:
             self.builder.branch(block_cond)
         # Build blocks
-        self.builder = ir.IRBuilder(block_cond)
+        self.builder = self.builder_type(block_cond)
         if kw == 'for':
             cond_ctx = ctx.second
         else:
@@ -731,14 +1086,14 @@ class Visitor(CVisitor):
             self.builder.branch(block_body)
         if ctx.third:
             block_update = self.builder.append_basic_block(name='loop.update')
-            self.builder = ir.IRBuilder(block_update)
+            self.builder = self.builder_type(block_update)
             self.visit(ctx.third)
             self.builder.branch(block_cond)
             self.continue_blocks.append(block_update)
         else:
             self.continue_blocks.append(block_cond)
         self.break_blocks.append(block_end)
-        self.builder = ir.IRBuilder(block_body)
+        self.builder = self.builder_type(block_body)
         self.visit(ctx.statement())
         if not self.builder.basic_block.is_terminated:
             self.builder.branch(self.continue_blocks[-1])
@@ -746,7 +1101,7 @@ class Visitor(CVisitor):
         self.break_blocks.pop()
         if ctx.first:
             self.symbol_table.quit_scope()
-        self.builder = ir.IRBuilder(block_end)
+        self.builder = self.builder_type(block_end)
 
     def visitJumpStatement(self, ctx: CParser.JumpStatementContext) -> None:
         """
@@ -901,8 +1256,14 @@ class Visitor(CVisitor):
             lvalue_ptr.type = new_type
 
     def str_constant(self, str_value: str) -> TypedValue:
-        if str_value in self.string_constants:
-            return self.string_constants[str_value]
+        typed_value = self.string_constants.get(str_value)
+        if typed_value is None:
+            typed_value = self.create_str_constant(str_value)
+        if self.function_references is not None:
+            self.function_references[(typed_value.ir_value.name, str_value)] = None
+        return typed_value
+
+    def create_str_constant(self, str_value: str) -> TypedValue:
         str_bytes = bytearray(str_value + "\0", "utf-8")
         variable_name = ".str" + str(len(self.string_constants))
         arr_type = ir.ArrayType(int8, len(str_bytes))
@@ -1105,9 +1466,12 @@ class Visitor(CVisitor):
         """
         if ctx.Identifier():
             identifier = ctx.getText()
-            item = self.symbol_table.get_item(identifier)
+            item = self.materialize(identifier)
             if item is None:
                 raise SemanticError("Undefined identifier: " + identifier, ctx)
+            if self.builder is None:
+                # 不在函数体中, 引用的函数总是可达的
+                self.root_functions.add(identifier)
             return item
         if ctx.StringLiteral():
             str_result = ""
@@ -1194,14 +1558,12 @@ class Visitor(CVisitor):
             raise SemanticError("Postfix expression(#4) is not literal struct.", ctx)
         member_name = ctx.Identifier().getText()
         ls_type: ElementNamedLiteralStructType = rvalue.type
-        try:
-            member_index, member_type = ls_type.get_element_by_name(member_name)
-            member_index = [ir.Constant(int32, idx) for idx in member_index]
-        except ValueError:
+        member = ls_type.get_member(member_name)
+        if member is None:
             raise SemanticError("Postfix expression(#4) has not such attribute.", ctx)
         # 获得地址
-        result = self.builder.gep(v1.ir_value, [int32_zero] + member_index, inbounds=False)
-        return TypedValue(result, member_type, constant=False, name=None, lvalue_ptr=True)
+        result = self.builder.gep(v1.ir_value, [int32_zero] + member.indices, inbounds=False)
+        return TypedValue(result, member.type, constant=False, name=None, lvalue_ptr=True)
 
     def visitPostfixExpression_5(self, ctx: CParser.PostfixExpression_5Context) -> TypedValue:
         # postfixExpression '->' Identifier
@@ -1211,16 +1573,16 @@ class Visitor(CVisitor):
             raise SemanticError("Postfix expression(#5) is not pointer.", ctx)
         # 转到结构体类型
         pointee_type = v1.type.pointee
+        if not isinstance(pointee_type, ElementNamedLiteralStructType):
+            raise SemanticError("Postfix expression(#5) is not pointer to literal struct.", ctx)
         member_name = ctx.Identifier().getText()
         ls_type: ElementNamedLiteralStructType = pointee_type
-        try:
-            member_index, member_type = ls_type.get_element_by_name(member_name)
-            member_index = [ir.Constant(int32, idx) for idx in member_index]
-        except ValueError:
+        member = ls_type.get_member(member_name)
+        if member is None:
             raise SemanticError("Postfix expression(#5) has not such attribute.", ctx)
         # 获得地址
-        result = self.builder.gep(rvalue, [int32_zero] + member_index, inbounds=False)
-        return TypedValue(result, member_type, constant=False, name=None, lvalue_ptr=True)
+        result = self.builder.gep(rvalue, [int32_zero] + member.indices, inbounds=False)
+        return TypedValue(result, member.type, constant=False, name=None, lvalue_ptr=True)
 
     def visitPostfixExpression_6(self, ctx: CParser.PostfixExpression_6Context) -> TypedValue:
         # postfixExpression '++'
@@ -1558,27 +1920,37 @@ class Visitor(CVisitor):
         if ctx.getChildCount() == 1:
             return self.visitChildren(ctx)
 
-        block_rhs = self.builder.append_basic_block(name='logical.rhs')
-        block_end = self.builder.append_basic_block(name='logical.end')
-
-        value_entry = self.ir_bool(self.visit(ctx.getChild(0)))
-        op = ctx.getChild(1).getText()
-        if op == '&&':
-            self.builder.cbranch(value_entry, block_rhs, block_end)
-        elif op == '||':
-            self.builder.cbranch(value_entry, block_end, block_rhs)
-        block_entry = self.builder.basic_block
-
-        self.builder = ir.IRBuilder(block_rhs)
-        value_rhs = self.ir_bool(self.visit(ctx.getChild(2)))
-        self.builder.branch(block_end)
-        block_rhs = self.builder.basic_block
-
-        self.builder = ir.IRBuilder(block_end)
-        result = self.builder.phi(int1)
-        result.add_incoming(value_entry, block_entry)
-        result.add_incoming(value_rhs, block_rhs)
-        return TypedValue(result, int1, constant=False, name=None, lvalue_ptr=False)
+        # a || b || c 中左侧的同类结点形成链, 用循环访问, 不按链的长度递归.
+        # 各层的基本块与递归访问时一样, 在访问最左侧的操作数之前由外向内创建
+        chain = [ctx]
+        child = ctx.getChild(0)
+        while type(child) is type(ctx) and child.getChildCount() == 3:
+            chain.append(child)
+            child = child.getChild(0)
+        blocks = [(self.builder.append_basic_block(name='logical.rhs'),
+                   self.builder.append_basic_block(name='logical.end')) for _ in chain]
+
+        value = self.visit(child)
+        for node, (block_rhs, block_end) in zip(reversed(chain), reversed(blocks)):
+            value_entry = self.ir_bool(value)
+            op = node.getChild(1).getText()
+            if op == '&&':
+                self.builder.cbranch(value_entry, block_rhs, block_end)
+            elif op == '||':
+                self.builder.cbranch(value_entry, block_end, block_rhs)
+            block_entry = self.builder.basic_block
+
+            self.builder = self.builder_type(block_rhs)
+            value_rhs = self.ir_bool(self.visit(node.getChild(2)))
+            self.builder.branch(block_end)
+            block_rhs = self.builder.basic_block
+
+            self.builder = self.builder_type(block_end)
+            result = self.builder.phi(int1)
+            result.add_incoming(value_entry, block_entry)
+            result.add_incoming(value_rhs, block_rhs)
+            value = TypedValue(result, int1, constant=False, name=None, lvalue_ptr=False)
+        return value
 
     def visitConditionalExpression(self, ctx: CParser.ConditionalExpressionContext):
         # logicalOrExpression ('?' expression ':' conditionalExpression)?
@@ -1593,7 +1965,7 @@ class Visitor(CVisitor):
         cond = self.ir_bool(first)
         self.builder.cbranch(cond, block_true, block_false)
 
-        self.builder = ir.IRBuilder(block_true)
+        self.builder = self.builder_type(block_true)
         typed_value_true = self.visit(ctx.expression())
         if isinstance(typed_value_true.type, ir.ArrayType):
             typed_value_true = self.decay(typed_value_true)
@@ -1601,7 +1973,7 @@ class Visitor(CVisitor):
         self.builder.branch(block_end)
         block_true = self.builder.basic_block
 
-        self.builder = ir.IRBuilder(block_false)
+        self.builder = self.builder_type(block_false)
         typed_value_false = self.visit(ctx.conditionalExpression())
         if isinstance(typed_value_false.type, ir.ArrayType):
             typed_value_false = self.decay(typed_value_false)
@@ -1612,7 +1984,7 @@ class Visitor(CVisitor):
         if typed_value_true.type != typed_value_false.type:
             raise SemanticError("Type not identical.", ctx)
 
-        self.builder = ir.IRBuilder(block_end)
+        self.builder = self.builder_type(block_end)
         result = self.builder.phi(typed_value_true.type)
         result.add_incoming(value_true, block_true)
         result.add_incoming(value_false, block_false)
@@ -1700,8 +2072,229 @@ class Visitor(CVisitor):
             f.write(repr(self.module))
 
 
+# DFA 缓存中的识别器, 包括预处理器的识别器
+DFA_RECOGNIZERS = (CParser, CLexer, CPreprocessorParser, CPreprocessorLexer)
+
+
+def make_token_source(lines: Iterator[SourceLine], lexer: str) -> TokenSource:
+    """
+    得到预处理结果的记号来源.
+
+    Args:
+        lines (Iterator[SourceLine]): 预处理产生的各行
+        lexer (str): 'preprocessor' 直接切分预处理器产生的各行; 'antlr' 用 CLexer 分析预处理后的文本;
+            'regex' 用 RegexTokenSource 分析预处理后的文本
+
+    Returns:
+        TokenSource
+    """
+    if lexer == 'antlr':
+        return CLexer(LineInputStream(line.text for line in lines))
+    if lexer == 'regex':
+        return RegexTokenSource(line.text for line in lines)
+    return PreprocessorTokenSource(lines)
+
+
+class ParseStats:
+    """
+    一次语法分析的统计: 分析器或成功的预测模式及各阶段用时.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # 'SLL', 'LL' 或 'fast', 语法错误时为 None
+        self.mode: Optional[str] = None
+        # 第一遍分析 (SLL 或 FastParser) 的用时
+        self.time: float = 0.0
+        # 未进行 LL 分析时为 None
+        self.ll_time: Optional[float] = None
+
+    def __str__(self):
+        mode = self.mode or 'syntax error'
+        if self.ll_time is None:
+            return f'parse {self.name}: {mode} {self.time:.3f}s'
+        return f'parse {self.name}: {mode} (SLL failed after {self.time:.3f}s, LL {self.ll_time:.3f}s)'
+
+
+def nesting_error(stream: CommonTokenStream) -> ParserError:
+    """
+    CParser 超过 Python 的递归深度限制时的错误, 位置是分析器当时的下一个记号.
+
+    CParser 是递归下降的分析器, 每层 else if 等嵌套都要递归; FastParser 用循环分析 else if 链, 不受此限制.
+    """
+    token = stream.LT(1)
+    return ParserError('nesting too deep for the ANTLR parser (try --parser=fast)',
+                       token.line, token.column, getattr(token, 'filepath', None))
+
+
+def parse(token_source: TokenSource, stats: Optional[ParseStats] = None,
+          parser: str = 'antlr') -> CParser.CompilationUnitContext:
+    """
+    对记号进行语法分析.
+
+    parser 为 'antlr' 时先用 SLL 预测和 BailErrorStrategy 分析, 这对绝大多数输入都能成功且快得多;
+    失败时回到开头用完整的 LL 预测重新分析, 此时的语法错误才是真正的错误.
+    parser 为 'fast' 时用 FastParser, 得到的树与 CParser 相同.
+
+    Args:
+        token_source (TokenSource): 记号来源
+        stats (Optional[ParseStats]): 不为 None 时记录统计
+        parser (str): 'antlr' 或 'fast'
+
+    Raises:
+        ParserError: 语法错误, 或者 CParser 的递归超过了深度限制
+    """
+    start = time.perf_counter()
+    if parser == 'fast':
+        tree = FastParser(token_source).compilationUnit()
+        if stats is not None:
+            stats.mode = 'fast'
+            stats.time = time.perf_counter() - start
+        return tree
+
+    stream = CommonTokenStream(token_source)
+    c_parser = CParser(stream)
+    c_parser.removeErrorListeners()
+    c_parser._interp.predictionMode = PredictionMode.SLL
+    c_parser._errHandler = BailErrorStrategy()
+    try:
+        tree = c_parser.compilationUnit()
+        if stats is not None:
+            stats.mode = 'SLL'
+            stats.time = time.perf_counter() - start
+        return tree
+    except ParseCancellationException:
+        pass
+    except RecursionError:
+        raise nesting_error(stream) from None
+
+    middle = time.perf_counter()
+    if stats is not None:
+        stats.time = middle - start
+    # 记号已经缓存在 stream 中, 不会再次词法分析
+    stream.seek(0)
+    c_parser.reset()
+    c_parser._interp.predictionMode = PredictionMode.LL
+    c_parser._errHandler = DefaultErrorStrategy()
+    errorListener = ParserErrorListener()
+    c_parser.addErrorListener(errorListener)
+    try:
+        tree = c_parser.compilationUnit()
+    except RecursionError:
+        raise nesting_error(stream) from None
+    finally:
+        if stats is not None:
+            stats.ll_time = time.perf_counter() - middle
+    if stats is not None:
+        stats.mode = 'LL'
+    return tree
+
+
+def discard_tokens(stream: CommonTokenStream) -> None:
+    """
+    丢弃 stream 中已经分析过的记号, 只保留前一个 (CParser 结束规则时用 LT(-1) 得到 stop).
+    剩下的记号重新编号, 使 tokenIndex 仍等于它在 stream.tokens 中的位置.
+    """
+    count = stream.index - 1
+    if count <= 0:
+        return
+    del stream.tokens[:count]
+    for i, token in enumerate(stream.tokens):
+        token.tokenIndex = i
+    stream.index -= count
+
+
+def parse_external_declarations(token_source: TokenSource, stats: Optional[ParseStats] = None,
+                                parser: str = 'antlr', skip_body: Optional[Callable[[List[Token]], bool]] = None
+                                ) -> Iterator[CParser.ExternalDeclarationContext]:
+    """
+    逐个分析 compilationUnit 中的 externalDeclaration, 用于流式编译.
+
+    与 parse 相同, parser 为 'antlr' 时每个 externalDeclaration 先用 SLL 分析, 失败时从它的开头用 LL 重新分析.
+    分析完的记号被丢弃, 所以内存占用只与单个 externalDeclaration 的大小有关.
+    依次访问得到的各个树与访问 parse 得到的 compilationUnit 效果相同.
+
+    Args:
+        token_source (TokenSource): 记号来源
+        stats (Optional[ParseStats]): 不为 None 时记录统计, 用时是各 externalDeclaration 的分析用时之和
+        parser (str): 'antlr' 或 'fast'
+        skip_body (Optional[Callable[[List[Token]], bool]]): parser 为 'fast' 时传给 FastParser, 见 Visitor.skip_function_body
+
+    Raises:
+        ParserError: 语法错误, 或者 CParser 的递归超过了深度限制
+    """
+    try:
+        yield from _parse_external_declarations(token_source, stats, parser, skip_body)
+    except Exception:
+        # 语法错误或预处理错误, 与 parse 一样不记录模式
+        if stats is not None:
+            stats.mode = None
+        raise
+
+
+def _parse_external_declarations(token_source: TokenSource, stats: Optional[ParseStats], parser: str,
+                                 skip_body: Optional[Callable[[List[Token]], bool]]
+                                 ) -> Iterator[CParser.ExternalDeclarationContext]:
+    # parse_external_declarations 的实现, 分析失败时由它清除 stats.mode
+    if parser == 'fast':
+        declarations = FastParser(token_source, skip_body).external_declarations()
+        if stats is not None:
+            stats.mode = 'fast'
+        while True:
+            start = time.perf_counter()
+            tree = next(declarations, None)
+            if stats is not None:
+                stats.time += time.perf_counter() - start
+            if tree is None:
+                return
+            yield tree
+
+    stream = CommonTokenStream(token_source)
+    c_parser = CParser(stream)
+    error_listener = ParserErrorListener()
+    if stats is not None:
+        stats.mode = 'SLL'
+    while True:
+        start = time.perf_counter()
+        if stream.LA(1) == Token.EOF:
+            return
+        begin = stream.index
+        c_parser.removeErrorListeners()
+        c_parser._interp.predictionMode = PredictionMode.SLL
+        c_parser._errHandler = BailErrorStrategy()
+        try:
+            tree = c_parser.externalDeclaration()
+        except ParseCancellationException:
+            tree = None
+        except RecursionError:
+            raise nesting_error(stream) from None
+        middle = time.perf_counter()
+        if stats is not None:
+            stats.time += middle - start
+        if tree is None:
+            # 只重新分析这一个 externalDeclaration
+            c_parser.reset()
+            stream.seek(begin)
+            c_parser._interp.predictionMode = PredictionMode.LL
+            c_parser._errHandler = DefaultErrorStrategy()
+            c_parser.addErrorListener(error_listener)
+            if stats is not None:
+                stats.mode = 'LL'
+            try:
+                tree = c_parser.externalDeclaration()
+            except RecursionError:
+                raise nesting_error(stream) from None
+            finally:
+                if stats is not None:
+                    stats.ll_time = (stats.ll_time or 0.0) + time.perf_counter() - middle
+        discard_tokens(stream)
+        yield tree
+
+
 def compile(input_file: str, output_file: str, target_arch: str, include_dirs: List[str],
-             macros: Dict[str, str]):
+             macros: Dict[str, str], pch: Optional[str] = None, lexer: str = 'preprocessor', parser: str = 'antlr',
+             stats: bool = False, stream: bool = False, ir_cache: Optional[str] = None, lazy_functions: bool = False,
+             dfa_cache: Optional[str] = None, syntax_only: bool = False):
     """
     将C代码文件转成IR代码文件
     :param input_file: C代码文件
@@ -1709,6 +2302,16 @@ def compile(input_file: str, output_file: str, target_arch: str, include_dirs: L
     :param macro_list: 宏
     :param include_dirs: 头文件目录
     :param target_arch: 目标架构
+    :param pch: 预编译头文件路径, 为 None 时不使用预编译头
+    :param lexer: 记号来源, 见 make_token_source
+    :param parser: 语法分析器, 'antlr' 为 CParser, 'fast' 为 FastParser
+    :param stats: 是否输出语法分析的预测模式和用时, 折叠的结点数以及内存峰值
+    :param stream: 是否逐个 externalDeclaration 分析并生成代码, 不建立整个文件的语法树
+    :param ir_cache: 函数的 IR 缓存文件路径, 为 None 时不使用缓存
+    :param lazy_functions: 是否只为从非 static 函数和全局变量可达的函数生成代码
+    :param dfa_cache: ANTLR 预测 DFA 的缓存文件路径, 为 None 时不使用缓存
+    :param syntax_only: 是否只做预处理, 语法分析和语义检查, 不生成指令也不输出 IR;
+        此时检查所有函数体, 不使用 lazy_functions 和 ir_cache
     :return: 生成是否成功
     """
     def as_pointer(self: ir.Type, addrspace=0):
@@ -1718,33 +2321,115 @@ def compile(input_file: str, output_file: str, target_arch: str, include_dirs: L
 
     ir.Type.as_pointer = as_pointer
 
+    def generate(token_source: TokenSource, name: str) -> None:
+        # 分析 token_source 并用 visitor 生成代码
+        lowering = Lowering(Visitor.pass_through)
+        parse_stats = ParseStats(name) if stats else None
+        if stream:
+            # 每个 externalDeclaration 的树在生成代码后即被释放.
+            # 使用 IR 缓存时, 缓存命中的函数不分析函数体
+            skip_body = visitor.skip_function_body if visitor.ir_cache is not None else None
+            try:
+                for tree in parse_external_declarations(token_source, parse_stats, parser, skip_body):
+                    visitor.visit(lowering.lower(tree))
+            finally:
+                if stats:
+                    print(str(parse_stats))
+        else:
+            try:
+                tree = parse(token_source, parse_stats, parser)
+            finally:
+                if stats:
+                    print(str(parse_stats))
+            visitor.visit(lowering.lower(tree))
+        if stats:
+            print(f'lower {name}: {lowering.nodes} nodes, {lowering.collapsed} pass-through nodes collapsed '
+                  f'({lowering.collapsed} visit calls saved)')
+
+    # 在任何识别器开始分析之前读入 DFA
+    dfa = None
+    if dfa_cache is not None:
+        dfa = DFACache(DFA_RECOGNIZERS)
+        loaded = dfa.load(dfa_cache)
+        if stats:
+            print(f'dfa cache: {dfa.loaded_states} states loaded' if loaded else 'dfa cache: not loaded')
+
+    if syntax_only:
+        lazy_functions = False
+        ir_cache = None
+
     includes = [os.getcwd(), *include_dirs]
-    macros = macros.copy()
+    macro_table = MacroTable(macros)
+    visitor = Visitor(target_arch)
+    visitor.lazy_functions = lazy_functions
+    if syntax_only:
+        visitor.builder_type = CheckingBuilder
+    # 主文件中已由预编译头处理的行数
+    start = 0
+    token_source = None
 
     try:
-        processed_text = preprocess(input_file, includes, macros)
+        if pch is not None:
+            prefix = header_prefix(input_file)
+            start = len(prefix)
+            key = PrecompiledHeader.make_key(input_file, prefix, target_arch, includes, macros, lazy_functions,
+                                             syntax_only)
+            header = PrecompiledHeader.load(pch, key)
+            if header is not None:
+                macro_table, visitor = header.macros, header.visitor
+            else:
+                files = header_cache.start_tracking()
+                try:
+                    token_source = make_token_source(
+                        preprocess_source(input_file, includes, macro_table, stop=start), lexer)
+                    generate(token_source, 'header prefix')
+                finally:
+                    header_cache.stop_tracking(files)
+                PrecompiledHeader(key, files, macro_table, visitor).save(pch)
+
+        if ir_cache is not None:
+            visitor.ir_cache = IRCache.load(ir_cache, (visitor.module.triple, visitor.module.data_layout))
+
+        # 预处理的结果逐行送入语法分析器; 语法树转换为 Node 之后即被释放, 生成代码时不再占用内存
+        token_source = make_token_source(preprocess_source(input_file, includes, macro_table, start=start), lexer)
+        generate(token_source, input_file)
+        if lazy_functions:
+            generated, removed = visitor.generate_reachable_functions()
+            if stats:
+                print(f'functions: {generated} generated, {removed} unreachable removed')
     except MacroError as e:
         print(str(e))
         return False
-
-    processed_lines = processed_text.splitlines()
-    lexer = CLexer(InputStream(processed_text))
-    stream = CommonTokenStream(lexer)
-    parser = CParser(stream)
-    parser.removeErrorListeners()
-    errorListener = ParserErrorListener()
-    parser.addErrorListener(errorListener)
-
-    try:
-        tree = parser.compilationUnit()
-        visitor = Visitor(target_arch)
-        visitor.visit(tree)
     except CompilationError as e:
         print(str(e))
-        i = e.line - 1
-        if i in range(len(processed_lines)):
-            print(processed_lines[i])
+        if e.filepath is not None:
+            # 行号是源文件中的行号
+            line = linecache.getline(e.filepath, e.line).rstrip('\r\n')
+            print('{}:{}:{}: {}'.format(e.filepath, e.line, e.column, line))
+        elif isinstance(token_source, (CLexer, RegexTokenSource)):
+            # 行号是预处理结果中的行号
+            if isinstance(token_source, CLexer):
+                line = token_source.inputStream.get_line(e.line)
+            else:
+                line = token_source.get_line(e.line)
+            if line is not None:
+                print(line)
         return False
-
-    visitor.save(output_file)
+    finally:
+        # 出错时已经学到的 DFA 状态同样有效
+        if dfa is not None and dfa.save(dfa_cache) and stats:
+            print(f'dfa cache: {dfa.loaded_states} states saved')
+
+    if not syntax_only:
+        visitor.save(output_file)
+    if visitor.ir_cache is not None:
+        visitor.ir_cache.save(ir_cache)
+        if stats:
+            print(f'ir cache: {visitor.ir_cache.hits} hits, {visitor.ir_cache.misses} misses')
+    if stats and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 上单位是 KiB, macOS 上是字节
+        if sys.platform == 'darwin':
+            peak //= 1024
+        print(f'peak RSS: {peak / 1024:.1f} MiB')
     return True
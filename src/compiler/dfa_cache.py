@@ -0,0 +1,248 @@
+import hashlib
+import io
+import os
+import pickle
+import sys
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from antlr4.atn.ATNConfigSet import ATNConfigSet
+from antlr4.atn.ATNSimulator import ATNSimulator
+from antlr4.atn.LexerActionExecutor import LexerActionExecutor
+from antlr4.atn.SemanticContext import SemanticContext
+from antlr4.dfa.DFA import DFA
+from antlr4.dfa.DFAState import DFAState
+from antlr4.PredictionContext import PredictionContext, SingletonPredictionContext, ArrayPredictionContext
+
+try:
+    from importlib.metadata import version as package_version
+except ImportError:
+    package_version = None
+
+
+def runtime_version() -> Optional[str]:
+    """
+    ANTLR 运行时的版本, 不同版本的 DFA 不通用.
+    """
+    if package_version is None:
+        return None
+    try:
+        return package_version('antlr4-python3-runtime')
+    except Exception:
+        return None
+
+
+def grammar_hash(recognizer: type) -> str:
+    """
+    识别器的 ATN 的 hash. 文法改变并重新生成识别器后 ATN 不同, 缓存的 DFA 不再可用.
+    """
+    return hashlib.sha256(sys.modules[recognizer.__module__].serializedATN().encode()).hexdigest()
+
+
+def _make_config_set(configs: List, full_context: bool, unique_alt: int, conflicting_alts: Any,
+                     has_semantic_context: bool, dips_into_outer_context: bool) -> ATNConfigSet:
+    # 重新建立 DFA 状态的 ATNConfigSet, hash 在新的进程中重新计算
+    config_set = ATNConfigSet(full_context)
+    config_set.configs = configs
+    config_set.uniqueAlt = unique_alt
+    config_set.conflictingAlts = conflicting_alts
+    config_set.hasSemanticContext = has_semantic_context
+    config_set.dipsIntoOuterContext = dips_into_outer_context
+    config_set.setReadonly(True)
+    return config_set
+
+
+class _DFAPickler(pickle.Pickler):
+    """
+    保存 DFA 状态中的对象.
+
+    ATN 状态, 词法动作和运行时中的单例 (EMPTY, NONE, ERROR) 只保存编号, 读取时换成当前进程中的对象.
+    PredictionContext, ATNConfigSet 和 LexerActionExecutor 缓存了字符串的 hash, 而字符串的 hash 在每个进程中不同,
+    所以保存构造参数, 读取时重新构造.
+    """
+
+    def __init__(self, file, recognizers: Sequence[type]):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.ids: Dict[int, Tuple] = {
+            id(PredictionContext.EMPTY): ('empty',),
+            id(SemanticContext.NONE): ('none',),
+            id(ATNSimulator.ERROR): ('error',),
+        }
+        for i, recognizer in enumerate(recognizers):
+            for state in recognizer.atn.states:
+                self.ids[id(state)] = ('state', i, state.stateNumber)
+            for j, action in enumerate(recognizer.atn.lexerActions or ()):
+                self.ids[id(action)] = ('action', i, j)
+
+    def persistent_id(self, obj):
+        return self.ids.get(id(obj))
+
+    def reducer_override(self, obj):
+        typ = type(obj)
+        if typ is SingletonPredictionContext:
+            return SingletonPredictionContext.create, (obj.parentCtx, obj.returnState)
+        if typ is ArrayPredictionContext:
+            return ArrayPredictionContext, (obj.parents, obj.returnStates)
+        if typ is ATNConfigSet:
+            return _make_config_set, (obj.configs, obj.fullCtx, obj.uniqueAlt, obj.conflictingAlts,
+                                      obj.hasSemanticContext, obj.dipsIntoOuterContext)
+        if typ is LexerActionExecutor:
+            return LexerActionExecutor, (obj.lexerActions,)
+        return NotImplemented
+
+
+class _DFAUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, recognizers: Sequence[type]):
+        super().__init__(file)
+        self.recognizers = recognizers
+
+    def persistent_load(self, pid):
+        kind = pid[0]
+        if kind == 'empty':
+            return PredictionContext.EMPTY
+        if kind == 'none':
+            return SemanticContext.NONE
+        if kind == 'error':
+            return ATNSimulator.ERROR
+        if kind == 'state':
+            return self.recognizers[pid[1]].atn.states[pid[2]]
+        if kind == 'action':
+            return self.recognizers[pid[1]].atn.lexerActions[pid[2]]
+        raise pickle.UnpicklingError('unknown persistent id: {}'.format(pid))
+
+
+def _flatten_dfa(dfa: DFA) -> Tuple[int, int, List[Tuple], bool]:
+    # 把 DFA 的状态排成列表, 边换成下标 (-1 为 None, -2 为 ERROR), 保存时不按路径长度递归.
+    # 列表的前 count 项是 dfa.states 中的状态, 之后是只能从边到达的状态 (例如优先级 DFA 的 s0)
+    states: List[DFAState] = list(dfa.states)
+    count = len(states)
+    index = {id(state): i for i, state in enumerate(states)}
+
+    def state_index(state: Optional[DFAState]) -> int:
+        if state is None:
+            return -1
+        if state is ATNSimulator.ERROR:
+            return -2
+        i = index.get(id(state))
+        if i is None:
+            i = index[id(state)] = len(states)
+            states.append(state)
+        return i
+
+    s0 = state_index(dfa.s0)
+    records = []
+    i = 0
+    while i < len(states):
+        state = states[i]
+        edges = None if state.edges is None else [state_index(edge) for edge in state.edges]
+        records.append((state.stateNumber, state.configs, state.isAcceptState, state.prediction,
+                        state.lexerActionExecutor, state.requiresFullContext, state.predicates, edges))
+        i += 1
+    return s0, count, records, dfa.precedenceDfa
+
+
+def _restore_dfa(dfa: DFA, s0: int, count: int, records: List[Tuple], precedence: bool) -> None:
+    # _flatten_dfa 的逆过程
+    states = []
+    for state_number, configs, accept, prediction, executor, full_context, predicates, _ in records:
+        state = DFAState(state_number, configs)
+        state.isAcceptState = accept
+        state.prediction = prediction
+        state.lexerActionExecutor = executor
+        state.requiresFullContext = full_context
+        state.predicates = predicates
+        states.append(state)
+
+    def state_at(i: int) -> Optional[DFAState]:
+        if i == -1:
+            return None
+        if i == -2:
+            return ATNSimulator.ERROR
+        return states[i]
+
+    for state, record in zip(states, records):
+        edges = record[-1]
+        if edges is not None:
+            state.edges = [state_at(i) for i in edges]
+    dfa._states = {state: state for state in states[:count]}
+    dfa.s0 = state_at(s0)
+    dfa.precedenceDfa = precedence
+
+
+class DFACache:
+    """
+    ANTLR 识别器的预测 DFA 的缓存.
+
+    Python 的 ANTLR 运行时在每个进程中都从空的 DFA 开始, 开始的一段时间大部分决策都要模拟 ATN;
+    保存已经学到的 DFA 状态, 下次启动时读入, 第一个文件也能以 DFA 已经建立时的速度分析.
+    key 包含格式版本, 运行时版本和各识别器的 ATN 的 hash, 文法或运行时改变后缓存失效.
+    """
+
+    # 缓存格式改变时增加
+    version: int = 1
+
+    def __init__(self, recognizers: Sequence[type]):
+        """
+        Args:
+            recognizers (Sequence[type]): 识别器类, 例如 CParser, CLexer. 它们的 decisionsToDFA 被读入的 DFA 替换
+        """
+        self.recognizers: Tuple[type, ...] = tuple(recognizers)
+        # 读入时的状态数, 保存时只有状态增加才写入文件
+        self.loaded_states = self.state_count()
+
+    def make_key(self) -> Tuple[Any, ...]:
+        return (DFACache.version,
+                runtime_version(),
+                tuple((recognizer.__name__, grammar_hash(recognizer)) for recognizer in self.recognizers))
+
+    def state_count(self) -> int:
+        """
+        各识别器的 DFA 中的状态总数.
+        """
+        return sum(len(dfa.states) for recognizer in self.recognizers for dfa in recognizer.decisionsToDFA)
+
+    def load(self, path: str) -> bool:
+        """
+        读取缓存并替换各识别器的 DFA. 文件不存在, 无法读取或 key 不同时不做任何改变.
+
+        Returns:
+            bool: 是否读入了缓存
+        """
+        try:
+            with open(path, 'rb') as f:
+                key, data = _DFAUnpickler(f, self.recognizers).load()
+        except Exception:
+            return False
+        if key != self.make_key():
+            return False
+        for recognizer, decisions in zip(self.recognizers, data):
+            dfas = []
+            for dfa, (s0, count, records, precedence) in zip(recognizer.decisionsToDFA, decisions):
+                loaded = DFA(dfa.atnStartState, dfa.decision)
+                _restore_dfa(loaded, s0, count, records, precedence)
+                dfas.append(loaded)
+            # 识别器实例创建时取得类的 decisionsToDFA 列表, 所以原地替换
+            recognizer.decisionsToDFA[:] = dfas
+        self.loaded_states = self.state_count()
+        return True
+
+    def save(self, path: str) -> bool:
+        """
+        DFA 的状态比读入时多时写入缓存.
+
+        Returns:
+            bool: 是否写入了文件
+        """
+        if self.state_count() <= self.loaded_states:
+            return False
+        data = [[_flatten_dfa(dfa) for dfa in recognizer.decisionsToDFA] for recognizer in self.recognizers]
+        buf = io.BytesIO()
+        _DFAPickler(buf, self.recognizers).dump((self.make_key(), data))
+        # 与预编译头相同, 先写入临时文件
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(buf.getvalue())
+        os.replace(temp_path, path)
+        self.loaded_states = self.state_count()
+        return True
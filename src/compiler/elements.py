@@ -1,4 +1,4 @@
-from typing import List, Union, Optional, Tuple
+from typing import List, Set, Union, Optional, Tuple
 
 from llvmlite import ir
 
@@ -77,3 +77,26 @@ class ParameterList:
     def __len__(self):
         return len(self.parameters)
 
+
+class DeferredFunction:
+    """
+    已处理函数头, 尚未生成函数体的函数定义, 见 Visitor.generate_reachable_functions.
+    """
+
+    def __init__(self, ctx, llvm_function: ir.Function, parameter_list: ParameterList, cache_key: Optional[str],
+                 references: Set[str], checkpoint: int):
+        """
+        Args:
+            ctx: 函数定义的结点
+            llvm_function (ir.Function): 函数
+            parameter_list (ParameterList): 参数列表
+            cache_key (Optional[str]): 函数在 IR 缓存中的 key, 不使用缓存时为 None
+            references (Set[str]): 函数体中出现的标识符, 其中的函数名是调用图中的边
+            checkpoint (int): 定义函数时符号表的 checkpoint, 生成函数体时只能看到这之前的全局名字
+        """
+        self.ctx = ctx
+        self.llvm_function = llvm_function
+        self.parameter_list = parameter_list
+        self.cache_key = cache_key
+        self.references = references
+        self.checkpoint = checkpoint
@@ -1,12 +1,16 @@
 from antlr4 import ParserRuleContext
 from antlr4.error.ErrorListener import ErrorListener
 
+from typing import Optional
+
 
 class CompilationError(Exception):
-    def __init__(self, msg: str, line: int, column: int):
+    def __init__(self, msg: str, line: int, column: int, filepath: Optional[str] = None):
         self.msg = msg
         self.line = line
         self.column = column
+        # 记号来自预处理器时为出错位置所在的源文件, 此时行号是源文件中的行号
+        self.filepath = filepath
 
     def __str__(self):
         return self.msg
@@ -14,22 +18,24 @@ class CompilationError(Exception):
 
 class SemanticError(CompilationError):
     def __init__(self, msg: str, ctx: ParserRuleContext = None):
+        filepath = None
         if ctx:
             line = ctx.start.line
             column = ctx.start.column
+            filepath = getattr(ctx.start, 'filepath', None)
         else:
             line = 0
             column = 0
         msg = f'Semantic Error: {msg}'
-        super().__init__(msg, line, column)
+        super().__init__(msg, line, column, filepath)
 
 
 class ParserError(CompilationError):
-    def __init__(self, msg: str, line: int, column: int):
+    def __init__(self, msg: str, line: int, column: int, filepath: Optional[str] = None):
         msg = f'Syntax Error: {msg}'
-        super().__init__(msg, line, column)
+        super().__init__(msg, line, column, filepath)
 
 
 class ParserErrorListener(ErrorListener):
     def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
-        raise ParserError(msg, line, column)
+        raise ParserError(msg, line, column, getattr(offending_symbol, 'filepath', None))
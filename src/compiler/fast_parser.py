@@ -0,0 +1,881 @@
+from antlr4.Token import Token
+from antlr4.Lexer import TokenSource
+from antlr4.ParserRuleContext import ParserRuleContext
+
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .errors import ParserError
+from .parser.CParser import CParser
+from .token_source import LITERAL_TYPES
+
+T = LITERAL_TYPES
+
+STORAGE_CLASS_SPECIFIERS = frozenset(T[k] for k in ('typedef', 'extern', 'static'))
+TYPE_QUALIFIERS = frozenset(T[k] for k in ('const', 'volatile'))
+FUNCTION_SPECIFIERS = frozenset(T[k] for k in ('inline', '__stdcall', '__cdecl', '__declspec'))
+PRIMITIVE_TYPES = frozenset(T[k] for k in ('void', 'char', 'short', 'int', 'long', 'float', 'double',
+                                           'signed', 'unsigned'))
+# 一定是声明限定符的开头 (不含可能是 typedefName 的标识符)
+SPECIFIER_KEYWORDS = STORAGE_CLASS_SPECIFIERS | TYPE_QUALIFIERS | FUNCTION_SPECIFIERS | PRIMITIVE_TYPES | \
+                     {T['struct'], T['enum']}
+
+UNARY_OPERATORS = frozenset(T[k] for k in ('&', '*', '+', '-', '~', '!'))
+ASSIGNMENT_OPERATORS = frozenset(T[k] for k in ('=', '*=', '/=', '%=', '+=', '-=', '<<=', '>>=', '&=', '^=', '|='))
+# castExpression 可能的第一个记号
+CAST_START = UNARY_OPERATORS | {T['('], T['++'], T['--'], T['sizeof'], CParser.Identifier, CParser.IntegerConstant,
+                                CParser.FloatingConstant, CParser.CharacterConstant, CParser.StringLiteral}
+CONSTANTS = frozenset((CParser.IntegerConstant, CParser.FloatingConstant, CParser.CharacterConstant))
+# 声明限定符之后的标识符若后面是这些记号, 它是描述符而不是 typedefName
+DECLARATOR_FOLLOW = frozenset(T[k] for k in (';', ',', '=', '[', '(', '{', ')'))
+
+# 二元运算的各层, 从结合最紧的 multiplicativeExpression 到 logicalOrExpression.
+# 每层为 (只有下一层一个子结点的 context, 运算符 -> context)
+BINARY_LEVELS: List[Tuple[type, Dict[int, type]]] = [
+    (CParser.MultiplicativeExpression_1Context, {T['*']: CParser.MultiplicativeExpression_2Context,
+                                                 T['/']: CParser.MultiplicativeExpression_3Context,
+                                                 T['%']: CParser.MultiplicativeExpression_4Context}),
+    (CParser.AdditiveExpression_1Context, {T['+']: CParser.AdditiveExpression_2Context,
+                                           T['-']: CParser.AdditiveExpression_3Context}),
+    (CParser.ShiftExpression_1Context, {T['<<']: CParser.ShiftExpression_2Context,
+                                        T['>>']: CParser.ShiftExpression_3Context}),
+    (CParser.RelationalExpression_1Context, {T['<']: CParser.RelationalExpression_2Context,
+                                             T['>']: CParser.RelationalExpression_3Context,
+                                             T['<=']: CParser.RelationalExpression_4Context,
+                                             T['>=']: CParser.RelationalExpression_5Context}),
+    (CParser.EqualityExpression_1Context, {T['==']: CParser.EqualityExpression_2Context,
+                                           T['!=']: CParser.EqualityExpression_3Context}),
+    (CParser.AndExpression_1Context, {T['&']: CParser.AndExpression_2Context}),
+    (CParser.ExclusiveOrExpression_1Context, {T['^']: CParser.ExclusiveOrExpression_2Context}),
+    (CParser.InclusiveOrExpression_1Context, {T['|']: CParser.InclusiveOrExpression_2Context}),
+    (CParser.LogicalAndExpressionContext, {T['&&']: CParser.LogicalAndExpressionContext}),
+    (CParser.LogicalOrExpressionContext, {T['||']: CParser.LogicalOrExpressionContext}),
+]
+# 运算符 -> (所在层, context)
+BINARY_OPERATORS: Dict[int, Tuple[int, type]] = {
+    op: (level, cls) for level, (_, operators) in enumerate(BINARY_LEVELS) for op, cls in operators.items()
+}
+
+# 带 # 标签的备选分支的 context 由同一规则的 context 复制而来, 构造时用它作为参数
+_TEMPLATE = ParserRuleContext()
+
+
+def token_name(typ: int) -> str:
+    """
+    记号类型在报错信息中的名字, 与 ANTLR 相同.
+    """
+    if typ == Token.EOF:
+        return '<EOF>'
+    if typ < len(CParser.literalNames) and CParser.literalNames[typ] != '<INVALID>':
+        return CParser.literalNames[typ]
+    return CParser.symbolicNames[typ]
+
+
+class FastParser:
+    """
+    手写的递归下降语法分析器, 表达式部分用优先级爬升.
+
+    得到的语法树由 CParser 的 context 构成, 与 CParser 分析同样的记号得到的树相同, Visitor 可以直接使用.
+    CParser 靠自适应预测解决的几处歧义在这里用固定的规则处理, 与 CParser 的选择一致:
+        - 声明限定符之后的标识符, 若下一个记号可以跟在描述符之后 (见 DECLARATOR_FOLLOW), 它是描述符,
+          否则是 typedefName
+        - 以标识符开头的块内项目, 能作为语句分析时是语句, 否则是声明; for 的初始化部分同理
+        - ( 标识符 ) 之后若是可以开始 castExpression 的记号, 它是类型转换
+        - sizeof ( 标识符 ) 是 sizeof 表达式
+    """
+
+    def __init__(self, token_source: TokenSource, skip_body: Optional[Callable[[List[Token]], bool]] = None):
+        """
+        Args:
+            token_source (TokenSource): 记号来源
+            skip_body (Optional[Callable[[List[Token]], bool]]): 以函数定义的全部记号调用, 返回 True 时不分析函数体,
+                用于 IR 缓存命中的函数 (见 _function_body)
+        """
+        self._source = token_source
+        self._skip_body = skip_body
+        # 已读取的记号
+        self._tokens: List[Token] = []
+        self._pos = 0
+        # 已丢弃的记号数, 见 external_declarations
+        self._discarded = 0
+        self._eof: Optional[Token] = None
+
+    # 记号
+
+    def _fill(self, index: int) -> Token:
+        while index >= len(self._tokens):
+            if self._eof is not None:
+                return self._eof
+            token = self._source.nextToken()
+            token.tokenIndex = self._discarded + len(self._tokens)
+            self._tokens.append(token)
+            if token.type == Token.EOF:
+                self._eof = token
+        return self._tokens[index]
+
+    def _lt(self, k: int = 1) -> Token:
+        index = self._pos + k - 1
+        if index < len(self._tokens):
+            return self._tokens[index]
+        return self._fill(index)
+
+    def _la(self, k: int = 1) -> int:
+        index = self._pos + k - 1
+        if index < len(self._tokens):
+            return self._tokens[index].type
+        return self._fill(index).type
+
+    def _consume(self, ctx: ParserRuleContext) -> None:
+        ctx.addTokenNode(self._lt())
+        self._pos += 1
+
+    def _match(self, ctx: ParserRuleContext, typ: int) -> None:
+        if self._la() != typ:
+            self._error_expecting(typ)
+        ctx.addTokenNode(self._tokens[self._pos])
+        self._pos += 1
+
+    def _error_expecting(self, typ: int) -> None:
+        token = self._lt()
+        raise ParserError("mismatched input '{}' expecting {}".format(token.text, token_name(typ)),
+                          token.line, token.column, getattr(token, 'filepath', None))
+
+    def _error(self) -> None:
+        token = self._lt()
+        raise ParserError("no viable alternative at input '{}'".format(token.text),
+                          token.line, token.column, getattr(token, 'filepath', None))
+
+    # context
+
+    @staticmethod
+    def _new(cls: type) -> ParserRuleContext:
+        if cls.__bases__[0] is ParserRuleContext:
+            return cls(None)
+        return cls(None, _TEMPLATE)
+
+    def _node(self, cls: type) -> ParserRuleContext:
+        """
+        创建从当前记号开始的 context.
+        """
+        ctx = self._new(cls)
+        ctx.start = self._lt()
+        return ctx
+
+    def _wrap(self, cls: type, child: ParserRuleContext) -> ParserRuleContext:
+        """
+        创建以 child 为第一个子结点的 context, 用于左递归的规则和已经分析了开头部分的规则.
+        """
+        ctx = self._new(cls)
+        ctx.start = child.start
+        ctx.stop = child.stop
+        ctx.children = [child]
+        child.parentCtx = ctx
+        return ctx
+
+    def _done(self, ctx: ParserRuleContext) -> ParserRuleContext:
+        ctx.stop = self._tokens[self._pos - 1] if self._pos > 0 else None
+        return ctx
+
+    @staticmethod
+    def _add(ctx: ParserRuleContext, child: ParserRuleContext) -> None:
+        if ctx.children is None:
+            ctx.children = []
+        ctx.children.append(child)
+        child.parentCtx = ctx
+
+    def _speculate(self, rule, *args) -> Optional[ParserRuleContext]:
+        """
+        尝试分析 rule, 有语法错误时回到原位置并返回 None.
+        """
+        pos = self._pos
+        try:
+            return rule(*args)
+        except ParserError:
+            self._pos = pos
+            return None
+
+    # 顶层
+
+    def compilationUnit(self) -> CParser.CompilationUnitContext:
+        ctx = self._node(CParser.CompilationUnitContext)
+        while self._la() != Token.EOF:
+            self._add(ctx, self.externalDeclaration())
+        # 与 CParser 一样, EOF 是子结点但不算在 ctx.stop 中
+        self._done(ctx)
+        ctx.addTokenNode(self._lt())
+        return ctx
+
+    def external_declarations(self) -> Iterator[CParser.ExternalDeclarationContext]:
+        """
+        逐个分析 compilationUnit 中的 externalDeclaration, 不建立 compilationUnit.
+
+        每分析完一个, 它之前的记号即被丢弃 (只保留最后一个, 用于空规则的 stop),
+        因此分析器占用的内存与整个文件的长度无关.
+        """
+        while self._la() != Token.EOF:
+            yield self.externalDeclaration()
+            if self._pos > 1:
+                self._discarded += self._pos - 1
+                del self._tokens[:self._pos - 1]
+                self._pos = 1
+
+    def externalDeclaration(self) -> CParser.ExternalDeclarationContext:
+        start = self._pos
+        ctx = self._node(CParser.ExternalDeclarationContext)
+        if self._la() == T[';']:
+            self._consume(ctx)
+            return self._done(ctx)
+        specifiers = self.declarationSpecifiers()
+        if self._la() == T[';']:
+            self._add(ctx, self._declaration(specifiers, None))
+            return self._done(ctx)
+        declarator = self.declarator()
+        if self._la() == T['{']:
+            definition = self._wrap(CParser.FunctionDefinitionContext, specifiers)
+            self._add(definition, declarator)
+            self._add(definition, self._function_body(start))
+            self._add(ctx, self._done(definition))
+        else:
+            self._add(ctx, self._declaration(specifiers, declarator))
+        return self._done(ctx)
+
+    def _function_body(self, start: int) -> CParser.CompoundStatementContext:
+        """
+        函数定义中的 compoundStatement, 函数定义从 self._tokens[start] 开始.
+
+        skip_body 认为不需要分析时, 得到的 compoundStatement 以函数体的各记号为子结点, 不分析其结构;
+        这样的树只能用于取得函数定义的记号, 不能生成代码.
+        """
+        if self._skip_body is not None:
+            end = self._matching_brace()
+            if end is not None and self._skip_body(self._tokens[start:end + 1]):
+                ctx = self._node(CParser.CompoundStatementContext)
+                while self._pos <= end:
+                    self._consume(ctx)
+                return self._done(ctx)
+        return self.compoundStatement()
+
+    def _matching_brace(self) -> Optional[int]:
+        # 当前的 { 对应的 } 在 self._tokens 中的位置, 没有时为 None
+        depth = 0
+        k = 1
+        while True:
+            la = self._la(k)
+            if la == T['{']:
+                depth += 1
+            elif la == T['}']:
+                depth -= 1
+                if depth == 0:
+                    return self._pos + k - 1
+            elif la == Token.EOF:
+                return None
+            k += 1
+
+    # 声明
+
+    def declaration(self) -> CParser.DeclarationContext:
+        return self._declaration(self.declarationSpecifiers(), None)
+
+    def _declaration(self, specifiers: CParser.DeclarationSpecifiersContext,
+                     declarator: Optional[CParser.DeclaratorContext]) -> CParser.DeclarationContext:
+        # 已经分析了声明限定符, 可能还有第一个描述符
+        ctx = self._wrap(CParser.DeclarationContext, self._for_declaration(specifiers, declarator))
+        self._match(ctx, T[';'])
+        return self._done(ctx)
+
+    def forDeclaration(self) -> CParser.ForDeclarationContext:
+        return self._for_declaration(self.declarationSpecifiers(), None)
+
+    def _for_declaration(self, specifiers: CParser.DeclarationSpecifiersContext,
+                         declarator: Optional[CParser.DeclaratorContext]) -> CParser.ForDeclarationContext:
+        ctx = self._wrap(CParser.ForDeclarationContext, specifiers)
+        if declarator is not None or self._la() != T[';']:
+            self._add(ctx, self._init_declarator_list(declarator))
+        return self._done(ctx)
+
+    def _init_declarator_list(self, declarator: Optional[CParser.DeclaratorContext]) \
+            -> CParser.InitDeclaratorListContext:
+        ctx = self._wrap(CParser.InitDeclaratorListContext, self._init_declarator(declarator))
+        while self._la() == T[',']:
+            ctx = self._wrap(CParser.InitDeclaratorListContext, ctx)
+            self._consume(ctx)
+            self._add(ctx, self._init_declarator(None))
+            self._done(ctx)
+        return ctx
+
+    def _init_declarator(self, declarator: Optional[CParser.DeclaratorContext]) -> CParser.InitDeclaratorContext:
+        if declarator is None:
+            declarator = self.declarator()
+        ctx = self._wrap(CParser.InitDeclaratorContext, declarator)
+        if self._la() == T['=']:
+            self._consume(ctx)
+            self._add(ctx, self.initializer())
+        return self._done(ctx)
+
+    def initializer(self) -> CParser.InitializerContext:
+        ctx = self._node(CParser.InitializerContext)
+        if self._la() != T['{']:
+            self._add(ctx, self.assignmentExpression())
+            return self._done(ctx)
+        self._consume(ctx)
+        self._add(ctx, self.initializerList())
+        if self._la() == T[',']:
+            self._consume(ctx)
+        self._match(ctx, T['}'])
+        return self._done(ctx)
+
+    def initializerList(self) -> CParser.InitializerListContext:
+        ctx = self._wrap(CParser.InitializerListContext, self.initializer())
+        while self._la() == T[','] and self._la(2) != T['}']:
+            ctx = self._wrap(CParser.InitializerListContext, ctx)
+            self._consume(ctx)
+            self._add(ctx, self.initializer())
+            self._done(ctx)
+        return ctx
+
+    def declarationSpecifiers(self) -> CParser.DeclarationSpecifiersContext:
+        ctx = self._node(CParser.DeclarationSpecifiersContext)
+        self._add(ctx, self.declarationSpecifier())
+        while True:
+            la = self._la()
+            if la in SPECIFIER_KEYWORDS:
+                self._add(ctx, self.declarationSpecifier())
+            elif la == CParser.Identifier and self._la(2) not in DECLARATOR_FOLLOW:
+                self._add(ctx, self.declarationSpecifier())
+            else:
+                return self._done(ctx)
+
+    def declarationSpecifier(self) -> CParser.DeclarationSpecifierContext:
+        ctx = self._node(CParser.DeclarationSpecifierContext)
+        la = self._la()
+        if la in STORAGE_CLASS_SPECIFIERS:
+            child = self._node(CParser.StorageClassSpecifierContext)
+            self._consume(child)
+        elif la in TYPE_QUALIFIERS:
+            child = self.typeQualifier()
+        elif la in FUNCTION_SPECIFIERS:
+            child = self._node(CParser.FunctionSpecifierContext)
+            if la == T['__declspec']:
+                self._consume(child)
+                self._match(child, T['('])
+                self._match(child, CParser.Identifier)
+                self._match(child, T[')'])
+            else:
+                self._consume(child)
+        else:
+            child = self.typeSpecifier()
+        self._add(ctx, self._done(child))
+        return self._done(ctx)
+
+    def typeQualifier(self) -> CParser.TypeQualifierContext:
+        ctx = self._node(CParser.TypeQualifierContext)
+        if self._la() not in TYPE_QUALIFIERS:
+            self._error()
+        self._consume(ctx)
+        return self._done(ctx)
+
+    def typeSpecifier(self) -> CParser.TypeSpecifierContext:
+        la = self._la()
+        if la in PRIMITIVE_TYPES:
+            ctx = self._node(CParser.TypeSpecifier_1Context)
+            self._add(ctx, self.primitiveType())
+        elif la == CParser.Identifier:
+            ctx = self._node(CParser.TypeSpecifier_2Context)
+            name = self._node(CParser.TypedefNameContext)
+            self._consume(name)
+            self._add(ctx, self._done(name))
+        elif la == T['struct']:
+            ctx = self._node(CParser.TypeSpecifier_4Context)
+            self._add(ctx, self.structSpecifier())
+        elif la == T['enum']:
+            ctx = self._node(CParser.TypeSpecifier_5Context)
+            self._add(ctx, self.enumSpecifier())
+        else:
+            self._error()
+        self._done(ctx)
+        while self._la() == T['*']:
+            ctx = self._wrap(CParser.TypeSpecifier_3Context, ctx)
+            self._add(ctx, self.pointer())
+            self._done(ctx)
+        return ctx
+
+    def primitiveType(self) -> CParser.PrimitiveTypeContext:
+        ctx = self._node(CParser.PrimitiveTypeContext)
+        if self._la() not in PRIMITIVE_TYPES:
+            self._error()
+        long = self._la() == T['long']
+        self._consume(ctx)
+        if long and self._la() == T['long']:
+            self._consume(ctx)
+        return self._done(ctx)
+
+    def pointer(self) -> CParser.PointerContext:
+        ctx = self._wrap(CParser.PointerContext, self.qualifiedPointer())
+        while self._la() == T['*']:
+            ctx = self._wrap(CParser.PointerContext, ctx)
+            self._add(ctx, self.qualifiedPointer())
+            self._done(ctx)
+        return ctx
+
+    def qualifiedPointer(self) -> CParser.QualifiedPointerContext:
+        ctx = self._node(CParser.QualifiedPointerContext)
+        self._match(ctx, T['*'])
+        if self._la() in TYPE_QUALIFIERS:
+            qualifiers = self._node(CParser.TypeQualifierListContext)
+            while self._la() in TYPE_QUALIFIERS:
+                self._add(qualifiers, self.typeQualifier())
+            self._add(ctx, self._done(qualifiers))
+        return self._done(ctx)
+
+    def structSpecifier(self) -> CParser.StructSpecifierContext:
+        has_body = self._la(2) == T['{'] or (self._la(2) == CParser.Identifier and self._la(3) == T['{'])
+        ctx = self._node(CParser.StructSpecifier_1Context if has_body else CParser.StructSpecifier_2Context)
+        self._match(ctx, T['struct'])
+        if not has_body:
+            self._match(ctx, CParser.Identifier)
+            return self._done(ctx)
+        if self._la() == CParser.Identifier:
+            self._consume(ctx)
+        self._match(ctx, T['{'])
+        if self._la() != T['}']:
+            declarations = self._wrap(CParser.StructDeclarationListContext, self.structDeclaration())
+            while self._la() != T['}']:
+                declarations = self._wrap(CParser.StructDeclarationListContext, declarations)
+                self._add(declarations, self.structDeclaration())
+                self._done(declarations)
+            self._add(ctx, declarations)
+        self._match(ctx, T['}'])
+        return self._done(ctx)
+
+    def structDeclaration(self) -> CParser.StructDeclarationContext:
+        ctx = self._wrap(CParser.StructDeclarationContext, self.declarationSpecifiers())
+        if self._la() != T[';']:
+            declarators = self._wrap(CParser.StructDeclaratorListContext, self.declarator())
+            while self._la() == T[',']:
+                declarators = self._wrap(CParser.StructDeclaratorListContext, declarators)
+                self._consume(declarators)
+                self._add(declarators, self.declarator())
+                self._done(declarators)
+            self._add(ctx, declarators)
+        self._match(ctx, T[';'])
+        return self._done(ctx)
+
+    def enumSpecifier(self) -> CParser.EnumSpecifierContext:
+        ctx = self._node(CParser.EnumSpecifierContext)
+        self._match(ctx, T['enum'])
+        if self._la() == CParser.Identifier:
+            self._consume(ctx)
+            if self._la() != T['{']:
+                return self._done(ctx)
+        self._match(ctx, T['{'])
+        enumerators = self._wrap(CParser.EnumeratorListContext, self.enumerator())
+        while self._la() == T[','] and self._la(2) != T['}']:
+            enumerators = self._wrap(CParser.EnumeratorListContext, enumerators)
+            self._consume(enumerators)
+            self._add(enumerators, self.enumerator())
+            self._done(enumerators)
+        self._add(ctx, enumerators)
+        if self._la() == T[',']:
+            self._consume(ctx)
+        self._match(ctx, T['}'])
+        return self._done(ctx)
+
+    def enumerator(self) -> CParser.EnumeratorContext:
+        ctx = self._node(CParser.EnumeratorContext)
+        self._match(ctx, CParser.Identifier)
+        if self._la() == T['=']:
+            self._consume(ctx)
+            constant = self._wrap(CParser.ConstantExpressionContext, self.conditionalExpression())
+            self._add(ctx, constant)
+        return self._done(ctx)
+
+    def declarator(self) -> CParser.DeclaratorContext:
+        ctx = self._node(CParser.DeclaratorContext)
+        if self._la() == T['*']:
+            self._add(ctx, self.pointer())
+        self._add(ctx, self.directDeclarator())
+        return self._done(ctx)
+
+    def directDeclarator(self) -> CParser.DirectDeclaratorContext:
+        la = self._la()
+        if la == CParser.Identifier:
+            ctx = self._node(CParser.DirectDeclarator_1Context)
+            self._consume(ctx)
+        elif la == T['(']:
+            ctx = self._node(CParser.DirectDeclarator_2Context)
+            self._consume(ctx)
+            self._add(ctx, self.declarator())
+            self._match(ctx, T[')'])
+        else:
+            self._error()
+        self._done(ctx)
+        while True:
+            la = self._la()
+            if la == T['[']:
+                ctx = self._wrap(CParser.DirectDeclarator_3Context, ctx)
+                self._consume(ctx)
+                if self._la() != T[']']:
+                    self._add(ctx, self.assignmentExpression())
+                self._match(ctx, T[']'])
+            elif la == T['(']:
+                ctx = self._wrap(CParser.DirectDeclarator_4Context, ctx)
+                self._consume(ctx)
+                self._add(ctx, self.parameterTypeList())
+                self._match(ctx, T[')'])
+            else:
+                return ctx
+            self._done(ctx)
+
+    def parameterTypeList(self) -> CParser.ParameterTypeListContext:
+        ctx = self._node(CParser.ParameterTypeListContext)
+        if self._la() == T[')']:
+            return self._done(ctx)
+        parameters = self._wrap(CParser.ParameterListContext, self.parameterDeclaration())
+        while self._la() == T[','] and self._la(2) != T['...']:
+            parameters = self._wrap(CParser.ParameterListContext, parameters)
+            self._consume(parameters)
+            self._add(parameters, self.parameterDeclaration())
+            self._done(parameters)
+        self._add(ctx, parameters)
+        if self._la() == T[',']:
+            self._consume(ctx)
+            self._match(ctx, T['...'])
+        return self._done(ctx)
+
+    def parameterDeclaration(self) -> CParser.ParameterDeclarationContext:
+        ctx = self._wrap(CParser.ParameterDeclarationContext, self.declarationSpecifiers())
+        self._add(ctx, self.declarator())
+        return self._done(ctx)
+
+    def typeName(self) -> CParser.TypeNameContext:
+        return self._wrap(CParser.TypeNameContext, self.typeSpecifier())
+
+    def _scan_type_name(self, k: int) -> int:
+        """
+        不建立结点, 从第 k 个记号开始向前看一个 typeName.
+
+        Returns:
+            int: typeName 之后的记号的位置, 不是 typeName 时为 0
+        """
+        la = self._la(k)
+        if la in PRIMITIVE_TYPES:
+            k += 2 if la == T['long'] and self._la(k + 1) == T['long'] else 1
+        elif la == CParser.Identifier:
+            k += 1
+        elif la == T['struct'] or la == T['enum']:
+            if self._la(k + 1) != CParser.Identifier or self._la(k + 2) == T['{']:
+                return 0
+            k += 2
+        else:
+            return 0
+        while self._la(k) == T['*']:
+            k += 1
+            while self._la(k) in TYPE_QUALIFIERS:
+                k += 1
+        return k
+
+    # 语句
+
+    def statement(self) -> CParser.StatementContext:
+        ctx = self._node(CParser.StatementContext)
+        la = self._la()
+        if la == T['{']:
+            child = self.compoundStatement()
+        elif la == T['if'] or la == T['switch']:
+            child = self.selectionStatement()
+        elif la == T['while'] or la == T['do'] or la == T['for']:
+            child = self.iterationStatement()
+        elif la == T['continue'] or la == T['break'] or la == T['return']:
+            child = self.jumpStatement()
+        else:
+            child = self.expressionStatement()
+        self._add(ctx, child)
+        return self._done(ctx)
+
+    def compoundStatement(self) -> CParser.CompoundStatementContext:
+        ctx = self._node(CParser.CompoundStatementContext)
+        self._match(ctx, T['{'])
+        if self._la() != T['}']:
+            items = self._node(CParser.BlockItemListContext)
+            while self._la() != T['}']:
+                self._add(items, self._block_item())
+            self._add(ctx, self._done(items))
+        self._match(ctx, T['}'])
+        return self._done(ctx)
+
+    def _block_item(self) -> ParserRuleContext:
+        # blockItemList 中的一项: 语句或声明
+        la = self._la()
+        if la in SPECIFIER_KEYWORDS:
+            return self.declaration()
+        if la != CParser.Identifier:
+            return self.statement()
+        if self._la(2) == CParser.Identifier:
+            return self.declaration()
+        statement = self._speculate(self.statement)
+        if statement is not None:
+            return statement
+        return self.declaration()
+
+    def expressionStatement(self) -> CParser.ExpressionStatementContext:
+        ctx = self._node(CParser.ExpressionStatementContext)
+        if self._la() != T[';']:
+            self._add(ctx, self.expression())
+        self._match(ctx, T[';'])
+        return self._done(ctx)
+
+    def selectionStatement(self) -> CParser.SelectionStatementContext:
+        # else if 链用循环分析, 不递归: else 之后的 statement 和其中的 selectionStatement 直接创建,
+        # 它们与外层在同一个记号结束, 最后一起设置 stop
+        ctx = outer = self._node(CParser.SelectionStatementContext)
+        chain = []
+        while True:
+            is_if = self._la() == T['if']
+            self._consume(ctx)
+            self._match(ctx, T['('])
+            self._add(ctx, self.expression())
+            self._match(ctx, T[')'])
+            self._add(ctx, self.statement())
+            if not is_if or self._la() != T['else']:
+                break
+            self._consume(ctx)
+            if self._la() != T['if']:
+                self._add(ctx, self.statement())
+                break
+            statement = self._node(CParser.StatementContext)
+            self._add(ctx, statement)
+            chain.append(ctx)
+            chain.append(statement)
+            ctx = self._node(CParser.SelectionStatementContext)
+            self._add(statement, ctx)
+        self._done(ctx)
+        for ctx in chain:
+            self._done(ctx)
+        return outer
+
+    def iterationStatement(self) -> CParser.IterationStatementContext:
+        ctx = self._node(CParser.IterationStatementContext)
+        la = self._la()
+        self._consume(ctx)
+        if la == T['while']:
+            self._match(ctx, T['('])
+            self._add(ctx, self.expression())
+            self._match(ctx, T[')'])
+            self._add(ctx, self.statement())
+        elif la == T['do']:
+            self._add(ctx, self.statement())
+            self._match(ctx, T['while'])
+            self._match(ctx, T['('])
+            self._add(ctx, self.expression())
+            self._match(ctx, T[')'])
+            self._match(ctx, T[';'])
+        else:
+            self._match(ctx, T['('])
+            ctx.first = self.forInitialization()
+            self._add(ctx, ctx.first)
+            self._match(ctx, T[';'])
+            if self._la() != T[';']:
+                ctx.second = self._wrap(CParser.ForExpressionContext, self.expression())
+                self._add(ctx, ctx.second)
+            self._match(ctx, T[';'])
+            if self._la() != T[')']:
+                ctx.third = self._wrap(CParser.ForExpressionContext, self.expression())
+                self._add(ctx, ctx.third)
+            self._match(ctx, T[')'])
+            self._add(ctx, self.statement())
+        return self._done(ctx)
+
+    def forInitialization(self) -> CParser.ForInitializationContext:
+        ctx = self._node(CParser.ForInitializationContext)
+        la = self._la()
+        if la == T[';']:
+            return self._done(ctx)
+        if la in SPECIFIER_KEYWORDS or (la == CParser.Identifier and self._la(2) == CParser.Identifier):
+            child = self.forDeclaration()
+        elif la != CParser.Identifier:
+            child = self.expression()
+        else:
+            child = self._speculate(self._for_expression)
+            if child is None:
+                child = self.forDeclaration()
+        self._add(ctx, child)
+        return self._done(ctx)
+
+    def _for_expression(self) -> CParser.ExpressionContext:
+        # for 的初始化部分作为表达式, 其后必须是 ;
+        expression = self.expression()
+        if self._la() != T[';']:
+            self._error_expecting(T[';'])
+        return expression
+
+    def jumpStatement(self) -> CParser.JumpStatementContext:
+        ctx = self._node(CParser.JumpStatementContext)
+        la = self._la()
+        self._consume(ctx)
+        if la == T['return'] and self._la() != T[';']:
+            self._add(ctx, self.expression())
+        self._match(ctx, T[';'])
+        return self._done(ctx)
+
+    # 表达式
+
+    def expression(self) -> CParser.ExpressionContext:
+        ctx = self._wrap(CParser.Expression_1Context, self.assignmentExpression())
+        while self._la() == T[',']:
+            ctx = self._wrap(CParser.Expression_2Context, ctx)
+            self._consume(ctx)
+            self._add(ctx, self.assignmentExpression())
+            self._done(ctx)
+        return ctx
+
+    def assignmentExpression(self) -> CParser.AssignmentExpressionContext:
+        operand = self.castExpression()
+        if isinstance(operand, CParser.CastExpression_2Context) and self._la() in ASSIGNMENT_OPERATORS:
+            ctx = self._wrap(CParser.AssignmentExpression_2Context, operand.children[0])
+            operator = self._node(CParser.AssignmentOperatorContext)
+            self._consume(operator)
+            self._add(ctx, self._done(operator))
+            self._add(ctx, self.assignmentExpression())
+            return self._done(ctx)
+        return self._wrap(CParser.AssignmentExpression_1Context, self._conditional(operand))
+
+    def conditionalExpression(self) -> CParser.ConditionalExpressionContext:
+        return self._conditional(self.castExpression())
+
+    def _conditional(self, operand: CParser.CastExpressionContext) -> CParser.ConditionalExpressionContext:
+        # operand 是已经分析的第一个 castExpression
+        ctx = self._wrap(CParser.ConditionalExpressionContext, self._binary(operand, len(BINARY_LEVELS) - 1))
+        if self._la() == T['?']:
+            self._consume(ctx)
+            self._add(ctx, self.expression())
+            self._match(ctx, T[':'])
+            self._add(ctx, self.conditionalExpression())
+            self._done(ctx)
+        return ctx
+
+    def _binary(self, operand: ParserRuleContext, max_level: int) -> ParserRuleContext:
+        """
+        优先级爬升: 以 castExpression operand 为最左的操作数, 分析到第 max_level 层 (BINARY_LEVELS) 为止.
+        """
+        left = operand
+        level = -1
+        while True:
+            entry = BINARY_OPERATORS.get(self._la())
+            if entry is None or entry[0] > max_level:
+                return self._lift(left, level, max_level)
+            op_level, cls = entry
+            left = self._wrap(cls, self._lift(left, level, op_level))
+            self._consume(left)
+            self._add(left, self._binary(self.castExpression(), op_level - 1))
+            self._done(left)
+            level = op_level
+
+    def _lift(self, ctx: ParserRuleContext, level: int, target: int) -> ParserRuleContext:
+        # 用各层只有一个子结点的 context 把第 level 层的 ctx 包装到第 target 层
+        for i in range(level + 1, target + 1):
+            ctx = self._wrap(BINARY_LEVELS[i][0], ctx)
+        return ctx
+
+    def castExpression(self) -> CParser.CastExpressionContext:
+        if self._la() == T['('] and self._is_cast():
+            ctx = self._node(CParser.CastExpression_1Context)
+            self._consume(ctx)
+            self._add(ctx, self.typeName())
+            self._match(ctx, T[')'])
+            self._add(ctx, self.castExpression())
+            return self._done(ctx)
+        return self._wrap(CParser.CastExpression_2Context, self.unaryExpression())
+
+    def _is_cast(self) -> bool:
+        # 当前的 ( 是否开始一个类型转换
+        k = self._scan_type_name(2)
+        if k == 0 or self._la(k) != T[')']:
+            return False
+        return self._la(2) != CParser.Identifier or self._la(k + 1) in CAST_START
+
+    def unaryExpression(self) -> CParser.UnaryExpressionContext:
+        la = self._la()
+        if la == T['++'] or la == T['--']:
+            ctx = self._node(CParser.UnaryExpression_2Context if la == T['++'] else CParser.UnaryExpression_3Context)
+            self._consume(ctx)
+            self._add(ctx, self.unaryExpression())
+        elif la in UNARY_OPERATORS:
+            ctx = self._node(CParser.UnaryExpression_4Context)
+            operator = self._node(CParser.UnaryOperatorContext)
+            self._consume(operator)
+            self._add(ctx, self._done(operator))
+            self._add(ctx, self.castExpression())
+        elif la == T['sizeof']:
+            if self._la(2) == T['('] and self._is_sizeof_type():
+                ctx = self._node(CParser.UnaryExpression_6Context)
+                self._consume(ctx)
+                self._consume(ctx)
+                self._add(ctx, self.typeName())
+                self._match(ctx, T[')'])
+            else:
+                ctx = self._node(CParser.UnaryExpression_5Context)
+                self._consume(ctx)
+                self._add(ctx, self.unaryExpression())
+        else:
+            return self._wrap(CParser.UnaryExpression_1Context, self.postfixExpression())
+        return self._done(ctx)
+
+    def _is_sizeof_type(self) -> bool:
+        # sizeof ( 之后是否是 typeName; sizeof ( 标识符 ) 按表达式处理
+        k = self._scan_type_name(3)
+        if k == 0 or self._la(k) != T[')']:
+            return False
+        return self._la(3) != CParser.Identifier or k != 4
+
+    def postfixExpression(self) -> CParser.PostfixExpressionContext:
+        ctx = self._wrap(CParser.PostfixExpression_1Context, self.primaryExpression())
+        while True:
+            la = self._la()
+            if la == T['[']:
+                ctx = self._wrap(CParser.PostfixExpression_2Context, ctx)
+                self._consume(ctx)
+                self._add(ctx, self.expression())
+                self._match(ctx, T[']'])
+            elif la == T['(']:
+                ctx = self._wrap(CParser.PostfixExpression_3Context, ctx)
+                self._consume(ctx)
+                if self._la() != T[')']:
+                    arguments = self._wrap(CParser.ArgumentExpressionListContext, self.assignmentExpression())
+                    while self._la() == T[',']:
+                        arguments = self._wrap(CParser.ArgumentExpressionListContext, arguments)
+                        self._consume(arguments)
+                        self._add(arguments, self.assignmentExpression())
+                        self._done(arguments)
+                    self._add(ctx, arguments)
+                self._match(ctx, T[')'])
+            elif la == T['.'] or la == T['->']:
+                ctx = self._wrap(CParser.PostfixExpression_4Context if la == T['.']
+                                 else CParser.PostfixExpression_5Context, ctx)
+                self._consume(ctx)
+                self._match(ctx, CParser.Identifier)
+            elif la == T['++'] or la == T['--']:
+                ctx = self._wrap(CParser.PostfixExpression_6Context if la == T['++']
+                                 else CParser.PostfixExpression_7Context, ctx)
+                self._consume(ctx)
+            else:
+                return ctx
+            self._done(ctx)
+
+    def primaryExpression(self) -> CParser.PrimaryExpressionContext:
+        ctx = self._node(CParser.PrimaryExpressionContext)
+        la = self._la()
+        if la == CParser.Identifier:
+            self._consume(ctx)
+        elif la == CParser.StringLiteral:
+            while self._la() == CParser.StringLiteral:
+                self._consume(ctx)
+        elif la in CONSTANTS:
+            constant = self._node(CParser.ConstantContext)
+            self._consume(constant)
+            self._add(ctx, self._done(constant))
+        elif la == T['(']:
+            self._consume(ctx)
+            self._add(ctx, self.expression())
+            self._match(ctx, T[')'])
+        else:
+            self._error()
+        return self._done(ctx)
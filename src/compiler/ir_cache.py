@@ -0,0 +1,166 @@
+import hashlib
+import os
+import pickle
+import re
+
+from typing import Dict, Iterable, List, Optional, Tuple, Any
+
+from llvmlite import ir
+
+from .values import TypedValue, PendingDeclaration, ElementNamedLiteralStructType
+
+# 函数体中对字符串常量的引用, 见 Visitor.str_constant
+STRING_REFERENCE = re.compile(r'@"(\.str\d+)"')
+
+
+def describe_type(typ: ir.Type) -> str:
+    """
+    类型的描述, 与 str(typ) 相比还包含结构体的成员名.
+    """
+    if isinstance(typ, ElementNamedLiteralStructType):
+        members = ', '.join('{} {}'.format(describe_type(element), name)
+                            for element, name in zip(typ.elements, typ.names))
+        return '{' + members + '}'
+    if isinstance(typ, ir.PointerType):
+        return describe_type(typ.pointee) + '*'
+    if isinstance(typ, ir.ArrayType):
+        return '[{} x {}]'.format(typ.count, describe_type(typ.element))
+    if isinstance(typ, ir.FunctionType):
+        args = ', '.join(describe_type(arg) for arg in typ.args)
+        return '{} ({}{})'.format(describe_type(typ.return_type), args, ', ...' if typ.var_arg else '')
+    return str(typ)
+
+
+def describe_symbol(item: Any) -> str:
+    """
+    符号表中一项的描述. 生成函数代码时只用到这里包含的内容, 描述相同的符号生成的代码相同.
+    """
+    if item is None:
+        return 'undefined'
+    if isinstance(item, PendingDeclaration):
+        # 与加入模块之后的描述相同 (见 Visitor.materialize), 所以声明是否已经被其他函数引用不影响 key
+        if isinstance(item.type, ir.FunctionType):
+            return 'value {} False False @"{}" '.format(describe_type(item.type.as_pointer()), item.name)
+        return 'value {} False True @"{}"'.format(describe_type(item.type), item.name)
+    if isinstance(item, ir.Type):
+        return 'type ' + describe_type(item)
+    if isinstance(item, TypedValue):
+        value = item.ir_value
+        if isinstance(value, ir.Constant):
+            reference = str(value)
+        elif isinstance(value, ir.Function):
+            reference = '{} {}'.format(value.get_reference(), value.calling_convention)
+        else:
+            reference = value.get_reference()
+        return 'value {} {} {} {}'.format(describe_type(item.type), item.constant, item.lvalue_ptr, reference)
+    return repr(item)
+
+
+class CachedFunction:
+    """
+    一个函数定义生成的代码: 函数体的文本和它按首次使用的顺序引用的全局符号和字符串常量.
+    """
+
+    def __init__(self, body: str, references: List[Tuple[str, Optional[str]]]):
+        """
+        Args:
+            body (str): 函数体各基本块的文本, 不含函数头和花括号
+            references (List[Tuple[str, Optional[str]]]): 引用的函数或全局变量的名字和 None,
+                或者字符串常量在 body 中的名字和它的值
+        """
+        self.body = body
+        self.references = references
+
+
+class CachedBody:
+    """
+    代替函数的各基本块放在 ir.Function.blocks 中, 输出时给出缓存的函数体.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def descr(self, buf: List[str]) -> None:
+        buf.append(self.text)
+
+
+class IRCache:
+    """
+    按函数保存的 IR 缓存, 用于修改大文件中少数函数后的重新编译.
+
+    key 包含格式版本, 目标平台, 函数定义的全部记号以及函数中的标识符在全局作用域中对应的符号的描述
+    (类型, typedef, 结构体, 枚举常量, 函数和全局变量), 因此函数本身或它引用的声明改变时不会命中.
+    命中时只处理函数头, 函数体直接使用缓存的文本; 引用的声明按原来的顺序加入模块,
+    字符串常量按原来的顺序重新取得, 改名后替换.
+    流式编译并使用 FastParser 时, 命中的函数在语法分析时就跳过函数体 (见 Visitor.skip_function_body).
+    保存时只保留本次编译用到的项.
+    """
+
+    # 缓存格式或 Visitor 生成代码的方式改变时增加
+    version: int = 2
+
+    def __init__(self, target: Tuple[str, str], entries: Optional[Dict[str, CachedFunction]] = None):
+        """
+        Args:
+            target (Tuple[str, str]): 目标平台和 data layout
+            entries (Optional[Dict[str, CachedFunction]]): 已有的缓存项
+        """
+        self.target = target
+        self.entries: Dict[str, CachedFunction] = entries or {}
+        # 本次编译用到或新生成的项
+        self.used: Dict[str, CachedFunction] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, tokens: Iterable[str], symbols: Iterable[str]) -> str:
+        """
+        Args:
+            tokens (Iterable[str]): 函数定义的各记号
+            symbols (Iterable[str]): 函数引用的各符号的描述, 见 describe_symbol
+
+        Returns:
+            str
+        """
+        digest = hashlib.sha256()
+        digest.update(repr((IRCache.version, self.target)).encode())
+        for token in tokens:
+            digest.update(token.encode())
+            digest.update(b'\0')
+        digest.update(b'\1')
+        for symbol in symbols:
+            digest.update(symbol.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[CachedFunction]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used[key] = entry
+        return entry
+
+    def put(self, key: str, entry: CachedFunction) -> None:
+        self.used[key] = entry
+
+    def save(self, path: str) -> None:
+        # 与预编译头相同, 先写入临时文件
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump((IRCache.version, self.target, self.used), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path: str, target: Tuple[str, str]) -> 'IRCache':
+        """
+        读取缓存. 文件不存在, 无法读取或目标平台不同时得到空的缓存.
+        """
+        try:
+            with open(path, 'rb') as f:
+                version, cached_target, entries = pickle.load(f)
+        except Exception:
+            return IRCache(target)
+        if version != IRCache.version or cached_target != target:
+            return IRCache(target)
+        return IRCache(target, entries)
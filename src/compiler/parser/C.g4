@@ -219,7 +219,9 @@ initializerList
     | initializerList ',' initializer
     ;
 
-declarationSpecifiers: declarationSpecifier+ ;
+// Non-greedy: in `T x;` the last identifier is the declarator rather than another
+// typedefName, so SLL prediction picks the same tree as full LL.
+declarationSpecifiers: declarationSpecifier+? ;
 
 declarationSpecifier
     : storageClassSpecifier
@@ -0,0 +1,99 @@
+import os
+import pickle
+
+from typing import Dict, List, Optional, Tuple, Any
+
+from preprocessor import MacroTable
+
+
+class PrecompiledHeader:
+    """
+    预编译头: 主文件开头的 #include 部分预处理并分析之后的宏表和 Visitor 状态
+    (全局符号表, typedef, 结构体类型, 已声明的函数等).
+
+    key 包含格式版本, 目标平台, 是否延迟生成函数体, 是否只做检查, -D 宏, 头文件目录, 主文件所在目录和 #include 部分的文本;
+    此外所有被包含的头文件都不能被修改过. 任何一项不同时都需要重新生成.
+    """
+
+    # 预编译头格式或 Visitor 状态的结构改变时增加
+    version: int = 10
+
+    def __init__(self, key: Tuple[Any, ...], files: Dict[str, int], macros: MacroTable, visitor):
+        """
+        Args:
+            key (Tuple[Any, ...]): make_key 的结果
+            files (Dict[str, int]): 被包含的头文件的绝对路径 -> 修改时间
+            macros (MacroTable): 处理完 #include 部分后的宏表
+            visitor (Visitor): 分析完 #include 部分后的 Visitor
+        """
+        self.key: Tuple[Any, ...] = key
+        self.files: Dict[str, int] = files
+        self.macros: MacroTable = macros
+        self.visitor = visitor
+
+    @staticmethod
+    def make_key(input_file: str, prefix: List[str], target_arch: str, include_dirs: List[str],
+                 macros: Dict[str, Optional[str]], lazy_functions: bool = False,
+                 syntax_only: bool = False) -> Tuple[Any, ...]:
+        """
+        Args:
+            input_file (str): 主文件
+            prefix (List[str]): 主文件开头 #include 部分的各行
+            target_arch (str): 目标平台
+            include_dirs (List[str]): 头文件目录
+            macros (Dict[str, Optional[str]]): -D 定义的宏
+            lazy_functions (bool): 是否延迟生成函数体, 此时头文件中的函数定义保存在 Visitor 中
+            syntax_only (bool): 是否只做检查, 此时头文件中的函数没有生成指令
+
+        Returns:
+            Tuple[Any, ...]
+        """
+        return (PrecompiledHeader.version,
+                target_arch,
+                lazy_functions,
+                syntax_only,
+                tuple(sorted(macros.items(), key=lambda item: item[0])),
+                tuple(os.path.abspath(include_dir) for include_dir in include_dirs),
+                os.path.dirname(os.path.abspath(input_file)),
+                tuple(prefix))
+
+    def is_fresh(self) -> bool:
+        """
+        被包含的头文件是否都未被修改.
+        """
+        for path, mtime in self.files.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def save(self, path: str) -> None:
+        # 先写入临时文件, 避免其它编译进程读到不完整的文件
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path: str, key: Tuple[Any, ...]) -> Optional['PrecompiledHeader']:
+        """
+        读取预编译头.
+
+        Args:
+            path (str): 文件路径
+            key (Tuple[Any, ...]): 当前编译的 make_key 结果
+
+        Returns:
+            Optional[PrecompiledHeader]: 文件不存在, 无法读取或已过期时为 None
+        """
+        try:
+            with open(path, 'rb') as f:
+                header = pickle.load(f)
+        except Exception:
+            # 文件损坏或由不兼容的版本生成
+            return None
+        if not isinstance(header, PrecompiledHeader) or header.key != key or not header.is_fresh():
+            return None
+        return header
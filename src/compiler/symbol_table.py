@@ -9,15 +9,24 @@ from .utils import Result
 class SymbolTable:
     """
     符号表类
+
+    每个名字对应一个定义的栈, 每层作用域记录它定义的名字, 退出时从各名字的栈中弹出.
     """
 
     def __init__(self):
         """
         建立符号表.
         """
-        # table：table[i]是一个字典，存着key，value组
-        self.table: List[Dict[str, Union[TypedValue, ir.Type, ir.Function]]] = [{}]
+        # bindings：每个名字可见的各层定义，栈顶是最内层的定义，元素是 (层数, value, 序号)
+        # 查找时不随作用域的层数增加而变慢
+        self.bindings: Dict[str, List[Tuple[int, Union[TypedValue, ir.Type, ir.Function], int]]] = {}
+        # scopes：scopes[i] 是第 i 层定义的名字，退出作用域时按它撤销
+        self.scopes: List[List[str]] = [[]]
         self.current_level: int = 0
+        # 下一个定义的序号，按定义的顺序递增
+        self.sequence: int = 0
+        # 不为 None 时，序号不小于它的全局定义不可见，见 checkpoint
+        self.global_limit: Optional[int] = None
 
     def get_item(self, item: str) -> Optional[Union[TypedValue, ir.Type]]:
         """
@@ -29,10 +38,13 @@ class SymbolTable:
         Returns:
             str: 成功返回元素，失败返回 None
         """
-        for i in range(self.current_level, -1, -1):
-            if item in self.table[i]:
-                return self.table[i][item]
-        return None
+        stack = self.bindings.get(item)
+        if stack is None:
+            return None
+        level, value, number = stack[-1]
+        if level == 0 and self.global_limit is not None and number >= self.global_limit:
+            return None
+        return value
 
     def add_item(self, key: str, value: Union[TypedValue, ir.Type, ir.Function]) -> Result[None]:
         """
@@ -45,11 +57,44 @@ class SymbolTable:
         Returns:
             Optional[str]: 如果出现了异常，返回具体错误信息，否则返回 None
         """
-        if key in self.table[self.current_level]:
+        stack = self.bindings.get(key)
+        if stack is None:
+            self.bindings[key] = [(self.current_level, value, self.sequence)]
+        elif stack[-1][0] == self.current_level:
             return Result(False, message="redefinition")
-        self.table[self.current_level][key] = value
+        else:
+            stack.append((self.current_level, value, self.sequence))
+        self.sequence += 1
+        self.scopes[self.current_level].append(key)
         return Result(True, value=None)
 
+    def replace_item(self, key: str, value: Union[TypedValue, ir.Type, ir.Function]) -> None:
+        """
+        替换符号表中可见的元素, 元素必须存在.
+
+        Args:
+            key (str): 待替换的 key
+            value (TypedValue): 新的 value
+
+        Returns:
+            None
+        """
+        stack = self.bindings[key]
+        level, _, number = stack[-1]
+        stack[-1] = (level, value, number)
+
+    def checkpoint(self) -> int:
+        """
+        记录当前的位置, 之后用 global_limit 恢复这个位置的全局作用域.
+
+        延迟生成的函数体在文件末尾才生成, 此时把 global_limit 设为定义函数时的 checkpoint,
+        函数体就只能看到定义之前的全局名字, 与立即生成时相同.
+
+        Returns:
+            int: 下一个定义的序号
+        """
+        return self.sequence
+
     def exist(self, item: str) -> bool:
         """
         判断元素是否在符号表里，包括局部和全局.
@@ -70,7 +115,7 @@ class SymbolTable:
             None
         """
         self.current_level += 1
-        self.table.append({})
+        self.scopes.append([])
 
     def quit_scope(self) -> None:
         """
@@ -81,7 +126,11 @@ class SymbolTable:
         """
         if self.current_level == 0:
             return
-        self.table.pop(-1)
+        for key in self.scopes.pop(-1):
+            stack = self.bindings[key]
+            stack.pop(-1)
+            if not stack:
+                del self.bindings[key]
         self.current_level -= 1
 
     def is_global(self) -> bool:
@@ -91,4 +140,4 @@ class SymbolTable:
         Returns:
             bool
         """
-        return len(self.table) == 1
+        return self.current_level == 0
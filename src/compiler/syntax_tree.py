@@ -0,0 +1,271 @@
+import inspect
+
+from antlr4.ParserRuleContext import ParserRuleContext
+from antlr4.Token import Token
+from antlr4.tree.Tree import TerminalNode
+
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional
+
+from .parser.CParser import CParser
+
+
+class Leaf:
+    """
+    语法树中的记号. 只保存 Visitor 和报错需要的内容, 不引用原来的记号和记号流.
+    """
+    __slots__ = ('type', 'text', 'line', 'column', 'filepath')
+
+    # 记号不属于任何规则
+    rule: Optional[type] = None
+
+    def __init__(self, token: Token):
+        self.type: int = token.type
+        self.text: str = token.text
+        self.line: int = token.line
+        self.column: int = token.column
+        self.filepath: Optional[str] = getattr(token, 'filepath', None)
+
+    def getText(self) -> str:
+        return self.text
+
+    def getChildCount(self) -> int:
+        return 0
+
+    def accept(self, visitor):
+        return visitor.visitTerminal(self)
+
+    def __str__(self):
+        return self.text
+
+
+class Node:
+    """
+    语法树中的规则结点, 代替 CParser 的 context.
+
+    每个 context 类都有一个对应的 Node 子类 (见 NODE_TYPES), 提供 Visitor 用到的接口:
+    同名的访问子结点的方法, getChild, getChildCount, getText, accept 和 start;
+    for 语句的 first, second, third 等标签也保留. 不保存父结点, 结束记号和所属的分析器.
+
+    结点可能代替了被折叠的上层结点 (见 Lowering), 因此按规则查找子结点时比较的是 rule,
+    而不是结点本身的类.
+    """
+    __slots__ = ('children', 'start', 'rule')
+
+    # 对应的 Visitor 方法名
+    visit_name: str = 'visitChildren'
+    # 规则对应的 Node 类, 带标签的备选分支的 Node 类的 rule_type 是规则的 Node 类
+    rule_type: Optional[type] = None
+
+    def __init__(self, children: List['Node'], start: Leaf):
+        self.children: List[Node] = children
+        # 第一个记号, 用于报错
+        self.start: Leaf = start
+        # 结点在父结点中所处的规则的 Node 类; 结点代替了被折叠的结点时是最上层被折叠的结点的规则
+        self.rule: type = self.rule_type
+
+    def getChild(self, i: int):
+        return self.children[i] if i < len(self.children) else None
+
+    def getChildCount(self) -> int:
+        return len(self.children)
+
+    def getText(self) -> str:
+        return ''.join(child.getText() for child in self.children)
+
+    def accept(self, visitor):
+        method = getattr(visitor, self.visit_name, None)
+        if method is None:
+            return visitor.visitChildren(self)
+        return method(self)
+
+    def _rule_child(self, typ: type, i: int):
+        for child in self.children:
+            if child.rule is typ:
+                if i == 0:
+                    return child
+                i -= 1
+        return None
+
+    def _rule_children(self, typ: type) -> List['Node']:
+        return [child for child in self.children if child.rule is typ]
+
+    def _token_child(self, typ: int, i: int) -> Optional[Leaf]:
+        for child in self.children:
+            if isinstance(child, Leaf) and child.type == typ:
+                if i == 0:
+                    return child
+                i -= 1
+        return None
+
+    def _token_children(self, typ: int) -> List[Leaf]:
+        return [child for child in self.children if isinstance(child, Leaf) and child.type == typ]
+
+
+# context 类 -> 对应的 Node 子类
+NODE_TYPES: Dict[type, type] = {}
+
+# context 类中不是访问子结点的方法
+_CONTEXT_METHODS = frozenset(('__init__', 'getRuleIndex', 'copyFrom', 'enterRule', 'exitRule', 'accept'))
+
+
+def _rule_accessor(typ: type, indexed: bool) -> Callable:
+    if indexed:
+        def accessor(self, i: int = None):
+            return self._rule_children(typ) if i is None else self._rule_child(typ, i)
+    else:
+        def accessor(self):
+            return self._rule_child(typ, 0)
+    return accessor
+
+
+def _token_accessor(typ: int, indexed: bool) -> Callable:
+    if indexed:
+        def accessor(self, i: int = None):
+            return self._token_children(typ) if i is None else self._token_child(typ, i)
+    else:
+        def accessor(self):
+            return self._token_child(typ, 0)
+    return accessor
+
+
+def _context_labels(cls: type) -> List[str]:
+    # 规则中的标签, 例如 iterationStatement 的 first, second, third
+    if cls.__bases__[0] is ParserRuleContext:
+        sample = cls(None)
+    else:
+        sample = cls(None, ParserRuleContext())
+    return [name for name in getattr(sample, '__dict__', ()) if name != 'parser']
+
+
+def _make_node_types() -> None:
+    contexts = [value for value in vars(CParser).values()
+                if isinstance(value, type) and issubclass(value, ParserRuleContext)]
+    rules = {name[0].upper() + name[1:] + 'Context' for name in CParser.ruleNames}
+    # 先建立各规则的 Node 类, 带标签的备选分支的 Node 类是它的子类
+    for cls in sorted(contexts, key=lambda c: c.__bases__[0] is not ParserRuleContext):
+        base = NODE_TYPES.get(cls.__bases__[0], Node)
+        name = cls.__name__[:-len('Context')]
+        node_type = NODE_TYPES[cls] = type(name + 'Node', (base,), {
+            '__slots__': tuple(_context_labels(cls)),
+            '__module__': __name__,
+            'visit_name': 'visit' + name,
+        })
+        if base is Node:
+            node_type.rule_type = node_type
+        # 模块中的名字, 使结点可以被 pickle (预编译头中可能有延迟生成的函数)
+        globals()[node_type.__name__] = node_type
+    for cls in contexts:
+        node_type = NODE_TYPES[cls]
+        for name, method in vars(cls).items():
+            if name in _CONTEXT_METHODS or not inspect.isfunction(method):
+                continue
+            indexed = 'i' in inspect.signature(method).parameters
+            context_name = name[0].upper() + name[1:] + 'Context'
+            if context_name in rules:
+                accessor = _rule_accessor(NODE_TYPES[getattr(CParser, context_name)], indexed)
+            else:
+                accessor = _token_accessor(getattr(CParser, name), indexed)
+            setattr(node_type, name, accessor)
+
+
+_make_node_types()
+
+
+class Lowering:
+    """
+    把 CParser 的语法树转换为 Node 构成的树.
+
+    转换的同时清空原树中各 context 的子结点, 原树及其引用的记号流在转换后即可被释放.
+    pass_through 中的 context 只有一个子结点且它不是记号时, 结点被折叠为它的子结点:
+    子结点的 rule 改为被折叠的结点的规则, 所以仍能通过上层结点的访问方法和标签找到它.
+    例如表达式中单独的标识符不再经过 expression 到 postfixExpression 的十几层结点.
+    """
+
+    def __init__(self, pass_through: Iterable[type] = ()):
+        """
+        Args:
+            pass_through (Iterable[type]): 只有一个子结点时, Visitor 访问它的结果就是访问子结点的结果的 context 类
+        """
+        self.pass_through: FrozenSet[type] = frozenset(pass_through)
+        # 转换后的树中的结点数和被折叠的结点数. 每个被折叠的结点在生成代码时少一次 visit
+        self.nodes = 0
+        self.collapsed = 0
+
+    def lower(self, ctx: ParserRuleContext) -> Node:
+        """
+        Args:
+            ctx (ParserRuleContext): CParser 或 FastParser 得到的语法树
+
+        Returns:
+            Node
+        """
+        # 用显式的栈代替递归, 很长的左递归链 (例如上万项的加法) 和 else if 链不会超过递归深度限制.
+        # 栈中每项是 context, 它原来的子结点, 尚未转换的子结点的迭代器和已转换的子结点
+        original = ctx.children or ()
+        stack = [(ctx, original, iter(original), [])]
+        while True:
+            ctx, original, rest, children = stack[-1]
+            for child in rest:
+                if isinstance(child, TerminalNode):
+                    children.append(Leaf(child.symbol))
+                else:
+                    grandchildren = child.children or ()
+                    stack.append((child, grandchildren, iter(grandchildren), []))
+                    break
+            else:
+                stack.pop()
+                node = self._make_node(ctx, original, children)
+                if not stack:
+                    return node
+                stack[-1][3].append(node)
+
+    def _make_node(self, ctx: ParserRuleContext, original: List, children: List) -> Node:
+        # 由已转换的子结点得到 ctx 对应的结点, 可能折叠为它的子结点
+        ctx.children = None
+        node_type = NODE_TYPES[type(ctx)]
+        if len(children) == 1 and type(ctx) in self.pass_through and isinstance(children[0], Node):
+            child = children[0]
+            child.rule = node_type.rule_type
+            self.collapsed += 1
+            return child
+        if children:
+            first = children[0]
+            start = first if isinstance(first, Leaf) else first.start
+        else:
+            # 空的规则, 例如没有参数的 parameterTypeList
+            start = Leaf(ctx.start)
+        node = node_type(children, start)
+        for label in node.__slots__:
+            value = getattr(ctx, label)
+            setattr(node, label, None if value is None else children[original.index(value)])
+        self.nodes += 1
+        return node
+
+
+def lower(ctx: ParserRuleContext, pass_through: Iterable[type] = ()) -> Node:
+    """
+    把 CParser 的语法树转换为 Node 构成的树, 见 Lowering.
+
+    Args:
+        ctx (ParserRuleContext): CParser 或 FastParser 得到的语法树
+        pass_through (Iterable[type]): 可以折叠的 context 类
+
+    Returns:
+        Node
+    """
+    return Lowering(pass_through).lower(ctx)
+
+
+def leaves(node: Node) -> List[Leaf]:
+    """
+    按顺序得到树中的全部记号.
+    """
+    result = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Leaf):
+            result.append(node)
+        else:
+            stack.extend(reversed(node.children))
+    return result
@@ -0,0 +1,307 @@
+from antlr4.Token import Token, CommonToken
+from antlr4.CommonTokenFactory import CommonTokenFactory
+from antlr4.Lexer import TokenSource
+
+import re
+import string
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from preprocessor import SourceLine
+from preprocessor.macro import TOKEN_PATTERN, ExpansionSpan
+from .errors import ParserError
+from .parser.CParser import CParser
+
+# 关键字和运算符 -> 记号类型
+LITERAL_TYPES: Dict[str, int] = {name[1:-1]: i for i, name in enumerate(CParser.literalNames) if name.startswith("'")}
+
+IDENTIFIER_START = frozenset(string.ascii_letters + '_')
+DIGITS = frozenset(string.digits)
+
+# C.g4 中的 FloatingConstant, IntegerConstant 和 Identifier
+FLOAT = r'[0-9]+\.[0-9]+'
+INTEGER = r'0[xX][0-9a-fA-F]+|[1-9][0-9]*|0[0-7]*'
+NAME = r'[A-Za-z_][A-Za-z0-9_]*'
+
+# 按 CLexer 的规则切分预处理数, 例如 CLexer 没有整数后缀, 1u 是 1 和 u 两个记号
+NUMBER_PATTERN = re.compile('|'.join((FLOAT, INTEGER, NAME, '.')))
+
+# C.g4 中的 EscapeSequence
+ESCAPE_SEQUENCE = r'''\\(?:['"?abfnrtv\\]|[0-7]{1,3}|x[0-9a-fA-F]+)'''
+STRING_PATTERN = re.compile(r'"(?:[^"\\\r\n]|' + ESCAPE_SEQUENCE + r')*"')
+CHARACTER_PATTERN = re.compile(r"'(?:[^'\\\r\n]|" + ESCAPE_SEQUENCE + r")'")
+
+# C.g4 中的 Newline
+NEWLINE_PATTERN = re.compile(r'\r\n?|\n')
+
+# 按长度从长到短排列的运算符, 使正则表达式的选择与 CLexer 的最长匹配一致
+PUNCTUATORS: List[str] = sorted((name for name in LITERAL_TYPES if name[0] not in IDENTIFIER_START),
+                                key=len, reverse=True)
+
+# CLexer 全部规则合成的一个正则表达式, 分组的顺序即匹配的优先顺序
+MASTER_PATTERN = re.compile('|'.join([
+    r'(?P<skip>[ \t]+|' + NEWLINE_PATTERN.pattern + r'|//[^\r\n]*|/\*(?s:.*?)\*/)',
+    # 没有在当前文本中结束的块注释
+    r'(?P<open_comment>/\*)',
+    # 一个记号, 类型由 token_type 得到
+    '(?P<token>' + '|'.join([FLOAT, INTEGER, NAME, STRING_PATTERN.pattern, CHARACTER_PATTERN.pattern]
+                            + [re.escape(p) for p in PUNCTUATORS]) + ')',
+    r'(?P<error>(?s:.))',
+]))
+
+
+def token_type(text: str) -> Optional[int]:
+    """
+    CLexer 的一个记号的类型. PreprocessorTokenSource 和 RegexTokenSource 都用它确定记号的类型.
+
+    Args:
+        text (str): 记号的文本. 以数字开头时应是 FLOAT 或 INTEGER 匹配的整个文本
+
+    Returns:
+        Optional[int]: 记号类型, 不是 CLexer 的记号时返回 None
+    """
+    c = text[0]
+    if c in IDENTIFIER_START:
+        return LITERAL_TYPES.get(text, CParser.Identifier)
+    if c in DIGITS:
+        return CParser.FloatingConstant if '.' in text else CParser.IntegerConstant
+    if c == '"':
+        return CParser.StringLiteral if STRING_PATTERN.fullmatch(text) is not None else None
+    if c == "'":
+        return CParser.CharacterConstant if CHARACTER_PATTERN.fullmatch(text) is not None else None
+    return LITERAL_TYPES.get(text)
+
+
+def recognition_error(token: str, line: int, column: int, filepath: Optional[str] = None) -> ParserError:
+    """
+    与 CLexer 相同的无法识别记号的错误.
+    """
+    return ParserError("token recognition error at: '{}'".format(token), line, column, filepath)
+
+
+class SourceToken(CommonToken):
+    """
+    记录了来源文件的记号, 行号和列号是在来源文件中的位置.
+    """
+    __slots__ = ('filepath',)
+
+
+class PreprocessorTokenSource(TokenSource):
+    """
+    把预处理器产生的各行直接切分为 CParser 的记号, 代替用 CLexer 重新分析预处理后的文本.
+
+    预处理器输出的是展开宏之后的文本而不是记号 (不含宏的行预处理器并不切分), 所以这里用 TOKEN_PATTERN
+    把每行重新切分一次. 记号的类型与 CLexer 的结果相同; 行号取自预处理器记录的来源文件的行,
+    列号按 SourceLine.spans 换算为来源文件的行中的列, 宏展开产生的记号的列是宏调用的位置,
+    因此报错位置是源文件中的位置. 跨行的块注释会被跳过.
+    """
+
+    def __init__(self, lines: Iterable[SourceLine], name: str = '<preprocessed>'):
+        self._lines = iter(lines)
+        self._name = name
+        self._factory = CommonTokenFactory.DEFAULT
+        self._source_pair = (self, None)
+        # 已切分但尚未取走的记号
+        self._tokens: List[SourceToken] = []
+        self._index = 0
+        # 当前行在整个输出中的起始位置
+        self._offset = 0
+        # 是否处于跨行的块注释中
+        self._in_comment = False
+        self._eof: Optional[Token] = None
+        # 当前行的宏调用, 下一个未经过的宏调用的下标, 以及已经过的宏调用使位置比列多出的长度
+        self._spans: Tuple[ExpansionSpan, ...] = ()
+        self._span = 0
+        self._shift = 0
+        # 最近一个记号的位置, CommonToken 创建时读取
+        self.line = 1
+        self.column = 0
+
+    def nextToken(self) -> Token:
+        while self._index >= len(self._tokens):
+            if self._eof is not None:
+                return self._eof
+            self._tokens.clear()
+            self._index = 0
+            line = next(self._lines, None)
+            if line is None:
+                self._eof = self._make_token(Token.EOF, '<EOF>', self._offset, self.column, None)
+                return self._eof
+            self._split(line)
+            self._offset += len(line.text)
+        token = self._tokens[self._index]
+        self._index += 1
+        return token
+
+    def getSourceName(self) -> str:
+        return self._name
+
+    def _make_token(self, typ: int, text: str, start: int, column: int, filepath: Optional[str]) -> SourceToken:
+        self.column = column
+        token = SourceToken(self._source_pair, typ, Token.DEFAULT_CHANNEL, start, start + len(text) - 1)
+        token.text = text
+        token.filepath = filepath
+        return token
+
+    def _split(self, line: SourceLine) -> None:
+        # 把一行切分为记号, 放入 self._tokens
+        text = line.text
+        self.line = line.line
+        spans = self._spans = line.spans
+        self._span = self._shift = 0
+        pos = 0
+        if self._in_comment:
+            end = text.find('*/')
+            if end < 0:
+                return
+            self._in_comment = False
+            pos = end + 2
+        for m in TOKEN_PATTERN.finditer(text, pos):
+            token = m.group()
+            c = token[0]
+            if c in ' \t\r\n':
+                continue
+            if c == '/':
+                if token.startswith(('//', '/*')):
+                    continue
+                if token == '/' and text.startswith('*', m.end()):
+                    # 块注释在此行没有结束
+                    self._in_comment = True
+                    return
+            if c in DIGITS or (c == '.' and len(token) > 1 and token[1] in DIGITS):
+                self._split_number(line, token, m.start())
+                continue
+            start = m.start()
+            typ = token_type(token)
+            if typ is None:
+                self._error(line, token, start)
+            self._tokens.append(self._make_token(typ, token, self._offset + start,
+                                                 self._column(start) if spans else start, line.filepath))
+
+    def _split_number(self, line: SourceLine, number: str, start: int) -> None:
+        # 预处理数可能对应 CLexer 的多个记号. start 是预处理数在 line.text 中的位置
+        for m in NUMBER_PATTERN.finditer(number):
+            token = m.group()
+            typ = token_type(token)
+            if typ is None:
+                self._error(line, token, start + m.start())
+            self._tokens.append(self._make_token(typ, token, self._offset + start + m.start(),
+                                                 self._column(start + m.start()), line.filepath))
+
+    def _error(self, line: SourceLine, token: str, start: int) -> None:
+        raise recognition_error(token, line.line, self._column(start), line.filepath)
+
+    def _column(self, offset: int) -> int:
+        # 当前行中 offset 处在来源文件的行中的列. 同一行中 offset 递增, 所以依次经过各次宏调用
+        spans = self._spans
+        while self._span < len(spans):
+            out_start, out_end, in_start, in_end = spans[self._span]
+            if offset < out_start:
+                break
+            if offset < out_end:
+                return in_start
+            self._shift = out_end - in_end
+            self._span += 1
+        return offset - self._shift
+
+
+class RegexTokenSource(TokenSource):
+    """
+    用一个正则表达式 (MASTER_PATTERN) 对预处理后的文本做词法分析, 代替 CLexer.
+
+    记号的类型, 文本, 行号, 列号和起止位置都与 CLexer 对同样的文本分析的结果相同,
+    行号是预处理结果中的行号. 与 LineInputStream 一样, 文本逐行从迭代器中取出.
+    """
+
+    def __init__(self, lines: Iterable[str], name: str = '<preprocessed>'):
+        self._source = iter(lines)
+        self._name = name
+        self._source_pair = (self, None)
+        # 已读取的行, 用于报错时显示
+        self._lines: List[str] = []
+        # 正在切分的文本, 通常是一行; 块注释跨行时是多行
+        self._text = ''
+        self._pos = 0
+        # self._text 在整个文本中的起始位置
+        self._offset = 0
+        # 当前行的行号及其在 self._text 中的起始位置
+        self.line = 1
+        self._line_start = 0
+        self.column = 0
+        self._eof: Optional[Token] = None
+
+    def nextToken(self) -> Token:
+        if self._eof is not None:
+            return self._eof
+        while True:
+            m = MASTER_PATTERN.match(self._text, self._pos)
+            if m is None:
+                # 当前文本已切分完
+                if not self._read():
+                    self.column = self._pos - self._line_start
+                    self._eof = self._make_token(Token.EOF, '<EOF>', self._pos, self._pos - 1)
+                    return self._eof
+                continue
+            kind = m.lastgroup
+            start, end = m.span()
+            if kind == 'skip':
+                self._pos = end
+                self._skip_lines(start, end)
+            elif kind == 'open_comment':
+                # 读入更多的行直到块注释结束
+                if not self._read():
+                    self.column = start - self._line_start
+                    self._error(m.group())
+            else:
+                text = m.group()
+                self.column = start - self._line_start
+                if kind == 'error':
+                    self._error(text)
+                typ = token_type(text)
+                self._pos = end
+                return self._make_token(typ, text, start, end - 1)
+
+    def getSourceName(self) -> str:
+        return self._name
+
+    def get_line(self, line: int) -> Optional[str]:
+        """
+        获得已读取的第 line 行 (从 1 开始), 不含换行符.
+        """
+        if 1 <= line <= len(self._lines):
+            return self._lines[line - 1].rstrip('\r\n')
+        return None
+
+    def _read(self) -> bool:
+        """
+        读取下一行接在未切分的文本之后.
+
+        Returns:
+            bool: 是否还有下一行
+        """
+        line = next(self._source, None)
+        while line == '':
+            line = next(self._source, None)
+        if line is None:
+            return False
+        self._lines.append(line)
+        rest = self._text[self._pos:]
+        self._offset += self._pos
+        self._line_start -= self._pos
+        self._text = rest + line
+        self._pos = 0
+        return True
+
+    def _skip_lines(self, start: int, end: int) -> None:
+        # 跳过的部分可能是换行或跨行的块注释. 与 CLexer 一样只有 \n 使行号增加, 单独的 \r 只占一列
+        count = self._text.count('\n', start, end)
+        if count:
+            self.line += count
+            self._line_start = self._text.rindex('\n', start, end) + 1
+
+    def _make_token(self, typ: int, text: str, start: int, stop: int) -> CommonToken:
+        token = CommonToken(self._source_pair, typ, Token.DEFAULT_CHANNEL, self._offset + start, self._offset + stop)
+        token.text = text
+        return token
+
+    def _error(self, token: str) -> None:
+        raise recognition_error(token, self.line, self.column)
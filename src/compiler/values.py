@@ -1,4 +1,4 @@
-from typing import List, Tuple, Optional
+from typing import Dict, List, Optional
 
 from llvmlite import ir
 
@@ -24,6 +24,22 @@ class TypedValue:
         return self.name is not None
 
 
+class PendingDeclaration:
+    """
+    尚未加入模块的外部声明: 函数原型或 extern 变量.
+    第一次被引用时才创建对应的 ir.Function 或 ir.GlobalVariable (见 Visitor.materialize),
+    头文件中大量未被使用的声明不会出现在输出中.
+    """
+
+    def __init__(self, typ: ir.Type, name: str):
+        """
+        @param typ:     声明的类型, 函数原型是 ir.FunctionType
+        @param name:    名字
+        """
+        self.type = typ
+        self.name = name
+
+
 def const_value(value: ir.Constant, name: str = None) -> TypedValue:
     """
     返回一个常量值.
@@ -38,6 +54,33 @@ def const_value(value: ir.Constant, name: str = None) -> TypedValue:
     return TypedValue(value, value.type, constant=True, name=name, lvalue_ptr=False)
 
 
+# 结构体成员的 gep 下标常量, 各结构体共用
+_member_indices: List[ir.Constant] = []
+
+
+def member_index(i: int) -> ir.Constant:
+    """
+    第 i 个成员的 gep 下标常量.
+    """
+    while len(_member_indices) <= i:
+        _member_indices.append(ir.Constant(ir.IntType(32), len(_member_indices)))
+    return _member_indices[i]
+
+
+class StructMember:
+    """
+    结构体的成员, 包括匿名结构体成员中的成员.
+    """
+
+    def __init__(self, typ: ir.Type, indices: List[ir.Constant]):
+        """
+        @param typ:         成员的类型
+        @param indices:     从外层结构体到成员的各层 gep 下标常量, 不含最前面的 0
+        """
+        self.type = typ
+        self.indices = indices
+
+
 class ElementNamedLiteralStructType(ir.LiteralStructType):
     """
     成员具名结构体类类型封装
@@ -51,28 +94,22 @@ class ElementNamedLiteralStructType(ir.LiteralStructType):
         """
         ir.LiteralStructType.__init__(self, elems, packed)
         self.names = tuple(names)
-        self.lookup_cache = {}
+        # 名字 -> 成员, 包括匿名结构体成员中的成员. 直接成员优先, 同名时取靠前的
+        self.members: Dict[str, StructMember] = {}
+        for i, (elem, name) in enumerate(zip(self.elements, self.names)):
+            if name is not None and name not in self.members:
+                self.members[name] = StructMember(elem, [member_index(i)])
+        for i, (elem, name) in enumerate(zip(self.elements, self.names)):
+            if name is None and isinstance(elem, ElementNamedLiteralStructType):
+                index = member_index(i)
+                for member_name, member in elem.members.items():
+                    if member_name not in self.members:
+                        self.members[member_name] = StructMember(member.type, [index] + member.indices)
 
-    def get_element_by_name(self, name: str) -> Optional[Tuple[List[int], ir.Type]]:
+    def get_member(self, name: str) -> Optional[StructMember]:
         """
-        寻找名字对应的下标. 找不到时返回 None.
+        寻找名字对应的成员. 找不到时返回 None.
         @param name: 名字
-        @return: 下标
+        @return: 成员
         """
-        for i in range(len(self.names)):
-            if self.names[i] == name:
-                return [i], self.elements[i]
-        try:
-            return self.lookup_cache[name]
-        except KeyError:
-            pass
-        for i in range(len(self.names)):
-            if self.names[i] is None:
-                elem: ElementNamedLiteralStructType = self.elements[i]
-                result = elem.get_element_by_name(name)
-                if result is not None:
-                    result = ([i] + result[0], result[1])
-                    self.lookup_cache[name] = result
-                    return result
-        self.lookup_cache[name] = None
-        return None
+        return self.members.get(name)
@@ -9,17 +9,40 @@ import compiler
 
 
 def usage():
-    print('Usage: python main.py [-h] [-o output_name] [-t target] [-I include_dirs] [-D<macro<=value>>] filename')
+    print('Usage: python main.py [-h] [-o output_name] [-t target] [-I include_dirs] [-D<macro<=value>>] '
+          '[-fsyntax-only]\n'
+          '                      [--pch=pch_file] [--ir-cache=cache_file] [--dfa-cache=cache_file] '
+          '[--lexer=lexer]\n'
+          '                      [--parser=parser] [--stream] [--lazy-functions] [--stats] filename')
     print('\t-h, --help: 语法帮助')
     print('\t-o, --output=: 输出的文件名')
     print('\t-t, --target=: LLVM IR 目标平台架构，默认为 x86_64-pc-linux-gnu')
     print('\t-I, --include=: 头文件搜寻目录，允许多个')
     print('\t-D<macro<=value>>: 定义宏 macro，值设为 value，允许定义多个宏')
+    print('\t-fsyntax-only: 只做预处理、语法分析和语义检查，不生成指令也不输出 IR 文件')
+    print('\t--pch=: 预编译头文件，保存文件开头 #include 部分的分析结果，'
+          '不存在或过期时重新生成')
+    print('\t--ir-cache=: 函数的 IR 缓存文件，函数及其引用的声明未改变时直接使用上次生成的代码；'
+          '与 --stream --parser=fast 一起使用时这些函数的函数体也不再分析')
+    print('\t--dfa-cache=: ANTLR 预测 DFA 的缓存文件，启动时读入之前学到的 DFA 状态，'
+          '结束时保存新的状态；文法或 ANTLR 运行时改变后自动失效')
+    print('\t--lexer=: 记号来源，preprocessor (默认) 直接使用预处理器切分的记号，'
+          'antlr 用 CLexer 重新分析预处理后的文本，regex 用一个正则表达式代替 CLexer 分析预处理后的文本')
+    print('\t--parser=: 语法分析器，antlr (默认) 为 ANTLR 生成的 CParser，'
+          'fast 为手写的递归下降分析器')
+    print('\t--stream: 逐个外部声明 (函数定义或声明) 分析并生成代码，不建立整个文件的语法树')
+    print('\t--lazy-functions: 先记录各函数定义及其引用的函数，'
+          '只为从非 static 函数 (包括 main) 和全局变量的初始值可达的函数生成代码，其余函数不出现在输出中')
+    print('\t--stats: 输出语法分析器或成功的预测模式 (SLL 或 LL) 及各阶段用时，'
+          '折叠的结点数 (节省的 visit 调用次数) 以及内存峰值')
 
 
 if __name__ == '__main__':
     pass_args = dict()
-    opts, args = getopt.getopt(sys.argv[1:], "ho:t:I:D:", ["help", "output=", "target=", 'include=', 'macro='])
+    opts, args = getopt.getopt(sys.argv[1:], "ho:t:I:D:f:",
+                               ["help", "output=", "target=", 'include=', 'macro=',
+                                'pch=', 'ir-cache=', 'dfa-cache=', 'lexer=', 'parser=',
+                                'stream', 'lazy-functions', 'stats'])
     if ('-h', '') in opts or ('--help', '') in opts:
         usage()
         sys.exit(0)
@@ -41,6 +64,33 @@ if __name__ == '__main__':
             pass_args['target_arch'] = opt_value
         elif opt_name in ('-I', '--include'):
             pass_args['include_dirs'].append(opt_value)
+        elif opt_name == '-f':
+            if opt_value != 'syntax-only':
+                print('Unknown option: -f' + opt_value)
+                sys.exit(1)
+            pass_args['syntax_only'] = True
+        elif opt_name == '--pch':
+            pass_args['pch'] = opt_value
+        elif opt_name == '--ir-cache':
+            pass_args['ir_cache'] = opt_value
+        elif opt_name == '--dfa-cache':
+            pass_args['dfa_cache'] = opt_value
+        elif opt_name == '--lexer':
+            if opt_value not in ('preprocessor', 'antlr', 'regex'):
+                print('Unknown lexer: ' + opt_value)
+                sys.exit(1)
+            pass_args['lexer'] = opt_value
+        elif opt_name == '--parser':
+            if opt_value not in ('antlr', 'fast'):
+                print('Unknown parser: ' + opt_value)
+                sys.exit(1)
+            pass_args['parser'] = opt_value
+        elif opt_name == '--stream':
+            pass_args['stream'] = True
+        elif opt_name == '--lazy-functions':
+            pass_args['lazy_functions'] = True
+        elif opt_name == '--stats':
+            pass_args['stats'] = True
         elif opt_name == '-D':
             l: List[str] = opt_value.split('=')
             macro_name = l[0]
@@ -1 +1,3 @@
-from .preprocessor import preprocess
+from .preprocessor import preprocess, preprocess_lines, preprocess_source, SourceLine, header_prefix, header_cache
+from .macro import MacroTable
+from .stream import LineInputStream
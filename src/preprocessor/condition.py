@@ -0,0 +1,261 @@
+import codecs
+import operator
+import re
+
+from .macro import MacroTable, tokenize, IDENTIFIER_PATTERN
+
+from typing import Callable, Dict, List, Optional
+
+# 整数常量: 数字部分及后缀
+INTEGER_PATTERN = re.compile(r'(0[xX][0-9a-fA-F]+|0[bB][01]+|0[0-7]*|[1-9][0-9]*)([uU]?[lL]{0,2}|[lL]{1,2}[uU])')
+
+# 二元运算符的优先级, 数字越大结合越紧
+BINARY_PRECEDENCE: Dict[str, int] = {
+    '||': 1,
+    '&&': 2,
+    '|': 3,
+    '^': 4,
+    '&': 5,
+    '==': 6, '!=': 6,
+    '<': 7, '>': 7, '<=': 7, '>=': 7,
+    '<<': 8, '>>': 8,
+    '+': 9, '-': 9,
+    '*': 10, '/': 10, '%': 10,
+}
+
+
+# 其余二元运算, && 和 || 需要短路求值，单独处理
+BINARY_OPERATORS: Dict[str, Callable[[int, int], int]] = {
+    '|': operator.or_,
+    '^': operator.xor,
+    '&': operator.and_,
+    '==': lambda a, b: int(a == b),
+    '!=': lambda a, b: int(a != b),
+    '<': lambda a, b: int(a < b),
+    '>': lambda a, b: int(a > b),
+    '<=': lambda a, b: int(a <= b),
+    '>=': lambda a, b: int(a >= b),
+    '<<': operator.lshift,
+    '>>': operator.rshift,
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+}
+
+
+def is_blank(token: str) -> bool:
+    """
+    记号是否为空白或注释.
+    """
+    return token.isspace() or token.startswith(('//', '/*'))
+
+
+def skip_blank(tokens: List[str], i: int) -> int:
+    """
+    返回从 i 开始第一个不是空白或注释的记号的下标.
+    """
+    while i < len(tokens) and is_blank(tokens[i]):
+        i += 1
+    return i
+
+
+def parse_integer(token: str) -> int:
+    """
+    解析 #if 中的整数常量.
+
+    Raises:
+        ValueError: 不是整数常量
+    """
+    m = INTEGER_PATTERN.fullmatch(token)
+    if m is None:
+        raise ValueError('#if 中无效的整数常量: ' + token)
+    digits = m.group(1)
+    if digits[:2] in ('0x', '0X'):
+        return int(digits[2:], 16)
+    if digits[:2] in ('0b', '0B'):
+        return int(digits[2:], 2)
+    if digits[0] == '0':
+        return int(digits, 8)
+    return int(digits)
+
+
+def parse_char(token: str) -> int:
+    """
+    解析 #if 中的字符常量.
+
+    Raises:
+        ValueError: 字符常量无效
+    """
+    if len(token) < 3 or token[-1] != "'":
+        raise ValueError('#if 中无效的字符常量: ' + token)
+    try:
+        value = codecs.decode(token[1:-1], 'unicode_escape')
+    except UnicodeDecodeError:
+        raise ValueError('#if 中无效的字符常量: ' + token)
+    if len(value) != 1:
+        raise ValueError('#if 中无效的字符常量: ' + token)
+    return ord(value)
+
+
+class ConditionParser:
+    """
+    #if 和 #elif 常量表达式的求值器.
+
+    defined 运算在宏展开之前替换为 0 或 1, 展开后剩余的标识符按 C 的规定视为 0.
+    &&, || 和 ?: 中不会被求值的部分只做语法检查，其中的除零不报错.
+    """
+
+    def __init__(self, expression: str, macros: MacroTable):
+        self._macros: MacroTable = macros
+        tokens = macros.expand(self._replace_defined(tokenize(expression)))
+        self._tokens: List[str] = [t for t in tokens if not is_blank(t)]
+        self._pos: int = 0
+
+    def _replace_defined(self, tokens: List[str]) -> List[str]:
+        result = []
+        i = 0
+        while i < len(tokens):
+            if tokens[i] != 'defined':
+                result.append(tokens[i])
+                i += 1
+                continue
+            # defined X 或 defined ( X )
+            i = skip_blank(tokens, i + 1)
+            parenthesized = i < len(tokens) and tokens[i] == '('
+            if parenthesized:
+                i = skip_blank(tokens, i + 1)
+            if i >= len(tokens) or IDENTIFIER_PATTERN.fullmatch(tokens[i]) is None:
+                raise ValueError('defined 后应为宏名')
+            name = tokens[i]
+            i += 1
+            if parenthesized:
+                i = skip_blank(tokens, i)
+                if i >= len(tokens) or tokens[i] != ')':
+                    raise ValueError('#if 表达式中缺少 )')
+                i += 1
+            result.append('1' if self._macros.is_defined(name) else '0')
+        return result
+
+    def evaluate(self) -> int:
+        """
+        Returns:
+            int: 表达式的值
+
+        Raises:
+            ValueError: 表达式有语法错误或除数为 0
+        """
+        if not self._tokens:
+            raise ValueError('#if 缺少表达式')
+        value = self._conditional(True)
+        if self._pos != len(self._tokens):
+            raise ValueError('#if 表达式中有多余的记号: ' + self._tokens[self._pos])
+        return value
+
+    def _peek(self) -> Optional[str]:
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _next(self) -> str:
+        token = self._peek()
+        if token is None:
+            raise ValueError('#if 表达式不完整')
+        self._pos += 1
+        return token
+
+    def _expect(self, token: str) -> None:
+        if self._next() != token:
+            raise ValueError('#if 表达式中缺少 ' + token)
+
+    def _conditional(self, active: bool) -> int:
+        condition = self._binary(1, active)
+        if self._peek() != '?':
+            return condition
+        self._pos += 1
+        a = self._conditional(active and condition != 0)
+        self._expect(':')
+        b = self._conditional(active and condition == 0)
+        return a if condition != 0 else b
+
+    def _binary(self, min_precedence: int, active: bool) -> int:
+        left = self._unary(active)
+        while True:
+            op = self._peek()
+            precedence = BINARY_PRECEDENCE.get(op)
+            if precedence is None or precedence < min_precedence:
+                return left
+            self._pos += 1
+            if op == '&&':
+                right = self._binary(precedence + 1, active and left != 0)
+                left = int(left != 0 and right != 0)
+            elif op == '||':
+                right = self._binary(precedence + 1, active and left == 0)
+                left = int(left != 0 or right != 0)
+            else:
+                right = self._binary(precedence + 1, active)
+                left = self._apply(op, left, right, active)
+
+    @staticmethod
+    def _apply(op: str, left: int, right: int, active: bool) -> int:
+        if op in ('/', '%') and right == 0:
+            if active:
+                raise ValueError('#if 中除数为 0')
+            return 0
+        if op == '/':
+            q = abs(left) // abs(right)
+            return q if (left < 0) == (right < 0) else -q
+        if op == '%':
+            return left - right * ConditionParser._apply('/', left, right, active)
+        if op in ('<<', '>>') and right < 0:
+            if active:
+                raise ValueError('#if 中移位位数为负数')
+            return 0
+        return BINARY_OPERATORS[op](left, right)
+
+    def _unary(self, active: bool) -> int:
+        token = self._next()
+        if token == '(':
+            value = self._conditional(active)
+            self._expect(')')
+            return value
+        if token == '+':
+            return self._unary(active)
+        if token == '-':
+            return -self._unary(active)
+        if token == '~':
+            return ~self._unary(active)
+        if token == '!':
+            return int(self._unary(active) == 0)
+        if token == 'defined':
+            # 由宏展开产生的 defined
+            if self._peek() == '(':
+                self._pos += 1
+                name = self._next()
+                self._expect(')')
+            else:
+                name = self._next()
+            if IDENTIFIER_PATTERN.fullmatch(name) is None:
+                raise ValueError('defined 后应为宏名')
+            return int(self._macros.is_defined(name))
+        if IDENTIFIER_PATTERN.fullmatch(token):
+            return 0
+        if token[0].isdigit():
+            return parse_integer(token)
+        if token[0] == "'":
+            return parse_char(token)
+        raise ValueError('#if 表达式中无效的记号: ' + token)
+
+
+def evaluate_condition(expression: str, macros: MacroTable) -> bool:
+    """
+    计算 #if 或 #elif 的条件.
+
+    Args:
+        expression (str): 指令后的表达式文本
+        macros (MacroTable): 宏表
+
+    Returns:
+        bool: 条件是否成立
+
+    Raises:
+        ValueError: 表达式无效
+    """
+    return ConditionParser(expression, macros).evaluate() != 0
@@ -1,11 +1,11 @@
 class MacroError(Exception):
-    def __init__(self, msg: str, filepath: str, ctx=None):
+    def __init__(self, msg: str, filepath: str, ctx=None, line: int = 0):
         super().__init__()
         if ctx:
             self.line = ctx.start.line  # 错误出现位置
             self.column = ctx.start.column
         else:
-            self.line = 0
+            self.line = line
             self.column = 0
         self.filepath = filepath
         self.msg = msg
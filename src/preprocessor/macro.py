@@ -0,0 +1,445 @@
+import re
+
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple, FrozenSet, Iterable
+
+# 预处理记号: 注释, 字符串, 字符常量, 标识符, 预处理数, 多字符运算符, 空白, 其余单个字符
+TOKEN_PATTERN = re.compile(r'''
+    //[^\n]*
+  | /\*.*?\*/
+  | "(?:[^"\\\n]|\\.)*"?
+  | '(?:[^'\\\n]|\\.)*'?
+  | [A-Za-z_][A-Za-z0-9_]*
+  | \.?[0-9](?:[eEpP][+-]|[A-Za-z0-9_.])*
+  | \.\.\. | <<= | >>= | -> | \+\+ | -- | << | >> | <= | >= | == | != | && | \|\| | [*/%+\-&^|]= | \#\#
+  | [ \t\r\n]+
+  | .
+''', re.X | re.S)
+
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+# 宏定义: 名称, 紧跟名称的参数列表 (函数宏), 宏体
+DEFINITION_PATTERN = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)(?:\(([^)]*)\))?(.*)', re.S)
+
+# 一次宏调用的展开结果在展开后的文本中的起止位置, 以及宏调用在原文本中的起止位置
+ExpansionSpan = Tuple[int, int, int, int]
+
+
+class PaintedToken(str):
+    """
+    不再展开的宏名记号 ("涂蓝"). 展开某个宏的过程中遇到的同名记号即使之后离开了这次展开
+    (例如作为实参被代入另一个宏体再重新扫描), 也不再作为宏展开.
+    """
+
+
+class UnterminatedCall(ValueError):
+    """
+    函数宏调用到文本末尾仍缺少右括号. 预处理器据此把后续的行接在后面再展开.
+    """
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为预处理记号, 记号拼接后与原文本完全相同.
+
+    Args:
+        text (str): 文本
+
+    Returns:
+        List[str]: 记号列表
+    """
+    return TOKEN_PATTERN.findall(text)
+
+
+def strip_whitespace(tokens: List[str]) -> List[str]:
+    """
+    去除记号列表首尾的空白记号.
+    """
+    begin, end = 0, len(tokens)
+    while begin < end and tokens[begin].isspace():
+        begin += 1
+    while end > begin and tokens[end - 1].isspace():
+        end -= 1
+    return tokens[begin:end]
+
+
+class Macro:
+    """
+    一个宏定义. params 为 None 时表示对象宏, 否则为函数宏的参数名列表.
+    """
+
+    def __init__(self, name: str, body: str, params: Optional[List[str]] = None):
+        self.name: str = name
+        self.params: Optional[Tuple[str, ...]] = tuple(params) if params is not None else None
+        self.body: List[str] = strip_whitespace(tokenize(body))
+
+    @property
+    def is_function_like(self) -> bool:
+        return self.params is not None
+
+    def __eq__(self, other):
+        return isinstance(other, Macro) and self.name == other.name \
+            and self.params == other.params and self.body == other.body
+
+    def __hash__(self):
+        return hash((self.name, self.params, tuple(self.body)))
+
+    def __repr__(self):
+        params = '(' + ', '.join(self.params) + ')' if self.params is not None else ''
+        return f'Macro({self.name}{params} {"".join(self.body)})'
+
+
+def parse_macro(definition: str) -> Macro:
+    """
+    解析 #define 之后的宏定义文本.
+
+    Args:
+        definition (str): 形如 `NAME body` 或 `NAME(a, b) body` 的文本
+
+    Returns:
+        Macro: 宏定义
+
+    Raises:
+        ValueError: 宏名非法
+    """
+    match = DEFINITION_PATTERN.fullmatch(definition.strip())
+    if match is None:
+        raise ValueError(f'非法的宏定义: {definition}')
+    name, params, body = match.groups()
+    if params is None:
+        return Macro(name, body)
+    param_list = [param.strip() for param in params.split(',')] if params.strip() else []
+    if param_list and param_list[-1] == '...':
+        param_list[-1] = '__VA_ARGS__'
+    return Macro(name, body, param_list)
+
+
+class MacroRecorder:
+    """
+    记录一段预处理过程读取和修改了哪些宏.
+    """
+
+    def __init__(self):
+        # 宏名 -> 首次读取时的定义 (None 表示未定义), 不包括先被本段修改过的宏
+        self.reads: Dict[str, Optional[Macro]] = dict()
+        # 宏名 -> 本段结束时的定义 (None 表示被取消定义)
+        self.writes: Dict[str, Optional[Macro]] = dict()
+
+
+class MacroTable:
+    """
+    宏表及单遍的宏展开引擎.
+
+    展开时只切分一次记号，通过字典查找标识符，支持递归展开和函数宏；
+    正在展开的宏名不会被再次展开, 此时遇到的记号标记为 PaintedToken, 以后也不再展开.
+    无参数宏的展开结果会被缓存，宏表变化时缓存失效.
+    """
+
+    def __init__(self, defines: Optional[Dict[str, Optional[str]]] = None):
+        """
+        Args:
+            defines (Dict[str, Optional[str]]): 预先定义的宏 (例如命令行 -D), 值为 None 时宏体为空
+        """
+        self._macros: Dict[str, Macro] = dict()
+        # 无参数宏的展开缓存
+        self._cache: Dict[str, List[str]] = dict()
+        # 正在记录的 MacroRecorder, 嵌套的头文件各对应一个
+        self._recorders: List[MacroRecorder] = []
+        if defines is not None:
+            for name, value in defines.items():
+                self.define(Macro(name, value if value is not None else ''))
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def __getstate__(self):
+        # 保存时不包括展开缓存和正在进行的记录
+        return {'_macros': self._macros, '_cache': dict(), '_recorders': []}
+
+    def __len__(self):
+        return len(self._macros)
+
+    def get(self, name: str) -> Optional[Macro]:
+        if self._recorders:
+            return self._recorded_get(name)
+        return self._macros.get(name)
+
+    def is_defined(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def define(self, macro: Macro) -> None:
+        self._macros[macro.name] = macro
+        if self._cache:
+            self._cache.clear()
+        for recorder in self._recorders:
+            recorder.writes[macro.name] = macro
+
+    def undefine(self, name: str) -> None:
+        if self._macros.pop(name, None) is not None and self._cache:
+            self._cache.clear()
+        for recorder in self._recorders:
+            recorder.writes[name] = None
+
+    def start_recording(self) -> MacroRecorder:
+        """
+        开始记录宏的读写, 直到对应的 stop_recording 为止. 记录可以嵌套.
+
+        Returns:
+            MacroRecorder: 新的记录
+        """
+        recorder = MacroRecorder()
+        self._recorders.append(recorder)
+        return recorder
+
+    def stop_recording(self, recorder: MacroRecorder) -> None:
+        if self._recorders.pop() is not recorder:
+            raise RuntimeError('MacroRecorder 未按嵌套顺序结束')
+
+    def matches(self, reads: Dict[str, Optional[Macro]]) -> bool:
+        """
+        当前宏表中这些宏的定义是否与记录的一致.
+
+        Args:
+            reads (Dict[str, Optional[Macro]]): MacroRecorder.reads
+
+        Returns:
+            bool
+        """
+        for name, macro in reads.items():
+            if self.get(name) != macro:
+                return False
+        return True
+
+    def apply(self, writes: Dict[str, Optional[Macro]]) -> None:
+        """
+        重放 MacroRecorder.writes 记录的修改.
+        """
+        for name, macro in writes.items():
+            if macro is None:
+                self.undefine(name)
+            else:
+                self.define(macro)
+
+    def _recorded_get(self, name: str) -> Optional[Macro]:
+        macro = self._macros.get(name)
+        for recorder in self._recorders:
+            if name not in recorder.reads and name not in recorder.writes:
+                recorder.reads[name] = macro
+        return macro
+
+    def expand_text(self, text: str) -> Tuple[str, Tuple[ExpansionSpan, ...]]:
+        """
+        展开一段文本中的宏. 字符串, 字符常量和注释中的内容不会被替换.
+
+        Args:
+            text (str): 文本
+
+        Returns:
+            Tuple[str, Tuple[ExpansionSpan, ...]]: 展开后的文本, 以及各次宏调用展开前后的位置, 按位置排列.
+                不在任何宏调用中的部分是原文本的原样复制
+
+        Raises:
+            UnterminatedCall: 函数宏调用缺少右括号
+            ValueError: 函数宏参数个数错误
+        """
+        # 不含任何宏名的文本无需切分记号
+        identifiers = IDENTIFIER_PATTERN.findall(text)
+        if self._recorders:
+            for identifier in identifiers:
+                self._recorded_get(identifier)
+        if self._macros.keys().isdisjoint(identifiers):
+            return text, ()
+        spans: List[ExpansionSpan] = []
+        return ''.join(self._expand(tokenize(text), frozenset(), spans)), tuple(spans)
+
+    def expand(self, tokens: List[str]) -> List[str]:
+        """
+        展开记号列表中的宏.
+
+        Args:
+            tokens (List[str]): 预处理记号
+
+        Returns:
+            List[str]: 展开后的记号
+        """
+        return self._expand(tokens, frozenset())
+
+    def _expand(self, tokens: List[str], disabled: FrozenSet[str],
+                spans: Optional[List[ExpansionSpan]] = None) -> List[str]:
+        # spans 不为 None 时记录各次宏调用展开前后的位置 (只用于最外层)
+        macros = self._macros if not self._recorders else self
+        result: List[str] = []
+        i, n = 0, len(tokens)
+        if spans is not None:
+            # columns[k] 是 tokens[k] 在原文本中的位置, columns[n] 是原文本的长度
+            columns = list(accumulate(map(len, tokens), initial=0))
+            # 展开结果的长度
+            length = 0
+            # 结尾的函数宏名与后续实参组成调用时, 之前的宏调用的起始位置 (展开后, 展开前)
+            pending: Optional[Tuple[int, int]] = None
+        while i < n:
+            token = tokens[i]
+            i += 1
+            macro = macros.get(token)
+            if macro is None:
+                result.append(token)
+                if spans is not None:
+                    length += len(token)
+                continue
+            if token in disabled or type(token) is PaintedToken:
+                result.append(PaintedToken(token))
+                if spans is not None:
+                    length += len(token)
+                continue
+            start = i - 1
+            if macro.params is None:
+                if disabled or self._recorders:
+                    expansion = self._expand(macro.body, disabled | {token})
+                else:
+                    expansion = self._cache.get(token)
+                    if expansion is None:
+                        expansion = self._expand(macro.body, frozenset((token,)))
+                        self._cache[token] = expansion
+            else:
+                j = i
+                while j < n and tokens[j].isspace():
+                    j += 1
+                if j >= n or tokens[j] != '(':
+                    # 不是函数宏调用
+                    result.append(token)
+                    if spans is not None:
+                        length += len(token)
+                    continue
+                args, i = self._collect_arguments(macro, tokens, j + 1)
+                expansion = self._expand(self._substitute(macro, args, disabled), disabled | {token})
+            # 展开结果以函数宏名结尾时，它可以和后续的实参组成调用
+            tail = len(expansion) - 1
+            while tail >= 0 and expansion[tail].isspace():
+                tail -= 1
+            if tail >= 0:
+                last = macros.get(expansion[tail])
+                if last is not None and last.params is not None and last.name != token \
+                        and last.name not in disabled and type(expansion[tail]) is not PaintedToken:
+                    j = i
+                    while j < n and tokens[j].isspace():
+                        j += 1
+                    if j < n and tokens[j] == '(':
+                        result.extend(expansion[:tail])
+                        if spans is not None:
+                            if pending is None:
+                                pending = (length, columns[start])
+                            length += sum(map(len, expansion[:tail]))
+                            columns = [pending[1]] + columns[i:]
+                        tokens = [last.name] + tokens[i:]
+                        i, n = 0, len(tokens)
+                        continue
+            result.extend(expansion)
+            if spans is not None:
+                out_start, in_start = pending if pending is not None else (length, columns[start])
+                length += sum(map(len, expansion))
+                spans.append((out_start, length, in_start, columns[i]))
+                pending = None
+        return result
+
+    @staticmethod
+    def _collect_arguments(macro: Macro, tokens: List[str], start: int) -> Tuple[List[List[str]], int]:
+        """
+        收集函数宏调用的实参.
+
+        Returns:
+            Tuple[List[List[str]], int]: 实参列表, 以及右括号之后的位置
+        """
+        args: List[List[str]] = [[]]
+        depth = 0
+        variadic = bool(macro.params) and macro.params[-1] == '__VA_ARGS__'
+        for i in range(start, len(tokens)):
+            token = tokens[i]
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                if depth == 0:
+                    args = [strip_whitespace(arg) for arg in args]
+                    if len(args) == 1 and not args[0] and not macro.params:
+                        args = []
+                    if len(args) != len(macro.params) and not (variadic and len(args) >= len(macro.params) - 1):
+                        raise ValueError(f'宏 {macro.name} 需要 {len(macro.params)} 个参数, 实际为 {len(args)} 个')
+                    return args, i + 1
+                depth -= 1
+            elif token == ',' and depth == 0 and not (variadic and len(args) >= len(macro.params)):
+                args.append([])
+                continue
+            args[-1].append(token)
+        raise UnterminatedCall(f'宏 {macro.name} 的调用缺少右括号')
+
+    def _substitute(self, macro: Macro, args: List[List[str]], disabled: FrozenSet[str]) -> List[str]:
+        """
+        用实参替换函数宏宏体中的形参, 处理 # 与 ## 运算符.
+        """
+        index = {param: i for i, param in enumerate(macro.params)}
+        body = macro.body
+        result: List[str] = []
+        # 每个实参至多展开一次
+        expanded: Dict[int, List[str]] = dict()
+        i, n = 0, len(body)
+        while i < n:
+            token = body[i]
+            if token == '#' and i + 1 < n:
+                j = i + 1
+                while j < n and body[j].isspace():
+                    j += 1
+                if j < n and body[j] in index:
+                    result.append(stringify(args[index[body[j]]] if index[body[j]] < len(args) else []))
+                    i = j + 1
+                    continue
+            if token in index:
+                arg = args[index[token]] if index[token] < len(args) else []
+                if _adjacent_to_paste(body, i):
+                    result.extend(arg)
+                else:
+                    if index[token] not in expanded:
+                        expanded[index[token]] = self._expand(arg, disabled)
+                    result.extend(expanded[index[token]])
+            else:
+                result.append(token)
+            i += 1
+        return paste(result) if '##' in result else result
+
+
+def _adjacent_to_paste(tokens: List[str], i: int) -> bool:
+    for step in (-1, 1):
+        j = i + step
+        while 0 <= j < len(tokens) and tokens[j].isspace():
+            j += step
+        if 0 <= j < len(tokens) and tokens[j] == '##':
+            return True
+    return False
+
+
+def stringify(tokens: Iterable[str]) -> str:
+    """
+    # 运算符: 将实参转为字符串字面量.
+    """
+    text = re.sub(r'\s+', ' ', ''.join(tokens))
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def paste(tokens: List[str]) -> List[str]:
+    """
+    ## 运算符: 拼接两侧的记号并重新切分.
+    """
+    result: List[str] = []
+    i, n = 0, len(tokens)
+    while i < n:
+        if tokens[i] == '##':
+            while result and result[-1].isspace():
+                result.pop()
+            i += 1
+            while i < n and tokens[i].isspace():
+                i += 1
+            left = result.pop() if result else ''
+            right = tokens[i] if i < n else ''
+            result.extend(tokenize(left + right))
+        else:
+            result.append(tokens[i])
+        i += 1
+    return result
@@ -10,8 +10,11 @@ line
     | includeStat   // 包含头文件
     | ifdefStat     // ifdef
     | ifndefStat    // ifndef
+    | ifStat        // if
+    | elifStat      // elif
     | elseStat      // else
     | endifStat     // endif
+    | pragmaStat    // pragma
     | text          // 普通文本
     |               // 空行
     ;
@@ -35,17 +38,26 @@ ifdefStat
 ifndefStat
     : WS? '#ifndef' WS macroID WS?;
 
+ifStat
+    : WS? '#if' WS restOfLine;
+
+elifStat
+    : WS? '#elif' WS restOfLine;
+
 elseStat
     : WS? '#else' WS?;
 
 endifStat
     : WS? '#endif' WS?;
 
+pragmaStat
+    : WS? '#pragma' WS restOfLine;
+
 text: .*?;
 
 macroID: (ID | OP)+;
 
-restOfLine: (WS? (ID | OP | DOUBLE_QUOTE)+ WS?)+;
+restOfLine: (WS? (ID | OP | DOUBLE_QUOTE | '<' | '>' | '.h')+ WS?)+;
 
 ID: [A-Za-z0-9_]+;
 OP: (~('a'..'z' | 'A'..'Z' | '0'..'9' | '\t' | '\r' | '\n' | ' ' | '_' | '"'))+;
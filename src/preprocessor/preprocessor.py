@@ -1,35 +1,57 @@
-from antlr4 import FileStream, CommonTokenStream, ParseTreeWalker
+from antlr4 import InputStream, CommonTokenStream, ParseTreeWalker
 
 import sys
+import re
 import os
 import platform
-import re
 
 from preprocessor.parser.CPreprocessorListener import CPreprocessorListener
 from preprocessor.parser.CPreprocessorParser import CPreprocessorParser
 from preprocessor.parser.CPreprocessorLexer import CPreprocessorLexer
 
 from .errors import MacroError
+from .macro import MacroTable, Macro, ExpansionSpan, UnterminatedCall, parse_macro
+from .condition import evaluate_condition
+from .stream import SourceFile
 
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, FrozenSet, List, Any, NamedTuple, Optional, Tuple, Union, Iterator
 
 # 文件路径分隔符
 separator: str = '\\' if platform.system().lower() == 'windows' else '/'
 
 
+# 源文件的编码
+SOURCE_ENCODING = 'utf-8'
+
+# #include 指令
+INCLUDE_PATTERN = re.compile(rb'#include[ \t]')
+
+# 可能是条件指令的行, 跳过无效块时只分析这些行
+CONDITIONAL_PATTERN = re.compile(rb'[ \t]*#(?:if|el|endif)')
+
+
 class IfStack:
     """
     用来存放宏中 if else 等块的栈，每一层表示一个 scope
     """
     def __init__(self):
         self.stack: List[Tuple[str, bool]] = list()
+        # 各层是否已有分支生效, 用于 #elif 和 #else
+        self._taken: List[bool] = list()
+        # 各层及其外层是否都生效, 栈顶即为当前行是否有效
+        self._valid: List[bool] = list()
 
     def __len__(self):
         return self.size()
 
+    def _push(self, name: str, b: bool) -> None:
+        self._valid.append(b and self.is_valid())
+        self._taken.append(b)
+        self.stack.append((name, b))
+
     def push_ifdef(self, b: bool) -> None:
         """
-        推入一个 if 宏.
+        推入一个 ifdef 宏.
 
         Args:
             b (bool): 宏是否有效
@@ -37,7 +59,7 @@ class IfStack:
         Returns:
             None
         """
-        self.stack.append(('ifdef', b))
+        self._push('ifdef', b)
 
     def push_ifndef(self, b: bool) -> None:
         """
@@ -49,11 +71,11 @@ class IfStack:
         Returns:
             None
         """
-        self.stack.append(('ifndef', b))
+        self._push('ifndef', b)
 
-    def push_else(self, b: bool) -> None:
+    def push_if(self, b: bool) -> None:
         """
-        推入一个 ifndef 宏.
+        推入一个 if 宏.
 
         Args:
             b (bool): 宏是否有效
@@ -61,7 +83,32 @@ class IfStack:
         Returns:
             None
         """
-        self.stack.append(('else', b))
+        self._push('if', b)
+
+    def switch(self, name: str, b: bool) -> None:
+        """
+        将栈顶替换为同一层的下一个分支 (elif 或 else).
+
+        Args:
+            name (str): 分支的宏名称
+            b (bool): 分支的条件是否成立, 此前已有分支生效时不会生效
+
+        Returns:
+            None
+        """
+        b = b and not self._taken[-1]
+        self._taken[-1] = self._taken[-1] or b
+        self._valid[-1] = b and (len(self._valid) == 1 or self._valid[-2])
+        self.stack[-1] = (name, b)
+
+    def can_take(self) -> bool:
+        """
+        返回栈顶的下一个分支是否可能生效, 即外层有效且此前的分支都没有生效.
+
+        Returns:
+            bool
+        """
+        return not self._taken[-1] and (len(self._valid) == 1 or self._valid[-2])
 
     def pop(self) -> Optional[Tuple[str, bool]]:
         """
@@ -71,7 +118,11 @@ class IfStack:
             Tuple[str, bool]:
                 返回一个 Tuple。str 代表宏名称，bool 表示是否生效。
         """
-        return self.stack.pop() if len(self.stack) != 0 else None
+        if len(self.stack) == 0:
+            return None
+        self._valid.pop()
+        self._taken.pop()
+        return self.stack.pop()
 
     def peek(self) -> Optional[Tuple[str, bool]]:
         """
@@ -88,23 +139,379 @@ class IfStack:
 
     def is_valid(self) -> bool:
         """
-        返回栈顶宏是否生效.
+        返回当前位置是否有效, 即栈中各层都生效.
 
         Returns:
             bool
         """
-        for s in self.stack:
-            if not s[1]:
-                return False
+        return self._valid[-1] if self._valid else True
+
+
+class SourceLine(NamedTuple):
+    """
+    预处理产生的一行及其来源.
+    """
+    # 以 '\n' 结尾的文本
+    text: str
+    # 来源文件
+    filepath: str
+    # 在来源文件中的行号, 从 1 开始
+    line: int
+    # 各次宏调用展开前后的位置, 见 MacroTable.expand_text
+    spans: Tuple[ExpansionSpan, ...] = ()
+
+
+class HeaderRecord:
+    """
+    一次头文件预处理的结果.
+    """
+
+    def __init__(self, files: Dict[str, int], reads: Dict[str, Optional[Macro]],
+                 writes: Dict[str, Optional[Macro]], output: Tuple[SourceLine, ...]):
+        # 用到的文件及其修改时间 (包括嵌套包含的头文件)
+        self.files = files
+        # 读取的宏及其当时的定义
+        self.reads = reads
+        # 对宏表的修改
+        self.writes = writes
+        # 预处理后的各行
+        self.output = output
+
+    def is_fresh(self) -> bool:
+        """
+        用到的文件是否都没有被修改过.
+        """
+        try:
+            for path, mtime in self.files.items():
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+        except OSError:
+            return False
         return True
 
 
+class HeaderCache:
+    """
+    头文件预处理结果的缓存, 以 (文件路径, 头文件目录) 为键.
+
+    命中条件: 文件未被修改，且头文件读取过的宏在当前宏表中的定义与记录一致.
+    命中时直接返回记录的文本并重放宏表的修改，不再词法/语法分析.
+    同一进程中编译的所有文件共用模块级的 header_cache.
+    """
+
+    # 每个头文件最多保留的记录数
+    max_records: int = 8
+
+    def __init__(self):
+        self._records: Dict[Tuple[str, Tuple[str, ...]], List[HeaderRecord]] = dict()
+        # 正在预处理的各层头文件用到的文件
+        self._frames: List[Dict[str, int]] = []
+
+    def clear(self) -> None:
+        self._records.clear()
+
+    def start_tracking(self) -> Dict[str, int]:
+        """
+        开始记录之后预处理的头文件, 直到对应的 stop_tracking 为止.
+
+        Returns:
+            Dict[str, int]: 头文件的绝对路径 -> 修改时间, 随预处理的进行而增加
+        """
+        files: Dict[str, int] = dict()
+        self._frames.append(files)
+        return files
+
+    def stop_tracking(self, files: Dict[str, int]) -> None:
+        if self._frames.pop() is not files:
+            raise RuntimeError('头文件记录未按嵌套顺序结束')
+
+    def preprocess(self, filepath: str, include_dirs: List[str], macros: MacroTable) -> Tuple[SourceLine, ...]:
+        """
+        预处理头文件，优先使用缓存.
+
+        Args:
+            filepath (str): 头文件路径
+            include_dirs (List[str]): 头文件目录
+            macros (MacroTable): 宏表
+
+        Returns:
+            Tuple[SourceLine, ...]: 预处理后的各行
+        """
+        path = os.path.abspath(filepath)
+        key = (path, tuple(include_dirs))
+        records = self._records.setdefault(key, [])
+        for record in records:
+            if record.is_fresh() and macros.matches(record.reads):
+                macros.apply(record.writes)
+                for frame in self._frames:
+                    frame.update(record.files)
+                return record.output
+
+        files = {path: os.stat(path).st_mtime_ns}
+        recorder = macros.start_recording()
+        self._frames.append(files)
+        try:
+            output = tuple(preprocess_source(filepath, include_dirs, macros))
+        finally:
+            self._frames.pop()
+            macros.stop_recording(recorder)
+        for frame in self._frames:
+            frame.update(files)
+        records.insert(0, HeaderRecord(files, recorder.reads, recorder.writes, output))
+        del records[self.max_records:]
+        return output
+
+
+header_cache = HeaderCache()
+
+
+class IncludeGuards:
+    """
+    记录各个文件的 include guard 宏.
+
+    若文件的全部内容都包在 `#ifndef X ... #endif` 中，则 X 已定义时再次包含该文件不会产生任何输出，
+    也不会修改宏表，可以直接跳过而不必打开文件. `#pragma once` 用一个不可能出现在源码中的宏名表示，
+    它在当前翻译单元的宏表中被定义，因此只在同一翻译单元内生效.
+    """
+
+    def __init__(self):
+        # 文件路径 -> (记录时的修改时间, guard 宏名)
+        self._guards: Dict[str, Tuple[int, str]] = dict()
+
+    def clear(self) -> None:
+        self._guards.clear()
+
+    def add(self, path: str, mtime: int, macro: str) -> None:
+        self._guards[os.path.abspath(path)] = (mtime, macro)
+
+    def get(self, path: str) -> Optional[str]:
+        """
+        获得文件的 guard 宏名. 文件被修改过或没有 guard 时返回 None.
+        """
+        path = os.path.abspath(path)
+        guard = self._guards.get(path)
+        if guard is None:
+            return None
+        try:
+            if os.stat(path).st_mtime_ns == guard[0]:
+                return guard[1]
+        except OSError:
+            pass
+        del self._guards[path]
+        return None
+
+    @staticmethod
+    def pragma_once_macro(path: str) -> str:
+        return '#pragma once ' + os.path.abspath(path)
+
+
+include_guards = IncludeGuards()
+
+
+class IncludeResolver:
+    """
+    查找 #include 的头文件.
+
+    每个目录只列出一次文件名，之后的查找只查询内存中的索引; 查找结果 (包括找不到) 也会被缓存.
+    索引在进程内有效，编译过程中新建的头文件不会被找到，需要时调用 clear.
+    """
+
+    def __init__(self):
+        # 目录 -> 目录中的文件名 (经过 normcase), 目录不存在时为空
+        self._listings: Dict[str, FrozenSet[str]] = dict()
+        # 搜索目录 -> {文件名 -> 路径 或 None}
+        self._lookups: Dict[Tuple[str, ...], Dict[str, Optional[str]]] = dict()
+
+    def clear(self) -> None:
+        self._listings.clear()
+        self._lookups.clear()
+
+    def _listing(self, directory: str) -> FrozenSet[str]:
+        listing = self._listings.get(directory)
+        if listing is None:
+            try:
+                with os.scandir(directory) as entries:
+                    listing = frozenset(os.path.normcase(entry.name) for entry in entries if entry.is_file())
+            except OSError:
+                listing = frozenset()
+            self._listings[directory] = listing
+        return listing
+
+    def _exists(self, directory: str, filename: str) -> bool:
+        if '/' in filename or separator in filename:
+            # 含有子目录时不使用索引
+            return os.path.isfile(os.path.join(directory, filename))
+        return os.path.normcase(filename) in self._listing(directory)
+
+    def resolve(self, filename: str, include_dirs: Tuple[str, ...]) -> Optional[str]:
+        """
+        按顺序在各目录中查找头文件.
+
+        Args:
+            filename (str): #include 中的文件名
+            include_dirs (Tuple[str, ...]): 搜索目录
+
+        Returns:
+            Optional[str]: 头文件路径, 找不到时为 None
+        """
+        lookups = self._lookups.get(include_dirs)
+        if lookups is None:
+            lookups = self._lookups[include_dirs] = dict()
+        if filename in lookups:
+            return lookups[filename]
+        filepath = None
+        for include_dir in include_dirs:
+            if self._exists(include_dir, filename):
+                filepath = include_dir + separator + filename
+                break
+        lookups[filename] = filepath
+        return filepath
+
+
+include_resolver = IncludeResolver()
+
+
+class ConditionCache:
+    """
+    #if 和 #elif 条件的缓存, 以表达式文本为键.
+
+    与 HeaderCache 相同，记录求值时读取过的宏，它们在当前宏表中的定义与记录一致时直接使用记录的结果.
+    """
+
+    # 每个表达式最多保留的记录数
+    max_records: int = 8
+
+    def __init__(self):
+        self._records: Dict[str, List[Tuple[Dict[str, Optional[Macro]], bool]]] = dict()
+
+    def clear(self) -> None:
+        self._records.clear()
+
+    def evaluate(self, expression: str, macros: MacroTable) -> bool:
+        """
+        计算条件，优先使用缓存.
+
+        Args:
+            expression (str): 指令后的表达式文本
+            macros (MacroTable): 宏表
+
+        Returns:
+            bool: 条件是否成立
+
+        Raises:
+            ValueError: 表达式无效
+        """
+        records = self._records.setdefault(expression, [])
+        for reads, result in records:
+            if macros.matches(reads):
+                return result
+        recorder = macros.start_recording()
+        try:
+            result = evaluate_condition(expression, macros)
+        finally:
+            macros.stop_recording(recorder)
+        records.insert(0, (recorder.reads, result))
+        del records[self.max_records:]
+        return result
+
+
+condition_cache = ConditionCache()
+
+
+class DirectiveParser:
+    """
+    只对以 # 开头的行进行语法分析. 所有行共用同一个词法分析器和语法分析器.
+    """
+    def __init__(self):
+        self._lexer = CPreprocessorLexer(InputStream(''))
+        self._parser = CPreprocessorParser(CommonTokenStream(self._lexer))
+        self._parser.removeErrorListeners()
+        # 最近一次分析的 (行号, 文本, 语法树)
+        self._last: Optional[Tuple[int, str, CPreprocessorParser.LineContext]] = None
+        # 跳过无效块时各行文本对应的指令类型
+        self._kinds: Dict[bytes, type] = dict()
+        # errorListener = SyntaxErrorListener()
+        # parser.addErrorListener(errorListener)
+
+    def parse(self, text: str, line: int) -> CPreprocessorParser.LineContext:
+        """
+        分析一行指令.
+
+        Args:
+            text (str): 不含换行符的一行
+            line (int): 行号, 使报错位置与在整个文件中分析时相同
+
+        Returns:
+            CPreprocessorParser.LineContext: 该行的语法树
+        """
+        # 跳过无效块时找到的指令行紧接着会被再次分析
+        if self._last is not None and self._last[0] == line and self._last[1] == text:
+            return self._last[2]
+        self._lexer.inputStream = InputStream(text)
+        self._lexer.line = line
+        self._parser.setTokenStream(CommonTokenStream(self._lexer))
+        tree = self._parser.macro().line(0)
+        self._last = (line, text, tree)
+        return tree
+
+    def skip_inactive(self, source: SourceFile, stop: Optional[int] = None) -> None:
+        """
+        跳过无效的条件块. 只按嵌套层数匹配条件指令，块中的其它行不做任何处理, 也不解码.
+
+        结束此块的同层 #elif, #else 或 #endif 被退回到 source 中, 由调用者处理.
+
+        Args:
+            source (SourceFile): 读到块中第一行之前的源文件
+            stop (Optional[int]): 最多读到第几行为止
+        """
+        depth = 0
+        while stop is None or source.line < stop:
+            line = source.next_line()
+            if line is None:
+                return
+            if CONDITIONAL_PATTERN.match(line) is None:
+                continue
+            kind = self._kinds.get(line)
+            if kind is None:
+                kind = self._kinds[line] = type(self.parse(line.decode(SOURCE_ENCODING), source.line).getChild(0))
+            if kind in (CPreprocessorParser.IfdefStatContext, CPreprocessorParser.IfndefStatContext,
+                        CPreprocessorParser.IfStatContext):
+                depth += 1
+            elif kind is CPreprocessorParser.EndifStatContext:
+                if depth == 0:
+                    source.unread_line()
+                    return
+                depth -= 1
+            elif depth == 0 and kind in (CPreprocessorParser.ElifStatContext, CPreprocessorParser.ElseStatContext):
+                source.unread_line()
+                return
+
+
+def _merge_continuation(spans: Tuple[ExpansionSpan, ...], first: int, length: int) -> Tuple[ExpansionSpan, ...]:
+    """
+    跨行的函数宏调用展开后, 把从这次调用开始到行末的部分合并为一次宏调用.
+    其后各行中的记号在第一行中没有对应的列, 因此都记在这次调用的位置.
+
+    Args:
+        spans (Tuple[ExpansionSpan, ...]): 连接后的文本展开的各次宏调用
+        first (int): 第一行的长度
+        length (int): 展开后的文本长度
+
+    Returns:
+        Tuple[ExpansionSpan, ...]: 合并后的各次宏调用
+    """
+    for i, (out_start, _, in_start, in_end) in enumerate(spans):
+        if in_end > first:
+            return spans[:i] + ((out_start, length, in_start, in_end),)
+    return spans
+
+
 class Listener(CPreprocessorListener):
-    def __init__(self, filepath: str, include_dirs: List[str], macro_define_list: Optional[Dict[str, Optional[str]]] = None):
+    def __init__(self, filepath: str, include_dirs: List[str], macro_define_list: Optional[MacroTable] = None):
         if macro_define_list is None:
-            macro_define_list = dict()
-        # 存放预处理后的代码
-        self.buffer: str = ''
+            macro_define_list = MacroTable()
+        # 存放预处理后尚未取走的行
+        self.buffer: List[SourceLine] = []
         # 此文件的路径
         self.filepath = filepath
         # 头文件寻找目录
@@ -112,21 +519,93 @@ class Listener(CPreprocessorListener):
         # 存放 if else 等宏 block 的栈
         self._if_stack: IfStack = IfStack()
         # 宏定义表
-        self._macro_define_list: Dict[str, str] = macro_define_list
+        self._macro_define_list: MacroTable = macro_define_list
         # 是否跳过此行，不写入文件
         self._is_skip: bool = False
+        # include guard 检测: 0 尚未遇到 guard, 1 在 guard 中, 2 guard 已结束, -1 文件不受 guard 保护
+        self._guard_state: int = 0
+        self._guard_macro: Optional[str] = None
+        # guard 之外的文本是否处于块注释中
+        self._in_comment: bool = False
+        self._pragma_once: bool = False
+        # 函数宏调用跨行时, 已读入的各行连接成的文本, 第一行的行号和长度, 调用结束后一起展开
+        self._unterminated: Optional[Tuple[str, int, int]] = None
 
     def enterLine(self, ctx:CPreprocessorParser.LineContext):
         # 无效 if 块中
         if not self._if_stack.is_valid():
             self._is_skip = True
 
+    def _outside_guard(self) -> None:
+        # guard 之外出现了指令或文本
+        if len(self._if_stack) == 0:
+            self._guard_state = -1
+
+    def _is_blank(self, text: str) -> bool:
+        # 去除注释后是否为空白
+        pos = 0
+        while True:
+            if self._in_comment:
+                end = text.find('*/', pos)
+                if end < 0:
+                    return True
+                self._in_comment = False
+                pos = end + 2
+            rest = text[pos:].lstrip()
+            if not rest or rest.startswith('//'):
+                return True
+            if not rest.startswith('/*'):
+                return False
+            self._in_comment = True
+            pos = len(text) - len(rest) + 2
+
+    def exitText(self, ctx: CPreprocessorParser.TextContext):
+        if len(self._if_stack) == 0 and not self._is_blank(ctx.getText()):
+            self._guard_state = -1
+
     def exitLine(self, ctx: CPreprocessorParser.LineContext):
         if not self._is_skip:
-            self.buffer += ctx.getText()
-            self.buffer += '\n'
+            self._emit(ctx.getText(), ctx.start.line)
         self._is_skip = False
-        pass
+
+    def text_line(self, text: str, line: int = 0) -> None:
+        """
+        处理不以 # 开头的一行, 与经过语法分析得到的 text 行效果相同, 但不需要建立语法树.
+
+        Args:
+            text (str): 不含换行符的一行文本
+            line (int): 行号, 用于报错
+
+        Returns:
+            None
+        """
+        if len(self._if_stack) == 0:
+            if not self._is_blank(text):
+                self._guard_state = -1
+        elif not self._if_stack.is_valid():
+            return
+        self._emit(text, line)
+
+    def _emit(self, text: str, line: int) -> None:
+        # 展开宏并输出一行. 函数宏调用在行末仍未结束时, 与之后的行用空格连接为一行,
+        # 记在调用开始的行上
+        first = None
+        if self._unterminated is not None:
+            previous, line, first = self._unterminated
+            text = previous + ' ' + text
+            self._unterminated = None
+        try:
+            text, spans = self._macro_define_list.expand_text(text)
+        except UnterminatedCall:
+            self._unterminated = (text, line, len(text) if first is None else first)
+            return
+        except ValueError as e:
+            raise MacroError(str(e), self.filepath, None, line)
+        if first is not None:
+            spans = _merge_continuation(spans, first, len(text))
+        # 不输出空行
+        if text:
+            self.buffer.append(SourceLine(text + '\n', self.filepath, line, spans))
 
     def exitDefineStat(self, ctx: CPreprocessorParser.DefineStatContext):
         # WS? '#define' WS macroID restOfLine?
@@ -134,55 +613,139 @@ class Listener(CPreprocessorListener):
             return
         # 增加宏
         self._is_skip = True
-        m = ctx.macroID().getText()
-        self._macro_define_list[m] = ctx.restOfLine().getText() if ctx.restOfLine() is not None else ''
+        self._outside_guard()
+        definition = ctx.macroID().getText()
+        if ctx.restOfLine() is not None:
+            definition += ' ' + ctx.restOfLine().getText()
+        try:
+            self._macro_define_list.define(parse_macro(definition))
+        except ValueError as e:
+            raise MacroError(str(e), self.filepath, ctx)
 
     def exitUndefStat(self, ctx: CPreprocessorParser.UndefStatContext):
         if self._is_skip:
             return
         # 删除宏
         self._is_skip = True
+        self._outside_guard()
         m = ctx.macroID().getText()
-        del(self._macro_define_list[m])
+        self._macro_define_list.undefine(m)
 
     def exitIncludeCur(self, ctx: CPreprocessorParser.IncludeCurContext):
+        # #include "..." 先在当前文件所在目录中查找
+        self._include(ctx, (os.path.dirname(self.filepath) or os.curdir, *self._include_dirs))
+
+    def enterIncludeSys(self, ctx: CPreprocessorParser.IncludeSysContext):
+        self._include(ctx, tuple(self._include_dirs))
+
+    def _include(self, ctx: CPreprocessorParser.IncludeStatContext, search_dirs: Tuple[str, ...]) -> None:
         if self._is_skip:
             return
         self._is_skip = True
+        self._outside_guard()
         filename: str = ctx.filename().getText()
-        for include_dir in self._include_dirs:
-            filepath: str = include_dir + separator + filename
-            if os.path.exists(filepath):
-                self.buffer += preprocess(filepath, self._include_dirs, self._macro_define_list)
-                return
-        raise MacroError('头文件未找到', self.filepath, ctx)
-
-    def enterIncludeSys(self, ctx: CPreprocessorParser.IncludeSysContext):
-        # TODO: 目前和 exitIncludeCur 一样
-        self.exitIncludeCur(ctx)
+        filepath = include_resolver.resolve(filename, search_dirs)
+        if filepath is None:
+            raise MacroError('头文件未找到', self.filepath, ctx)
+        guard = include_guards.get(filepath)
+        if guard is not None and self._macro_define_list.is_defined(guard):
+            # 受 guard 保护且已经包含过
+            return
+        self.buffer.extend(header_cache.preprocess(filepath, self._include_dirs, self._macro_define_list))
 
     def exitIfdefStat(self, ctx: CPreprocessorParser.IfdefStatContext):
         self._is_skip = True
+        self._outside_guard()
         m = ctx.macroID().getText()
-        self._if_stack.push_ifdef(True if self._macro_define_list.get(m) is not None else False)
+        self._if_stack.push_ifdef(self._macro_define_list.is_defined(m))
 
     def exitIfndefStat(self, ctx: CPreprocessorParser.IfndefStatContext):
         self._is_skip = True
         m = ctx.macroID().getText()
-        self._if_stack.push_ifndef(True if self._macro_define_list.get(m) is None else False)
+        if self._guard_state == 0 and len(self._if_stack) == 0:
+            self._guard_state = 1
+            self._guard_macro = m
+        else:
+            self._outside_guard()
+        self._if_stack.push_ifndef(not self._macro_define_list.is_defined(m))
+
+    def exitIfStat(self, ctx: CPreprocessorParser.IfStatContext):
+        self._is_skip = True
+        self._outside_guard()
+        # 无效块中的条件不求值
+        self._if_stack.push_if(self._if_stack.is_valid() and self._evaluate(ctx))
+
+    def exitElifStat(self, ctx: CPreprocessorParser.ElifStatContext):
+        self._is_skip = True
+        top = self._if_stack.peek()
+        if top is None:
+            raise MacroError('#elif 宏未闭合', self.filepath, ctx)
+        if top[0] == 'else':
+            raise MacroError('#elif 出现在 #else 之后', self.filepath, ctx)
+        if len(self._if_stack) == 1:
+            # guard 的 #elif 分支在 guard 之外
+            self._guard_state = -1
+        self._if_stack.switch('elif', self._if_stack.can_take() and self._evaluate(ctx))
 
     def exitElseStat(self, ctx:CPreprocessorParser.ElseStatContext):
-        # TODO 目前没有 elif，因此逻辑较简单
         self._is_skip = True
-        ret = self._if_stack.pop()
-        if ret is None:
+        top = self._if_stack.peek()
+        if top is None:
             raise MacroError('#else 宏未闭合', self.filepath, ctx)
-        self._if_stack.push_else(True if not ret[1] else False)
+        if top[0] == 'else':
+            raise MacroError('#else 重复出现', self.filepath, ctx)
+        if len(self._if_stack) == 1:
+            # guard 的 #else 分支在 guard 之外
+            self._guard_state = -1
+        self._if_stack.switch('else', True)
 
     def exitEndifStat(self, ctx:CPreprocessorParser.EndifStatContext):
         self._is_skip = True
         if self._if_stack.pop() is None:
             raise MacroError('#endif 宏未闭合', self.filepath, ctx)
+        if len(self._if_stack) == 0 and self._guard_state == 1:
+            self._guard_state = 2
+
+    def _evaluate(self, ctx: Union[CPreprocessorParser.IfStatContext, CPreprocessorParser.ElifStatContext]) -> bool:
+        try:
+            return condition_cache.evaluate(ctx.restOfLine().getText(), self._macro_define_list)
+        except ValueError as e:
+            raise MacroError(str(e), self.filepath, ctx)
+
+    def exitPragmaStat(self, ctx: CPreprocessorParser.PragmaStatContext):
+        # 只支持 #pragma once, 其余 pragma 被忽略
+        if self._is_skip:
+            return
+        self._is_skip = True
+        if ctx.restOfLine().getText().strip() == 'once':
+            self._pragma_once = True
+            self._macro_define_list.define(Macro(IncludeGuards.pragma_once_macro(self.filepath), ''))
+
+    @property
+    def include_guard(self) -> Optional[str]:
+        """
+        文件的 include guard 宏名, 文件不受保护时为 None.
+        """
+        if self._pragma_once:
+            return IncludeGuards.pragma_once_macro(self.filepath)
+        if self._guard_state == 2:
+            return self._guard_macro
+        return None
+
+    def finish(self) -> None:
+        """
+        文件结束时检查是否有未结束的函数宏调用.
+
+        Raises:
+            MacroError: 函数宏调用缺少右括号
+        """
+        if self._unterminated is not None:
+            text, line, _ = self._unterminated
+            self._unterminated = None
+            try:
+                self._macro_define_list.expand_text(text)
+            except ValueError as e:
+                raise MacroError(str(e), self.filepath, None, line)
 
     @property
     def if_stack(self):
@@ -193,14 +756,42 @@ class Listener(CPreprocessorListener):
         return self._macro_define_list
 
 
-def preprocess(filepath: str, include_dirs: List[str], macro_define_list: Optional[Dict[str, Optional[str]]] = None) -> str:
+def header_prefix(filepath: str) -> List[str]:
+    """
+    文件开头的头文件部分: 从文件开头到最后一个 #include 为止, 其中只有 #include, 空行和 // 注释.
+
+    Args:
+        filepath (str): 文件路径
+
+    Returns:
+        List[str]: 这部分的各行, 文件不以 #include 开头时为空
+    """
+    lines = []
+    count = 0
+    with SourceFile(filepath) as source:
+        while True:
+            line = source.next_line()
+            if line is None:
+                break
+            text = line.strip()
+            if INCLUDE_PATTERN.match(text):
+                count = source.line
+            elif text and not text.startswith(b'//'):
+                break
+            lines.append(line.decode(SOURCE_ENCODING))
+    return lines[:count]
+
+
+def preprocess(filepath: str, include_dirs: List[str],
+               macro_define_list: Union[Dict[str, Optional[str]], MacroTable, None] = None) -> str:
     """
     预处理 .c 文件.
 
     Args:
         filepath (str): 文件的路径地址
         include_dirs (List[str]): 头文件目录
-        macro_define_list (Dict[str, str]): 预先定义的宏，默认为 None
+        macro_define_list (Union[Dict[str, Optional[str]], MacroTable]): 预先定义的宏，默认为 None.
+            传入 MacroTable 时，文件中的宏定义会写入该表
 
     Returns:
         str: 预处理后的文本
@@ -209,54 +800,72 @@ def preprocess(filepath: str, include_dirs: List[str], macro_define_list: Option
         MacroError:
             宏处理的错误
     """
-    lexer = CPreprocessorLexer(FileStream(filepath))
-    stream = CommonTokenStream(lexer)
-    parser = CPreprocessorParser(stream)
-    parser.removeErrorListeners()
-    # errorListener = SyntaxErrorListener()
-    # parser.addErrorListener(errorListener)
+    return ''.join(preprocess_lines(filepath, include_dirs, macro_define_list))
 
-    listener = Listener(filepath, include_dirs, macro_define_list)
-    tree = parser.macro()
-    walker = ParseTreeWalker()
-    walker.walk(listener, tree)
-    if len(listener.if_stack) != 0:
-        raise MacroError('缺少 #endif 宏', filepath, None)
 
-    output_data = listener.buffer
-    output_data = macro_replace(output_data, listener.macro_define_list)
-    output_data = remove_redundant_carriage(output_data)
-    return output_data
+def preprocess_lines(filepath: str, include_dirs: List[str],
+                     macro_define_list: Union[Dict[str, Optional[str]], MacroTable, None] = None,
+                     start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """
+    预处理 .c 文件, 逐行产生预处理后的文本. 每行以 '\\n' 结尾，空行不会产生.
 
+    参数与 preprocess_source 相同.
 
-def macro_replace(text: str, macro_list: Dict[str, Optional[str]]) -> str:
-    """
-    替换宏.
-
-    :param text: 原来的文本
-    :type text: str
-    :param macro_list: 宏表
-    :type macro_list: Dict[str, str]
-    :return: 替换后的文本
-    :rtype: str
+    Returns:
+        Iterator[str]: 预处理后的各行
     """
-    result = text
-    for (k, v) in macro_list.items():
-        result = result.replace(k, v if v is not None else '')
-    return result
+    for line in preprocess_source(filepath, include_dirs, macro_define_list, start, stop):
+        yield line.text
 
 
-def remove_redundant_carriage(text: str) -> str:
+def preprocess_source(filepath: str, include_dirs: List[str],
+                      macro_define_list: Union[Dict[str, Optional[str]], MacroTable, None] = None,
+                      start: int = 0, stop: Optional[int] = None) -> Iterator[SourceLine]:
     """
-    去除多余的换行.
+    预处理 .c 文件, 逐行产生预处理后的文本及其来源文件和行号. 空行不会产生.
+
+    前三个参数与 preprocess 相同. 宏错误在迭代到出错的行时抛出.
+
+    Args:
+        start (int): 从文件的第几行 (从 0 开始) 开始处理
+        stop (Optional[int]): 处理到第几行之前为止, 默认处理到文件末尾
 
-    :param text: 文本
-    :type text: str
-    :return: 处理后的文本
-    :rtype: str
+    Returns:
+        Iterator[SourceLine]: 预处理后的各行
     """
-    return re.sub('(\r?\n)+', '\n', text)
+    if not isinstance(macro_define_list, MacroTable):
+        macro_define_list = MacroTable(macro_define_list)
 
+    listener = Listener(filepath, include_dirs, macro_define_list)
+    directive_parser = DirectiveParser()
+    walker = ParseTreeWalker()
+    buffer = listener.buffer
+    if_stack = listener.if_stack
+    with SourceFile(filepath) as source:
+        mtime = os.fstat(source.fileno()).st_mtime_ns
+        while source.line < start and source.next_line() is not None:
+            pass
+        while stop is None or source.line < stop:
+            line = source.next_line()
+            if line is None:
+                break
+            if line.lstrip(b' \t').startswith(b'#'):
+                # 只有指令行才需要语法分析
+                walker.walk(listener, directive_parser.parse(line.decode(SOURCE_ENCODING), source.line))
+                if not if_stack.is_valid():
+                    # 直接跳到结束无效块的指令
+                    directive_parser.skip_inactive(source, stop)
+            else:
+                listener.text_line(line.decode(SOURCE_ENCODING), source.line)
+            if buffer:
+                yield from buffer
+                buffer.clear()
+        whole_file = start == 0 and source.at_end()
+    listener.finish()
+    if len(listener.if_stack) != 0:
+        raise MacroError('缺少 #endif 宏', filepath, None)
+    if whole_file and listener.include_guard is not None:
+        include_guards.add(filepath, mtime, listener.include_guard)
 
 if __name__ == '__main__':
     print(preprocess(sys.argv[1], ['H:\\github\\c-compiler\\src\\test',
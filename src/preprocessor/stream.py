@@ -0,0 +1,178 @@
+from antlr4 import InputStream, Token
+
+import sys
+import mmap
+import re
+from bisect import bisect_right
+from typing import Iterable, List, Optional
+
+# 与 CPreprocessor.g4 中的 NL 相同
+NEWLINE_PATTERN = re.compile(rb'\r\n|\r|\n')
+
+
+class LineInputStream(InputStream):
+    """
+    按行读取预处理结果的字符流, 可直接作为 CLexer 的输入.
+
+    InputStream 需要完整的文本并把它转换为码点列表; 这里只保存预处理产生的各行，
+    并且在词法分析器读到时才从迭代器中取出下一行，因此文本在内存中只有一份.
+    """
+
+    def __init__(self, lines: Iterable[str], name: str = '<preprocessed>'):
+        self.name = name
+        self.strdata = None
+        self.data = None
+        self._index = 0
+        self._size = 0
+        self._source = iter(lines)
+        # 已读取的行及其在文本中的起始位置
+        self._lines: List[str] = []
+        self._offsets: List[int] = []
+        # 最近访问的行
+        self._line: str = ''
+        self._line_start: int = 0
+
+    def _load(self, pos: int) -> bool:
+        """
+        读取新的行直到 pos 处的字符可用.
+
+        Returns:
+            bool: pos 是否在文本范围内
+        """
+        while pos >= self._size:
+            line = next(self._source, None)
+            if line is None:
+                return False
+            if line:
+                self._lines.append(line)
+                self._offsets.append(self._size)
+                self._size += len(line)
+        return True
+
+    def _char(self, pos: int) -> int:
+        if pos >= self._size and not self._load(pos):
+            return Token.EOF
+        i = bisect_right(self._offsets, pos) - 1
+        self._line = self._lines[i]
+        self._line_start = self._offsets[i]
+        return ord(self._line[pos - self._line_start])
+
+    def consume(self):
+        if self._index >= self._size and not self._load(self._index):
+            raise Exception("cannot consume EOF")
+        self._index += 1
+
+    def LA(self, offset: int):
+        if offset == 0:
+            return 0  # undefined
+        if offset < 0:
+            offset += 1
+        pos = self._index + offset - 1
+        if pos < 0:
+            return Token.EOF
+        column = pos - self._line_start
+        if 0 <= column < len(self._line):
+            return ord(self._line[column])
+        return self._char(pos)
+
+    def seek(self, _index: int):
+        if _index > self._size:
+            self._load(_index - 1)
+        super().seek(_index)
+
+    def getText(self, start: int, stop: int):
+        if stop >= self._size:
+            self._load(stop)
+            stop = min(stop, self._size - 1)
+        if start > stop:
+            return ""
+        first = bisect_right(self._offsets, start) - 1
+        last = bisect_right(self._offsets, stop) - 1
+        if first == last:
+            offset = self._offsets[first]
+            return self._lines[first][start - offset:stop - offset + 1]
+        parts = [self._lines[first][start - self._offsets[first]:]]
+        parts.extend(self._lines[first + 1:last])
+        parts.append(self._lines[last][:stop - self._offsets[last] + 1])
+        return ''.join(parts)
+
+    def get_line(self, line: int) -> Optional[str]:
+        """
+        获得已读取的第 line 行 (从 1 开始), 不含换行符. 要求每个输入项恰好是一行.
+        """
+        if 1 <= line <= len(self._lines):
+            return self._lines[line - 1].rstrip('\r\n')
+        return None
+
+    def __str__(self):
+        self._load(sys.maxsize)
+        return ''.join(self._lines)
+
+
+class SourceFile:
+    """
+    以内存映射的方式按行读取源文件.
+
+    文件内容不会被整体读入或解码; 每次只切出一行的字节, 由调用者决定是否解码.
+    行的划分与 CPreprocessor.g4 相同: 最后一个换行符之后的部分也是一行 (可能为空).
+    """
+    __slots__ = ('_file', '_data', '_pos', '_line_start', 'line')
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件不能映射
+            self._data = b''
+        # 下一行的起始位置, 超过文件长度表示已读完
+        self._pos: int = 0
+        self._line_start: int = 0
+        # 已读取的行数
+        self.line: int = 0
+
+    def __enter__(self) -> 'SourceFile':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def next_line(self) -> Optional[bytes]:
+        """
+        读取下一行.
+
+        Returns:
+            Optional[bytes]: 不含换行符的一行, 文件已读完时为 None
+        """
+        pos = self._pos
+        data = self._data
+        if pos > len(data):
+            return None
+        m = NEWLINE_PATTERN.search(data, pos)
+        if m is None:
+            line = data[pos:]
+            self._pos = len(data) + 1
+        else:
+            line = data[pos:m.start()]
+            self._pos = m.end()
+        self._line_start = pos
+        self.line += 1
+        return line
+
+    def unread_line(self) -> None:
+        """
+        退回最近读取的一行, 下次 next_line 时再次得到它. 只能退回一行.
+        """
+        self._pos = self._line_start
+        self.line -= 1
+
+    def at_end(self) -> bool:
+        return self._pos > len(self._data)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+--lazy-functions 的回归测试. 在 src 目录下运行:
+
+    python test/lazy_functions.py
+
+每个用例用 main.py 分别以默认方式和 --lazy-functions 编译同一个 C 文件, 两者应当同时成功,
+或者报告同样的错误: 延迟生成的函数体只能看到定义之前的全局名字.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+from typing import List, Optional, Tuple
+
+# 用例名, 源文件, 期望的错误 (为 None 时应当编译成功)
+CASES: List[Tuple[str, str, Optional[str]]] = [
+    ('function defined later',
+     'int f() { return g(); }\nint g() { return 1; }\nint main() { return f(); }\n',
+     'Undefined identifier: g'),
+    ('function declared earlier',
+     'int g();\nint f() { return g(); }\nint g() { return 1; }\nint main() { return f(); }\n',
+     None),
+    ('global variable declared later',
+     'int f() { return x; }\nint x;\nint main() { return f(); }\n',
+     'Undefined identifier: x'),
+    ('struct tag declared later',
+     'int f() { struct S s; s.a = 1; return s.a; }\nstruct S { int a; };\nint main() { return f(); }\n',
+     'Undefined identifier: struct S'),
+    ('typedef declared later',
+     'int f() { T t; t = 1; return t; }\ntypedef int T;\nint main() { return f(); }\n',
+     'Undefined type: T'),
+    ('local shadows global declared later',
+     'int f() { int g; g = 1; return g; }\nint g() { return 1; }\nint main() { return f(); }\n',
+     None),
+]
+
+
+def compile_source(directory: str, args: List[str]) -> Tuple[bool, str]:
+    source = os.path.join(directory, 'lazy.c')
+    output = os.path.join(directory, 'lazy.ll')
+    if os.path.exists(output):
+        os.remove(output)
+    main = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+    result = subprocess.run([sys.executable, main, '-o', output] + args + [source],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return result.returncode == 0 and os.path.exists(output), result.stdout
+
+
+def run_case(directory: str, name: str, text: str, expected: Optional[str]) -> bool:
+    with open(os.path.join(directory, 'lazy.c'), 'w') as f:
+        f.write(text)
+    ok = True
+    for args in [], ['--lazy-functions']:
+        success, output = compile_source(directory, args)
+        if 'Traceback' in output:
+            ok = False
+        elif expected is None:
+            ok = ok and success
+        else:
+            ok = ok and not success and expected in output
+        if not ok:
+            print(output[-2000:])
+            break
+    print('{}: {}'.format(name, 'ok' if ok else 'FAILED'))
+    return ok
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run_case(directory, *case) for case in CASES]
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+比较 RegexTokenSource 与 CLexer 的记号. 在 src 目录下运行:
+
+    python test/lexers.py
+
+test 目录下的每个 C 文件预处理之后分别由两者分析, 每个记号的类型, 文本, 行号, 列号和起止位置都应当相同;
+遇到词法错误时, 报错的位置也应当相同. 此外还比较了几段覆盖各种记号的文本.
+"""
+
+import glob
+import os
+import sys
+
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from antlr4 import InputStream  # noqa: E402
+from antlr4.Token import Token  # noqa: E402
+
+from compiler.errors import CompilationError  # noqa: E402
+from compiler.parser.CLexer import CLexer  # noqa: E402
+from compiler.token_source import RegexTokenSource  # noqa: E402
+from preprocessor import preprocess_source, MacroTable  # noqa: E402
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+INCLUDE_DIRS = [os.path.join(TEST_DIR, 'libc', 'include'), os.path.join(TEST_DIR, 'windows', 'include')]
+MACROS = {'_WIN64': None}
+
+# 用例名, 文本
+TEXTS: List[Tuple[str, str]] = [
+    ('numbers', 'int x = 0x1F + 017 + 1.5 + .5e-3f + 1e10 + 10UL + 09 + 0x1p-3;\n'),
+    ('strings and characters', 'char *s = "a\\n\\"b" L"w"; char c = \'\\x41\' + \'\\\'\';\n'),
+    ('operators', 'a ... -> ->* >>= <<= >> << ++ -- && || <= >= == != += -= *= /= %= &= ^= |= ? : ; ~ !\n'),
+    ('comments', 'a /* b\n c */ d // e\n\tf /**/ g\n'),
+    ('lexical error', 'int x;\n  int y = `;\n'),
+    ('unterminated string', 'int x;\n char *s = "bad\n'),
+]
+
+
+class RaisingCLexer(CLexer):
+    """
+    遇到词法错误时抛出 CompilationError 的 CLexer, 与 RegexTokenSource 的行为一致.
+    """
+
+    def notifyListeners(self, e):
+        raise CompilationError('token recognition error', self._tokenStartLine, self._tokenStartColumn)
+
+
+def tokens(source) -> List[tuple]:
+    result = []
+    try:
+        while True:
+            token = source.nextToken()
+            result.append((token.type, token.text, token.line, token.column, token.start, token.stop))
+            if token.type == Token.EOF:
+                return result
+    except CompilationError as e:
+        return result + [('error', e.line, e.column)]
+
+
+def run_case(name: str, text: str) -> bool:
+    expected = tokens(RaisingCLexer(InputStream(text)))
+    actual = tokens(RegexTokenSource(text.splitlines(True)))
+    ok = actual == expected
+    print('{}: {}'.format(name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        for i, (x, y) in enumerate(zip(actual, expected)):
+            if x != y:
+                print('token {}: regex {}, antlr {}'.format(i, x, y))
+                break
+        else:
+            print('regex {} tokens, antlr {} tokens'.format(len(actual), len(expected)))
+    return ok
+
+
+def main() -> int:
+    cases = []
+    for filepath in sorted(glob.glob(os.path.join(TEST_DIR, '*.c'))):
+        lines = preprocess_source(filepath, INCLUDE_DIRS, MacroTable(MACROS))
+        cases.append((os.path.basename(filepath), ''.join(line.text for line in lines)))
+    results = [run_case(name, text) for name, text in cases + TEXTS]
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
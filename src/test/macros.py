@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+宏展开的回归测试. 在 src 目录下运行:
+
+    python test/macros.py
+
+每个用例把一段源文件预处理, 与期望的输出比较 (忽略空白的差别). 期望的输出与符合标准的预处理器 (例如 gcc -E) 相同.
+"""
+
+import os
+import re
+import sys
+import tempfile
+
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessor import preprocess  # noqa: E402
+from preprocessor.errors import MacroError  # noqa: E402
+
+# 用例名, 源文件, 期望的输出 (以 'MacroError' 开头时应当报告该错误)
+CASES: List[Tuple[str, str, str]] = [
+    ('self reference',
+     '#define foo foo + 1\nfoo\n',
+     'foo + 1'),
+    ('self reference through an argument',
+     '#define foo foo + 1\n#define F(x) x\nF(foo)\n',
+     'foo + 1'),
+    ('self reference through nested arguments',
+     '#define foo foo + 1\n#define F(x) x\n#define G(x) F(x)\nG(foo) F(F(foo))\n',
+     'foo + 1 foo + 1'),
+    ('mutual reference through an argument',
+     '#define AA BB\n#define BB AA\n#define F(x) x\nAA F(AA) F(BB)\n',
+     'AA AA BB'),
+    ('function-like self reference',
+     '#define f(a) a*g\n#define g(a) f(a)\nf(2)(9)\n',
+     '2*9*g'),
+    ('call spanning lines',
+     '#define N 3\n#define ADD(a, b) ((a) + (b))\nint x = ADD(N,\n    4);\n',
+     'int x = ((3) + (4));'),
+    ('nested call spanning several lines',
+     '#define ADD(a, b) ((a) + (b))\nint y = ADD(ADD(1,\n  2),\n\n  3) + ADD(5, 6\n); int z;\n',
+     'int y = ((((1) + (2))) + (3)) + ((5) + (6)); int z;'),
+    ('call spanning lines around a directive',
+     '#define ADD(a, b) ((a) + (b))\nint x = ADD(1,\n#define N 2\n  N);\n',
+     'int x = ((1) + (2));'),
+    ('unterminated call',
+     '#define ADD(a, b) ((a) + (b))\nint x = ADD(1,\n  2;\n',
+     'MacroError'),
+]
+
+
+def normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def run_case(directory: str, name: str, text: str, expected: str) -> bool:
+    source = os.path.join(directory, 'macros.c')
+    with open(source, 'w') as f:
+        f.write(text)
+    try:
+        output = normalize(preprocess(source, []))
+    except MacroError as e:
+        output = 'MacroError: ' + str(e)
+    if expected == 'MacroError':
+        ok = output.startswith(expected)
+    else:
+        ok = output == normalize(expected)
+    print('{}: {}'.format(name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        print('expected: ' + expected)
+        print('actual:   ' + output)
+    return ok
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run_case(directory, *case) for case in CASES]
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
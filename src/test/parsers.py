@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+比较 FastParser 与 CParser 的语法树. 在 src 目录下运行:
+
+    python test/parsers.py
+
+test 目录下的每个 C 文件预处理之后分别用 --parser=antlr 和 --parser=fast 分析, 两棵树转换为 Node
+(不折叠任何结点) 之后应当完全相同: 各结点的类, 规则, 标签, 子结点, 以及每个记号的类型, 文本, 行号, 列号和来源文件.
+整个文件的分析 (parse) 和逐个外部声明的分析 (parse_external_declarations, 即 --stream) 都做比较.
+"""
+
+import glob
+import os
+import sys
+
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiler.compiler import make_token_source, parse, parse_external_declarations  # noqa: E402
+from compiler.syntax_tree import Leaf, Node, lower  # noqa: E402
+from preprocessor import preprocess_source, header_cache, MacroTable  # noqa: E402
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+INCLUDE_DIRS = [os.path.join(TEST_DIR, 'libc', 'include'), os.path.join(TEST_DIR, 'windows', 'include')]
+MACROS = {'_WIN64': None}
+
+
+def describe(node) -> tuple:
+    # 结点本身 (不含子结点) 的描述. 标签用它在子结点中的下标表示
+    if isinstance(node, Leaf):
+        return 'leaf', node.type, node.text, node.line, node.column, node.filepath
+    labels = tuple((label, None if getattr(node, label) is None else
+                    next(i for i, child in enumerate(node.children) if child is getattr(node, label)))
+                   for label in type(node).__slots__)
+    return type(node).__name__, node.rule.__name__, len(node.children), labels
+
+
+def difference(a: Node, b: Node) -> Optional[str]:
+    """
+    比较两棵树, 返回第一个不同之处的描述, 相同时返回 None. 用显式的栈, 很深的树也不会超过递归深度限制.
+    """
+    stack = [(a, b)]
+    while stack:
+        x, y = stack.pop()
+        if describe(x) != describe(y):
+            start = x if isinstance(x, Leaf) else x.start
+            return 'line {}: antlr {}, fast {}'.format(start.line, describe(x), describe(y))
+        if isinstance(x, Node):
+            stack.extend(zip(reversed(x.children), reversed(y.children)))
+    return None
+
+
+def parse_file(filepath: str, parser: str, stream: bool) -> List[Node]:
+    header_cache.clear()
+    token_source = make_token_source(preprocess_source(filepath, INCLUDE_DIRS, MacroTable(MACROS)), 'preprocessor')
+    if stream:
+        return [lower(tree) for tree in parse_external_declarations(token_source, None, parser)]
+    return [lower(parse(token_source, None, parser))]
+
+
+def run_case(filepath: str, stream: bool) -> bool:
+    name = os.path.basename(filepath) + (' (stream)' if stream else '')
+    expected = parse_file(filepath, 'antlr', stream)
+    actual = parse_file(filepath, 'fast', stream)
+    if len(actual) != len(expected):
+        message = 'antlr {} trees, fast {} trees'.format(len(expected), len(actual))
+    else:
+        message = next(filter(None, map(difference, expected, actual)), None)
+    print('{}: {}'.format(name, 'ok' if message is None else 'FAILED'))
+    if message is not None:
+        print(message)
+    return message is None
+
+
+def main() -> int:
+    results = []
+    for filepath in sorted(glob.glob(os.path.join(TEST_DIR, '*.c'))):
+        for stream in False, True:
+            results.append(run_case(filepath, stream))
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+很长的 else if 链, 表达式和列表的压力测试. 在 src 目录下运行:
+
+    python test/stress.py
+
+每个用例生成一个 C 文件, 以默认的递归深度限制用 main.py 编译. 编译应当成功;
+CParser 是递归下降的分析器, 无法分析很长的 else if 链, 此时应当报告语法错误而不是出现 Python 的异常.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+from typing import Callable, List, Tuple
+
+# 链或列表的长度
+N = 10000
+
+
+def else_if_chain(n: int) -> str:
+    arms = ' else '.join('if (x == {0}) {{ y = {0}; }}'.format(i) for i in range(n))
+    return 'int f(int x) {{ int y; y = -1; {} else {{ y = 0; }} return y; }}\n'.format(arms)
+
+
+def additive_chain(n: int) -> str:
+    return 'int f(int x) {{ return {}; }}\n'.format(' + '.join('x' if i % 2 else str(i) for i in range(n)))
+
+
+def logical_or_chain(n: int) -> str:
+    return 'int f(int x) {{ return {}; }}\n'.format(' || '.join('x == {}'.format(i) for i in range(n)))
+
+
+def logical_and_chain(n: int) -> str:
+    return 'int f(int x) {{ return {}; }}\n'.format(' && '.join('x != {}'.format(i) for i in range(n)))
+
+
+def struct_declarator_list(n: int) -> str:
+    members = ', '.join('a{}'.format(i) for i in range(n))
+    return 'struct S {{ int {}; }};\nint f() {{ struct S s; s.a{} = 1; return s.a{}; }}\n'.format(members, n - 1, n - 1)
+
+
+def struct_declaration_list(n: int) -> str:
+    members = ' '.join('int a{};'.format(i) for i in range(n))
+    return 'struct S {{ {} }};\nint f() {{ struct S s; s.a{} = 1; return s.a{}; }}\n'.format(members, n - 1, n - 1)
+
+
+def parameter_and_argument_list(n: int) -> str:
+    params = ', '.join('int p{}'.format(i) for i in range(n))
+    args = ', '.join(str(i) for i in range(n))
+    return 'int g({}) {{ return p{}; }}\nint f() {{ return g({}); }}\n'.format(params, n - 1, args)
+
+
+def init_declarator_list(n: int) -> str:
+    return 'int f() {{ int {}; a0 = 1; return a0; }}\n'.format(', '.join('a{}'.format(i) for i in range(n)))
+
+
+def initializer_list(n: int) -> str:
+    return 'int f() {{ int a[{}] = {{ {} }}; return a[0]; }}\n'.format(n, ', '.join(str(i) for i in range(n)))
+
+
+def enumerator_list(n: int) -> str:
+    return 'enum E {{ {} }};\nint f() {{ return E{}; }}\n'.format(', '.join('E{}'.format(i) for i in range(n)), n - 1)
+
+
+# 用例名, 生成源文件的函数, 额外的命令行参数, 期望的输出 (为 None 时应当编译成功)
+CASES: List[Tuple[str, Callable[[int], str], List[str], str]] = [
+    ('else-if chain (fast)', else_if_chain, ['--parser=fast'], None),
+    ('else-if chain (fast, stream)', else_if_chain, ['--parser=fast', '--stream'], None),
+    ('else-if chain (antlr)', else_if_chain, [], 'Syntax Error: nesting too deep for the ANTLR parser'),
+    ('+ chain', additive_chain, [], None),
+    ('|| chain', logical_or_chain, ['--parser=fast'], None),
+    ('&& chain', logical_and_chain, ['--parser=fast'], None),
+    ('struct declarator list', struct_declarator_list, ['--parser=fast'], None),
+    ('struct declaration list', struct_declaration_list, [], None),
+    ('parameter and argument lists', parameter_and_argument_list, ['--parser=fast'], None),
+    ('init declarator list', init_declarator_list, ['--parser=fast'], None),
+    ('initializer list', initializer_list, ['--parser=fast'], None),
+    ('enumerator list', enumerator_list, ['--parser=fast'], None),
+]
+
+
+def run_case(directory: str, name: str, generate: Callable[[int], str], args: List[str], expected: str) -> bool:
+    source = os.path.join(directory, 'stress.c')
+    output = os.path.join(directory, 'stress.ll')
+    with open(source, 'w') as f:
+        f.write(generate(N))
+    if os.path.exists(output):
+        os.remove(output)
+    main = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+    result = subprocess.run([sys.executable, main, '-o', output] + args + [source],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if 'Traceback' in result.stdout:
+        ok = False
+    elif expected is None:
+        ok = result.returncode == 0 and os.path.exists(output)
+    else:
+        ok = result.returncode != 0 and expected in result.stdout
+    print('{}: {}'.format(name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        print(result.stdout[-2000:])
+    return ok
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run_case(directory, *case) for case in CASES]
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())